@@ -0,0 +1,117 @@
+"""
+Explicit lifecycle for the server's background subsystems.
+
+Importing a module under pi/ does not start threads, open serial ports,
+create files or load models. create_app() in main.py imports the modules
+of the enabled subsystems, registers their blueprints and hands their
+start/stop functions to a ServiceManager. start() runs them in order and
+stop() runs them in reverse.
+
+Each import and each start is timed, and the resident memory it added is
+recorded, so cold start time and per-worker memory can be tracked:
+
+    python main.py --profile
+"""
+
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Peak RSS is the best portable fallback (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Service:
+    __slots__ = ('name', 'start', 'stop', 'running', 'profile', 'error')
+
+    def __init__(self, name, start=None, stop=None):
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.running = False
+        self.profile = {}
+        self.error = None
+
+
+class ServiceManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._services = []
+        self._import_profile = {}      # name -> {'import_ms', 'import_rss_kb'}
+        self.created_rss = rss_bytes()
+
+    def measure_import(self, name, importer):
+        """Call `importer()` (which imports a subsystem's modules) and record its cost."""
+        t0 = time.perf_counter()
+        rss0 = rss_bytes()
+        module = importer()
+        self._import_profile[name] = {
+            'import_ms': round((time.perf_counter() - t0) * 1000, 1),
+            'import_rss_kb': (rss_bytes() - rss0) // 1024,
+        }
+        return module
+
+    def add(self, name, start=None, stop=None):
+        service = Service(name, start, stop)
+        service.profile.update(self._import_profile.get(name, {}))
+        self._services.append(service)
+        return service
+
+    def start(self):
+        """Start every service not yet running; a failing service is reported and skipped."""
+        with self._lock:
+            for service in self._services:
+                if service.running:
+                    continue
+                t0 = time.perf_counter()
+                rss0 = rss_bytes()
+                try:
+                    if service.start is not None:
+                        service.start()
+                    service.running = True
+                    service.error = None
+                except Exception as e:
+                    service.error = str(e)
+                    print(f"Failed to start {service.name}: {e}")
+                service.profile['start_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+                service.profile['start_rss_kb'] = (rss_bytes() - rss0) // 1024
+
+    def stop(self):
+        with self._lock:
+            for service in reversed(self._services):
+                if not service.running:
+                    continue
+                try:
+                    if service.stop is not None:
+                        service.stop()
+                except Exception as e:
+                    print(f"Failed to stop {service.name}: {e}")
+                service.running = False
+
+    def status(self):
+        return {
+            'rss_kb': rss_bytes() // 1024,
+            'services': [dict(service.profile, name=service.name, running=service.running,
+                              error=service.error) for service in self._services],
+        }
+
+    def report(self):
+        """Startup profile as printable lines."""
+        lines = [f"{'service':<14}{'import ms':>11}{'import KiB':>12}{'start ms':>10}{'start KiB':>11}"]
+        for service in self._services:
+            p = service.profile
+            lines.append(f"{service.name:<14}{p.get('import_ms', 0):>11}{p.get('import_rss_kb', 0):>12}"
+                         f"{p.get('start_ms', 0):>10}{p.get('start_rss_kb', 0):>11}")
+        lines.append(f"RSS {rss_bytes() // 1024} KiB "
+                     f"({(rss_bytes() - self.created_rss) // 1024} KiB since create_app)")
+        return lines
@@ -0,0 +1,104 @@
+"""
+Detection result cache keyed by a perceptual frame hash.
+
+Repeated capture_and_detect calls on an unchanged scene produce nearly
+identical frames (sensor noise, slight exposure drift) but never identical
+bytes, so the cache key is a 64-bit difference hash (dHash) of a tiny
+grayscale thumbnail. Two frames whose hashes differ by at most
+`max_distance` bits are treated as the same scene.
+
+Entries expire after `ttl` seconds and the cache holds at most
+`max_entries` results (least recently used entries are evicted first).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+HASH_SIZE = 8  # 8x8 comparisons -> 64-bit hash
+
+
+def frame_hash(frame, hash_size=HASH_SIZE):
+    """Return the dHash of a BGR/RGB or grayscale frame as an int."""
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    # INTER_AREA averages pixels, which suppresses sensor noise
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DetectionCache:
+    def __init__(self, ttl=300.0, max_entries=16, max_distance=4):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # (namespace, hash) -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _purge_expired(self, now):
+        stale = [k for k, (stored_at, _) in self._entries.items() if now - stored_at > self.ttl]
+        for k in stale:
+            del self._entries[k]
+        self.expired += len(stale)
+
+    def get(self, key, namespace=None):
+        """Return the cached value for a frame hash (or a near match), else None."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            match = (namespace, key) if (namespace, key) in self._entries else None
+            if match is None:
+                best = self.max_distance + 1
+                for ns, h in self._entries:
+                    if ns != namespace:
+                        continue
+                    d = hamming(h, key)
+                    if d < best:
+                        best, match = d, (ns, h)
+            if match is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(match)
+            self.hits += 1
+            return self._entries[match][1]
+
+    def put(self, key, value, namespace=None):
+        with self._lock:
+            self._entries[(namespace, key)] = (time.monotonic(), value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'expired': self.expired,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,234 @@
+"""
+Isolated YOLOv5 inference worker.
+
+Loading torch and the YOLO model inside the Flask process costs several
+hundred MB of RSS per web process and lets a long inference hold the GIL
+while the sensor API is trying to answer. Instead, the model lives in a
+persistent child process started with `python inference_worker.py --fd N`.
+
+Protocol (over a socketpair, one length-prefixed JSON message per call):
+
+    web -> worker  {"op": "detect", "shm": name, "shape": [h, w, 3], "dtype": "uint8", "tiled": false}
+    worker -> web  {"ok": true, "dets": [[x1, y1, x2, y2, conf, cls], ...], "info": {...}, "ms": 812.4}
+                   {"ok": false, "error": "..."}
+
+The frame itself is never serialized: the web process copies it into a
+shared memory block that the worker maps as a numpy array. The first message
+from the worker is {"ready": true, "names": {...}, "conf": 0.3}.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+MODEL_NAME = 'yolov5n'
+CONFIDENCE = 0.3
+STARTUP_TIMEOUT = 300.0   # first start may download the model from Torch Hub
+REQUEST_TIMEOUT = 60.0    # a stalled worker is killed and restarted after this
+
+
+def _send(conn, message):
+    conn.send_bytes(json.dumps(message).encode())
+
+
+def _recv(conn):
+    return json.loads(conn.recv_bytes().decode())
+
+
+def _attach(name):
+    try:
+        # Python >= 3.13: don't let the worker's resource tracker own the block
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Older Pythons register attached blocks too, and would unlink the
+        # web process's buffer when the worker exits
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _worker_main(fd, model_name, conf):
+    import torch
+    from tiled_inference import detect_single, detect_tiled
+
+    conn = Connection(fd)
+    model = torch.hub.load('ultralytics/yolov5', model_name, pretrained=True)
+    model.conf = conf
+    names = model.names if isinstance(model.names, dict) else dict(enumerate(model.names))
+    _send(conn, {'ready': True, 'names': {str(k): v for k, v in names.items()}, 'conf': conf})
+
+    shm = None
+    while True:
+        try:
+            msg = _recv(conn)
+        except EOFError:
+            break
+        if msg.get('op') == 'stop':
+            break
+        if msg.get('op') != 'detect':
+            _send(conn, {'ok': False, 'error': f"unknown op {msg.get('op')!r}"})
+            continue
+        frame = None
+        try:
+            if shm is None or shm.name != msg['shm']:
+                if shm is not None:
+                    shm.close()
+                shm = _attach(msg['shm'])
+            frame = np.ndarray(tuple(msg['shape']), dtype=msg['dtype'], buffer=shm.buf)
+            t0 = time.perf_counter()
+            if msg.get('tiled'):
+                dets, info = detect_tiled(model, frame)
+            else:
+                dets, info = detect_single(model, frame), {}
+            _send(conn, {'ok': True, 'dets': dets, 'info': info,
+                         'ms': round((time.perf_counter() - t0) * 1000.0, 3)})
+        except Exception as e:
+            _send(conn, {'ok': False, 'error': str(e)})
+        finally:
+            # Release the buffer view, also after a failed detection, or
+            # closing the block for the next frame raises BufferError
+            frame = None
+    if shm is not None:
+        shm.close()
+
+
+class InferenceWorker:
+    """Client for the inference worker process; starts it on first use."""
+
+    def __init__(self, model_name=MODEL_NAME, conf=CONFIDENCE,
+                 request_timeout=REQUEST_TIMEOUT, startup_timeout=STARTUP_TIMEOUT):
+        self.model_name = model_name
+        self.conf = conf
+        self.names = {}
+        self.request_timeout = request_timeout
+        self.startup_timeout = startup_timeout
+        self._proc = None
+        self._conn = None
+        self._shm = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.restarts = 0
+        self.last_inference_ms = None
+
+    def _start(self):
+        parent_sock, child_sock = socket.socketpair()
+        child_fd = child_sock.fileno()
+        self._proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--fd', str(child_fd),
+             '--model', self.model_name, '--conf', str(self.conf)],
+            pass_fds=(child_fd,), cwd=os.path.dirname(os.path.abspath(__file__)))
+        child_sock.close()
+        self._conn = Connection(parent_sock.detach())
+        if not self._conn.poll(self.startup_timeout):
+            self._kill()
+            raise RuntimeError("Inference worker did not start in time.")
+        try:
+            hello = _recv(self._conn)
+        except EOFError:
+            self._kill()
+            raise RuntimeError("Inference worker exited during startup.")
+        self.names = {int(k): v for k, v in hello['names'].items()}
+        self.conf = hello['conf']
+        print(f"Inference worker started (pid {self._proc.pid})")
+
+    def _kill(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+    def _alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def _frame_buffer(self, nbytes):
+        if self._shm is None or self._shm.size < nbytes:
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        return self._shm
+
+    def start(self):
+        with self._lock:
+            if not self._alive():
+                self._start()
+
+    def detect(self, frame, tiled=False):
+        """Run detection on a frame; returns (dets, info) like tiled_inference."""
+        with self._lock:
+            if not self._alive():
+                if self._proc is not None:
+                    self.restarts += 1
+                    self._kill()
+                self._start()
+            frame = np.ascontiguousarray(frame)
+            shm = self._frame_buffer(frame.nbytes)
+            np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)[...] = frame
+            self.requests += 1
+            _send(self._conn, {'op': 'detect', 'shm': shm.name, 'shape': list(frame.shape),
+                               'dtype': frame.dtype.str, 'tiled': bool(tiled)})
+            try:
+                ready = self._conn.poll(self.request_timeout)
+                reply = _recv(self._conn) if ready else None
+            except EOFError:
+                reply = None
+            if reply is None:
+                # Stalled or crashed: kill it so the next call starts a fresh worker
+                self.failures += 1
+                self.restarts += 1
+                self._kill()
+                raise RuntimeError("Inference worker timed out or crashed.")
+            if not reply['ok']:
+                self.failures += 1
+                raise RuntimeError(f"Inference failed: {reply['error']}")
+            self.last_inference_ms = reply['ms']
+            return reply['dets'], reply['info']
+
+    def stop(self):
+        with self._lock:
+            if self._alive():
+                try:
+                    _send(self._conn, {'op': 'stop'})
+                    self._proc.wait(timeout=5)
+                except Exception:
+                    pass
+            self._kill()
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+                self._shm = None
+
+    def stats(self):
+        return {
+            'running': self._alive(),
+            'pid': self._proc.pid if self._alive() else None,
+            'model': self.model_name,
+            'requests': self.requests,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'last_inference_ms': self.last_inference_ms,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='YOLOv5 inference worker (started by InferenceWorker)')
+    parser.add_argument('--fd', type=int, required=True)
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--conf', type=float, default=CONFIDENCE)
+    args = parser.parse_args()
+    _worker_main(args.fd, args.model, args.conf)
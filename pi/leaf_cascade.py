@@ -0,0 +1,136 @@
+"""
+Cheap first stage of the leaf detection cascade.
+
+A colour-histogram classifier looks at a small thumbnail of the frame and
+decides between:
+
+- "no_plant":  almost no plant-coloured pixels, nothing for YOLO to find
+- "healthy":   plenty of green and very little yellow/brown
+- "uncertain": anything else; only these frames go to the full detector
+
+It costs a few milliseconds on a Pi, against seconds for YOLOv5n on CPU.
+
+Measure hit rates and latency savings on a folder of local images:
+
+    python leaf_cascade.py test_images/
+"""
+
+import threading
+import time
+
+import cv2
+
+from plant_health_history import colour_fractions
+
+THUMBNAIL_SIZE = (160, 120)
+
+NO_PLANT_MAX_COVERAGE = 0.02     # plant-coloured share below this -> no_plant
+HEALTHY_MIN_GREEN = 0.15         # green share needed to call a frame healthy
+HEALTHY_MAX_DISCOLOURED = 0.08   # yellow+brown share of plant pixels allowed when healthy
+
+DECISIONS = ('no_plant', 'healthy', 'uncertain')
+
+
+def classify(frame):
+    """Classify a BGR frame; returns (decision, colour fractions)."""
+    thumb = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    colours = colour_fractions(thumb)
+    coverage = colours['green_ratio'] + colours['yellow_ratio'] + colours['brown_ratio']
+    if coverage < NO_PLANT_MAX_COVERAGE:
+        return 'no_plant', colours
+    if (colours['green_ratio'] >= HEALTHY_MIN_GREEN
+            and colours['discoloured_ratio'] is not None
+            and colours['discoloured_ratio'] <= HEALTHY_MAX_DISCOLOURED):
+        return 'healthy', colours
+    return 'uncertain', colours
+
+
+class CascadeStats:
+    """Per-decision hit counters for the cascade's first stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {d: 0 for d in DECISIONS}
+
+    def record(self, decision):
+        with self._lock:
+            self.counts[decision] += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                'frames': total,
+                'counts': dict(self.counts),
+                'rates': {d: round(c / total, 3) if total else None for d, c in self.counts.items()},
+                # frames answered without running YOLO
+                'skip_rate': round((total - self.counts['uncertain']) / total, 3) if total else None,
+            }
+
+
+def evaluate(paths, detect):
+    """
+    Run the cascade and the full detector over local images.
+
+    `detect(frame)` returns a detection list. Every image goes through both
+    stages so the report can show what the cascade saved and how many
+    skipped frames the detector would have found something in.
+    """
+    stats = CascadeStats()
+    cascade_s = detector_s = cascaded_total_s = 0.0
+    skipped_with_detections = 0
+    rows = []
+    for path in paths:
+        frame = cv2.imread(str(path))
+        if frame is None:
+            print(f"Skipping unreadable image {path}")
+            continue
+        t0 = time.perf_counter()
+        decision, _ = classify(frame)
+        t1 = time.perf_counter()
+        dets = detect(frame)
+        t2 = time.perf_counter()
+        stats.record(decision)
+        cascade_s += t1 - t0
+        detector_s += t2 - t1
+        cascaded_total_s += (t1 - t0) + ((t2 - t1) if decision == 'uncertain' else 0.0)
+        if decision != 'uncertain' and dets:
+            skipped_with_detections += 1
+        rows.append((str(path), decision, len(dets), (t1 - t0) * 1000, (t2 - t1) * 1000))
+    n = len(rows)
+    report = stats.as_dict()
+    report.update({
+        'mean_cascade_ms': round(cascade_s / n * 1000, 2) if n else None,
+        'mean_detector_ms': round(detector_s / n * 1000, 2) if n else None,
+        'mean_end_to_end_ms_without_cascade': round(detector_s / n * 1000, 2) if n else None,
+        'mean_end_to_end_ms_with_cascade': round(cascaded_total_s / n * 1000, 2) if n else None,
+        'latency_saving': round(1 - cascaded_total_s / detector_s, 3) if detector_s else None,
+        'skipped_frames_with_detections': skipped_with_detections,
+    })
+    return report, rows
+
+
+if __name__ == '__main__':
+    import argparse
+    from pathlib import Path
+
+    from inference_worker import InferenceWorker
+
+    parser = argparse.ArgumentParser(description='Evaluate the colour cascade against YOLOv5n on local images')
+    parser.add_argument('image_dir')
+    args = parser.parse_args()
+
+    image_paths = sorted(p for p in Path(args.image_dir).iterdir()
+                         if p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.bmp'))
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+    worker = InferenceWorker()
+    try:
+        worker.detect(cv2.imread(str(image_paths[0])))  # warm-up
+        summary, per_image = evaluate(image_paths, lambda frame: worker.detect(frame)[0])
+    finally:
+        worker.stop()
+    for path, decision, num_dets, c_ms, d_ms in per_image:
+        print(f"{path}: {decision:<9} detections={num_dets:<3} cascade={c_ms:.1f}ms detector={d_ms:.1f}ms")
+    for key, value in summary.items():
+        print(f"{key}: {value}")
@@ -0,0 +1,282 @@
+"""
+Load test for the sensor API on localhost.
+
+Starts the sensor API in a separate process (so the load generator does
+not share its GIL), with history in a temporary directory and a fake Pico
+writing CSV lines into a pseudo-terminal that the serial ingestion reads.
+Then it runs simulated clients for a fixed duration:
+
+- pollers:  Pico W controllers calling GET /pico/sensors (a new connection
+            per request, like urequests)
+- posters:  Pico W telemetry calling POST /pico/sensors (binary records by
+            default, --json for JSON)
+
+and reports throughput, error rate and latency percentiles per operation.
+
+    python load_test.py --pollers 20 --posters 5 --duration 15
+    python load_test.py --save-baseline baseline.json
+    python load_test.py --baseline baseline.json      # exit 1 on regression
+
+--url runs the clients against an already running server instead.
+"""
+
+import http.client
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+PERCENTILES = (50, 90, 95, 99)
+DEFAULT_TOLERANCE = 0.25      # allowed latency increase over the baseline
+ERROR_RATE_TOLERANCE = 0.01   # allowed error-rate increase over the baseline
+REQUEST_TIMEOUT = 10.0
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+class OpStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+
+    def summary(self, duration):
+        lat = sorted(self.latencies)
+        total = len(lat) + self.errors
+        out = {
+            'requests': total,
+            'errors': self.errors,
+            'error_rate': round(self.errors / total, 4) if total else 0.0,
+            'throughput_rps': round(len(lat) / duration, 1) if duration else None,
+            'statuses': dict(sorted(self.statuses.items())),
+        }
+        for p in PERCENTILES:
+            v = percentile(lat, p)
+            out[f'p{p}_ms'] = round(v * 1000, 2) if v is not None else None
+        out['max_ms'] = round(lat[-1] * 1000, 2) if lat else None
+        return out
+
+
+def _client(host, port, method, path, body_fn, headers, interval, stop, stats, ok_statuses):
+    while not stop.is_set():
+        body = body_fn() if body_fn else None
+        t0 = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=REQUEST_TIMEOUT)
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            elapsed = time.perf_counter() - t0
+            stats.statuses[resp.status] = stats.statuses.get(resp.status, 0) + 1
+            if resp.status in ok_statuses:
+                stats.latencies.append(elapsed)
+            else:
+                stats.errors += 1
+        except (OSError, http.client.HTTPException):
+            stats.errors += 1
+            stats.statuses['conn_error'] = stats.statuses.get('conn_error', 0) + 1
+        if interval:
+            stop.wait(max(0.0, interval - (time.perf_counter() - t0)))
+
+
+def run_load(url, pollers=10, posters=2, duration=10.0, poll_interval=0.0, post_interval=0.0,
+             use_json=False, device='pico'):
+    """Run the simulated clients against `url` and return per-operation summaries."""
+    from sensor_payloads import BINARY_CONTENT_TYPE, encode_binary
+
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    stop = threading.Event()
+    stats = {'get': OpStats(), 'post': OpStats()}
+    counter = iter(range(10 ** 12))
+
+    def post_body():
+        n = next(counter)
+        reading = {'raw': 30000 + n % 5000, 'moisture_percent': 30 + n % 40,
+                   'relay': bool(n % 2), 'ts': int(time.time())}
+        return json.dumps(reading).encode() if use_json else encode_binary(reading)
+
+    post_headers = {'Content-Type': 'application/json' if use_json else BINARY_CONTENT_TYPE,
+                    'X-Device-Id': device}
+    threads = []
+    # Each client records into its own OpStats and they are merged afterwards,
+    # so the clients never contend on a shared lock
+    per_client = []
+    for _ in range(pollers):
+        s = OpStats()
+        per_client.append(('get', s))
+        threads.append(threading.Thread(target=_client, args=(
+            host, port, 'GET', '/pico/sensors', None, {}, poll_interval, stop, s, (200, 304))))
+    for _ in range(posters):
+        s = OpStats()
+        per_client.append(('post', s))
+        threads.append(threading.Thread(target=_client, args=(
+            host, port, 'POST', '/pico/sensors', post_body, post_headers, post_interval, stop, s, (200,))))
+    t0 = time.perf_counter()
+    for t in threads:
+        t.daemon = True
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join(REQUEST_TIMEOUT)
+    elapsed = time.perf_counter() - t0
+    for op, s in per_client:
+        stats[op].latencies += s.latencies
+        stats[op].errors += s.errors
+        for k, v in s.statuses.items():
+            stats[op].statuses[k] = stats[op].statuses.get(k, 0) + v
+    return {op: s.summary(elapsed) for op, s in stats.items() if s.latencies or s.errors}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of regressions of `results` against `baseline`."""
+    problems = []
+    for op, base in baseline.get('results', {}).items():
+        cur = results.get(op)
+        if cur is None:
+            problems.append(f'{op}: missing from this run')
+            continue
+        for key in [f'p{p}_ms' for p in PERCENTILES]:
+            if base.get(key) is None or cur.get(key) is None:
+                continue
+            limit = base[key] * (1 + tolerance)
+            if cur[key] > limit:
+                problems.append(f'{op} {key}: {cur[key]} ms > {limit:.2f} ms '
+                                f'(baseline {base[key]} ms +{tolerance:.0%})')
+        if cur['error_rate'] > base['error_rate'] + ERROR_RATE_TOLERANCE:
+            problems.append(f"{op} error_rate: {cur['error_rate']} > baseline {base['error_rate']}")
+    return problems
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port, store_dir, serial_rate):
+    """Server process: sensor API with a fake Pico on a pseudo-terminal."""
+    import pty
+    import tty
+
+    from werkzeug.serving import make_server
+
+    import main
+    import sensors_data_api
+    from serial_reader import SerialIngest
+
+    app = main.create_app(services=('sensors',))
+    sensors_data_api.start_storage(os.path.join(store_dir, 'sensor_history'),
+                                   os.path.join(store_dir, 'rollups'),
+                                   os.path.join(store_dir, 'sensors.db'))
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    slave_path = os.ttyname(slave)
+    ingest = SerialIngest(lambda p, r: sensors_data_api.record_serial_reading('/dev/ttyACM0', r),
+                          patterns=(), ports=(slave_path,))
+    ingest.start()
+
+    def fake_pico():
+        n = 0
+        while True:
+            os.write(master, f'{20 + n % 10},{40 + n % 20:.1f},{n % 2}\n'.encode())
+            n += 1
+            time.sleep(1.0 / serial_rate)
+
+    if serial_rate > 0:
+        threading.Thread(target=fake_pico, daemon=True).start()
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    print(f'ready on 127.0.0.1:{port}', flush=True)
+    server.serve_forever()
+
+
+def start_server(serial_rate):
+    import tempfile
+
+    port = _free_port()
+    store_dir = tempfile.mkdtemp(prefix='load-test-')
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port),
+                             '--store', store_dir, '--serial-rate', str(serial_rate)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            break
+        if line.startswith('ready'):
+            # Keep draining the server's output so it never blocks on a full pipe
+            threading.Thread(target=proc.stdout.read, daemon=True).start()
+            return proc, store_dir, f'http://127.0.0.1:{port}'
+    proc.kill()
+    shutil.rmtree(store_dir, ignore_errors=True)
+    raise RuntimeError('load test server did not start')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load test the sensor API on localhost')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    parser.add_argument('--pollers', type=int, default=10)
+    parser.add_argument('--posters', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--poll-interval', type=float, default=0.0,
+                        help='seconds between polls per client (0 = back to back)')
+    parser.add_argument('--post-interval', type=float, default=0.0)
+    parser.add_argument('--serial-rate', type=float, default=10.0, help='fake serial lines per second')
+    parser.add_argument('--json', action='store_true', help='post JSON instead of binary records')
+    parser.add_argument('--baseline', help='fail if latency regresses against this baseline file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--save-baseline', help='write the results to this baseline file')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--store', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.store, args.serial_rate)
+        sys.exit(0)
+
+    server = None
+    url = args.url
+    if url is None:
+        server, server_store, url = start_server(args.serial_rate)
+    try:
+        results = run_load(url, args.pollers, args.posters, args.duration,
+                           args.poll_interval, args.post_interval, args.json)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(5)
+            shutil.rmtree(server_store, ignore_errors=True)
+
+    config = {k: getattr(args, k) for k in ('pollers', 'posters', 'duration', 'poll_interval',
+                                            'post_interval', 'serial_rate', 'json')}
+    print(json.dumps({'config': config, 'results': results}, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Latency regression:')
+            for problem in regressions:
+                print(f'  {problem}')
+            sys.exit(1)
+        print('No regression against baseline')
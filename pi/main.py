@@ -1,61 +1,85 @@
-
 # Simple webcam streaming server using Flask and OpenCV
-from flask import Flask, Response, render_template_string
-from prototype_leaf_detection import plant_health_api
-import cv2
-
-app = Flask(__name__)
-
-
-from sensors_data_api import sensors_api
-# Register sensors API blueprint
-app.register_blueprint(sensors_api)
-
-# Register plant health check blueprint
-app.register_blueprint(plant_health_api)
-
-def gen_frames():
-	cap = cv2.VideoCapture(0)
-	if not cap.isOpened():
-		raise RuntimeError("Could not open webcam.")
-	while True:
-		success, frame = cap.read()
-		if not success:
-			break
-		ret, buffer = cv2.imencode('.jpg', frame)
-		frame = buffer.tobytes()
-		yield (b'--frame\r\n'
-			   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
-@app.route('/')
-def index():
-	# Simple HTML page to show the video stream
-	return render_template_string('''
-	<!DOCTYPE html>
-	<html lang="en">
-	<head>
-		<meta charset="UTF-8">
-		<meta name="viewport" content="width=device-width, initial-scale=1.0">
-		<title>Webcam Stream</title>
-		<link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-	</head>
-	<body class="bg-gray-900 min-h-screen flex flex-col items-center justify-center">
-		<div class="bg-white rounded-lg shadow-lg p-8 mt-8 flex flex-col items-center">
-			<h1 class="text-3xl font-bold mb-6 text-gray-800">Webcam Stream</h1>
-			<div class="border-4 border-gray-300 rounded-lg overflow-hidden mb-4">
-				<img src="/video_feed" width="640" height="480" class="block" />
-			</div>
-			<p class="text-gray-600">Live video from your Raspberry Pi webcam.</p>
-		</div>
-		<footer class="mt-8 text-gray-400 text-sm">&copy; 2025 PiCam</footer>
-	</body>
-	</html>
-	''')
-
-@app.route('/video_feed')
-def video_feed():
-	return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+#
+# create_app() builds the Flask app without side effects: subsystems are
+# imported only when enabled and their background work (serial ingestion,
+# history storage, plant health scans) only runs after services.start().
+import atexit
+import importlib
+import sys
+
+from flask import Flask, jsonify
+
+from app_services import ServiceManager
+from metrics import instrument_app, metrics_api
+
+# Subsystems enabled by default; a worker that only serves sensor data can
+# use create_app(services=('sensors',)) and never imports OpenCV
+SERVICES = ('sensors', 'serial', 'rules', 'retention', 'plant_health', 'video')
+
+
+def create_app(services=SERVICES, start=False):
+	app = Flask(__name__)
+	manager = ServiceManager()
+	app.extensions['services'] = manager
+	# Prometheus /metrics and per-route request latency
+	app.register_blueprint(metrics_api)
+	instrument_app(app)
+
+	if 'sensors' in services:
+		sensors = manager.measure_import('sensors', lambda: importlib.import_module('sensors_data_api'))
+		# Register sensors API blueprint
+		app.register_blueprint(sensors.sensors_api)
+		manager.add('sensors', sensors.start_storage, sensors.stop_storage)
+		if 'serial' in services:
+			# Only one process should own the serial ports
+			manager.add('serial', sensors.start_serial, sensors.stop_serial)
+		if 'rules' in services:
+			# Alert rules and webhook delivery
+			manager.add('rules', sensors.start_rules, sensors.stop_rules)
+		if 'retention' in services:
+			# Background compaction and expiry of old history
+			manager.add('retention', sensors.start_retention, sensors.stop_retention)
+
+	if 'plant_health' in services:
+		plant_health = manager.measure_import(
+			'plant_health', lambda: importlib.import_module('prototype_leaf_detection'))
+		# Register plant health check blueprint
+		app.register_blueprint(plant_health.plant_health_api)
+		manager.add('plant_health', plant_health.start, plant_health.stop)
+
+	if 'video' in services:
+		webcam = manager.measure_import('video', lambda: importlib.import_module('pi_webcam_main'))
+		# Dashboard page and MJPEG stream
+		app.register_blueprint(webcam.webcam_api)
+		manager.add('video')
+
+	@app.route('/services')
+	def services_status():
+		return jsonify(manager.status())
+
+	if start:
+		manager.start()
+		atexit.register(manager.stop)
+	return app
+
+
+_app = None
+
+
+def __getattr__(name):
+	# `main:app` (gunicorn, flask --app main) gets a started app, created on
+	# first access so that importing main still has no side effects. Only one
+	# process can own the sensor storage (see sensor_store.LOCK_FILE)
+	global _app
+	if name == 'app':
+		if _app is None:
+			_app = create_app(start=True)
+		return _app
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
+	app = create_app(start=True)
+	if '--profile' in sys.argv:
+		print('\n'.join(app.extensions['services'].report()))
 	app.run(host='0.0.0.0', port=5000, debug=False)
-
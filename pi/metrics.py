@@ -0,0 +1,283 @@
+"""
+Prometheus metrics for the hot paths (GET /metrics, text format 0.0.4).
+
+Counters and histograms are sharded per thread: each thread increments its
+own preallocated slots, so apart from a thread's first value (which
+registers its shard) recording takes no lock and never contends with other
+threads. A scrape sums the shards. Shards of threads that have exited are
+folded into a retired total at every scrape and every REAP_EVERY new
+shards, so the per-request threads of a threaded server do not pile up
+even when nothing scrapes /metrics.
+
+Values that already live elsewhere (serial reader health, device
+staleness, inference worker state) are read at scrape time through
+collector callbacks instead of being counted twice.
+
+    from metrics import metrics
+    FRAMES = metrics.counter('mjpeg_frames_total', 'Frames sent to MJPEG viewers')
+    FRAMES.inc()
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Blueprint, Response
+
+# Seconds; covers sub-millisecond API hits up to multi-second inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+REAP_EVERY = 64       # new shards between foldings of exited threads' shards
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class _Shard:
+    __slots__ = ('thread', 'values')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.values = {}      # metric index -> {label values: list of slots}
+
+
+class Counter:
+    def __init__(self, registry, index, name, help, labelnames):
+        self._registry = registry
+        self._index = index
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount=1, labels=()):
+        slots = self._registry._slots(self._index, labels, 1)
+        slots[0] += amount
+
+    def value(self, labels=()):
+        """Current total across threads (for collectors deriving gauges from counters)."""
+        return self._registry._total(self._index, labels)
+
+    def _merge(self, total, slots):
+        total[0] += slots[0]
+
+    def _render(self, lines, series):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} counter')
+        for labels, slots in sorted(series.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(slots[0])}')
+
+
+class Histogram:
+    def __init__(self, registry, index, name, help, labelnames, buckets):
+        self._registry = registry
+        self._index = index
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # one slot per bucket, then +Inf, then the sum
+        self._size = len(self.buckets) + 2
+
+    def observe(self, value, labels=()):
+        slots = self._registry._slots(self._index, labels, self._size)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def time(self, labels=()):
+        return _Timer(self, labels)
+
+    def _merge(self, total, slots):
+        for i, v in enumerate(slots):
+            total[i] += v
+
+    def _render(self, lines, series):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} histogram')
+        for labels, slots in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), slots[:-1]):
+                cumulative += count
+                le = (('le', _number(float(bound))),)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(float(slots[-1]))}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._local = threading.local()
+        self._shards = []
+        self._registered = 0      # shards registered since the last reap
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()      # guards the shard list, not the counters
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self, len(self._metrics), name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, len(self._metrics), name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """
+        Register `fn()` returning [(name, type, help, [(labels dict, value)])],
+        called on every scrape. Usable as a decorator.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def _slots(self, index, labels, size):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+                self._registered += 1
+                if self._registered >= REAP_EVERY:
+                    self._reap()
+        series = shard.values.get(index)
+        if series is None:
+            series = shard.values[index] = {}
+        slots = series.get(labels)
+        if slots is None:
+            slots = series[labels] = [0] * size
+        return slots
+
+    def _reap(self):
+        # Caller holds _lock
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                # The thread is gone, so nothing writes these slots any more
+                self._fold(self._retired, shard)
+        self._shards = alive
+        self._registered = 0
+
+    def _merged(self):
+        with self._lock:
+            self._reap()
+            shards = [self._retired] + self._shards
+            totals = {}
+            for shard in shards:
+                for index, series in list(shard.values.items()):
+                    metric = self._metrics[index]
+                    out = totals.setdefault(index, {})
+                    for labels, slots in list(series.items()):
+                        total = out.get(labels)
+                        if total is None:
+                            total = out[labels] = [0] * len(slots)
+                        metric._merge(total, slots)
+        return totals
+
+    def _total(self, index, labels):
+        total = 0
+        with self._lock:
+            for shard in [self._retired] + self._shards:
+                slots = shard.values.get(index, {}).get(labels)
+                if slots is not None:
+                    total += slots[0]
+        return total
+
+    def _fold(self, into, shard):
+        for index, series in shard.values.items():
+            target = into.values.setdefault(index, {})
+            for labels, slots in series.items():
+                total = target.get(labels)
+                if total is None:
+                    total = target[labels] = [0] * len(slots)
+                self._metrics[index]._merge(total, slots)
+
+    def render(self):
+        lines = []
+        totals = self._merged()
+        for index, metric in enumerate(self._metrics):
+            metric._render(lines, totals.get(index, {}))
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route', ('route', 'method'))
+HTTP_REQUESTS = metrics.counter(
+    'http_requests_total', 'HTTP responses by route and status', ('route', 'method', 'status'))
+
+
+def instrument_app(app):
+    """Time every request of `app` by its URL rule (not the raw path, to bound cardinality)."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = getattr(g, '_metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, (route, request.method))
+            HTTP_REQUESTS.inc(1, (route, request.method, str(response.status_code)))
+        return response
+
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+@metrics_api.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -2,22 +2,46 @@
 # Simple webcam streaming server using Flask and OpenCV
 
 from flask import Blueprint, Response, render_template_string
+import time
 import cv2
 
+from metrics import metrics
+
 webcam_api = Blueprint('webcam_api', __name__)
 
+# fps is rate(mjpeg_frames_total); viewers is opened minus closed streams
+MJPEG_FRAMES = metrics.counter('mjpeg_frames_total', 'JPEG frames sent to MJPEG viewers')
+MJPEG_FRAME_SECONDS = metrics.histogram('mjpeg_frame_seconds', 'Time to capture and encode one frame')
+MJPEG_OPENED = metrics.counter('mjpeg_streams_opened_total', 'MJPEG streams started')
+MJPEG_CLOSED = metrics.counter('mjpeg_streams_closed_total', 'MJPEG streams ended')
+
+
+@metrics.collector
+def webcam_metrics():
+	return [('mjpeg_viewers', 'gauge', 'Open MJPEG streams',
+			 [({}, MJPEG_OPENED.value() - MJPEG_CLOSED.value())])]
+
 def gen_frames():
 	cap = cv2.VideoCapture(0)
 	if not cap.isOpened():
 		raise RuntimeError("Could not open webcam.")
-	while True:
-		success, frame = cap.read()
-		if not success:
-			break
-		ret, buffer = cv2.imencode('.jpg', frame)
-		frame = buffer.tobytes()
-		yield (b'--frame\r\n'
-			   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+	MJPEG_OPENED.inc()
+	try:
+		while True:
+			t0 = time.perf_counter()
+			success, frame = cap.read()
+			if not success:
+				break
+			ret, buffer = cv2.imencode('.jpg', frame)
+			frame = buffer.tobytes()
+			MJPEG_FRAME_SECONDS.observe(time.perf_counter() - t0)
+			MJPEG_FRAMES.inc()
+			yield (b'--frame\r\n'
+				   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+	finally:
+		# Runs when the viewer disconnects and the generator is closed
+		MJPEG_CLOSED.inc()
+		cap.release()
 
 @webcam_api.route('/')
 def index():
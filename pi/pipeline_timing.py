@@ -0,0 +1,132 @@
+"""
+Per-stage timing for the plant-health pipeline.
+
+Every run of the capture/detect/crop pipeline records how long each stage
+took (capture, inference, crop, encode, write). The per-run
+timings are returned with the API response, and all runs are aggregated into
+fixed-bucket histograms that can be read from /plant_health/timings. Runs are
+kept apart by source, so background scans do not skew the latencies of the
+interactive endpoint.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+SOURCES = ('interactive', 'scheduled')
+STAGES = ('capture', 'cache_lookup', 'cascade', 'inference', 'inference_tiled', 'crop', 'encode', 'write')
+
+# Histogram bucket upper bounds in milliseconds (last bucket is +Inf)
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class StageHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+
+    def observe(self, ms):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        if self.min_ms is None or ms < self.min_ms:
+            self.min_ms = ms
+        if self.max_ms is None or ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that holds it."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self):
+        buckets = {}
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            le = str(BUCKETS_MS[i]) if i < len(BUCKETS_MS) else '+Inf'
+            buckets[le] = cumulative
+        return {
+            'count': self.count,
+            'sum_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'min_ms': round(self.min_ms, 3) if self.min_ms is not None else None,
+            'max_ms': round(self.max_ms, 3) if self.max_ms is not None else None,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'buckets': buckets,
+        }
+
+
+class RunTimer:
+    """Collects stage durations for a single pipeline run."""
+
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Stages such as crop/encode/write run once per crop; accumulate
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0) * 1000.0
+
+    def total_ms(self):
+        return (time.perf_counter() - self._start) * 1000.0
+
+    def as_dict(self):
+        out = {name: round(ms, 3) for name, ms in self.stages.items()}
+        out['total'] = round(self.total_ms(), 3)
+        return out
+
+
+def _new_histograms():
+    return {name: StageHistogram() for name in STAGES + ('total',)}
+
+
+_lock = threading.Lock()
+_histograms = {source: _new_histograms() for source in SOURCES}
+
+
+def record_run(timer, source='interactive'):
+    """Fold a finished RunTimer into the histograms of `source` and return its timings."""
+    timings = timer.as_dict()
+    with _lock:
+        histograms = _histograms[source]
+        for name, ms in timings.items():
+            hist = histograms.get(name)
+            if hist is None:
+                hist = histograms[name] = StageHistogram()
+            hist.observe(ms)
+    return timings
+
+
+def timings_snapshot(source='interactive'):
+    with _lock:
+        return {
+            'source': source,
+            'bucket_bounds_ms': list(BUCKETS_MS),
+            'stages': {name: hist.as_dict() for name, hist in _histograms[source].items()},
+        }
+
+
+def reset_timings():
+    with _lock:
+        for source in _histograms:
+            _histograms[source] = _new_histograms()
@@ -0,0 +1,205 @@
+"""
+Scheduled plant-health scans and their result history.
+
+A PlantHealthScheduler runs a scan callback at a fixed cadence. Each scan
+captures a frame and skips detection when the scene hasn't changed since the
+last stored run (perceptual hash within a few bits). Otherwise the compact
+result (boxes, labels, confidences and colour-based health metrics) is stored
+in a small SQLite database indexed by timestamp, so trends can be queried by
+time range without keeping or rescanning images.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+HISTORY_DB = Path(__file__).parent / 'plant_health.db'
+
+# HSV hue ranges on OpenCV's 0-179 scale; low-saturation pixels are ignored
+GREEN_HUE = (35, 85)
+YELLOW_HUE = (20, 35)
+BROWN_HUE = (5, 20)
+MIN_SATURATION = 40
+MIN_VALUE = 40
+
+
+def colour_fractions(frame):
+    """Fractions of green, yellow and brown pixels in a BGR frame."""
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    coloured = (s >= MIN_SATURATION) & (v >= MIN_VALUE)
+    total = float(h.size)
+
+    def fraction(lo, hi):
+        return round(float(np.count_nonzero(coloured & (h >= lo) & (h < hi))) / total, 4)
+
+    green = fraction(*GREEN_HUE)
+    yellow = fraction(*YELLOW_HUE)
+    brown = fraction(*BROWN_HUE)
+    plant = green + yellow + brown
+    return {
+        'green_ratio': green,
+        'yellow_ratio': yellow,
+        'brown_ratio': brown,
+        # share of plant-coloured pixels that look discoloured
+        'discoloured_ratio': round((yellow + brown) / plant, 4) if plant else None,
+    }
+
+
+def health_metrics(frame, detections):
+    """Colour and detection summary for one BGR frame."""
+    confs = [d['conf'] for d in detections]
+    metrics = colour_fractions(frame)
+    metrics['num_detections'] = len(detections)
+    metrics['mean_conf'] = round(sum(confs) / len(confs), 3) if confs else None
+    return metrics
+
+
+class PlantHealthHistory:
+    def __init__(self, path=HISTORY_DB):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                frame_hash TEXT NOT NULL,
+                num_detections INTEGER NOT NULL,
+                mean_conf REAL,
+                green_ratio REAL,
+                yellow_ratio REAL,
+                brown_ratio REAL,
+                discoloured_ratio REAL,
+                detections TEXT NOT NULL,
+                inference TEXT
+            )''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS runs_ts ON runs (ts)')
+        self._db.commit()
+
+    def add(self, ts, frame_hash, detections, metrics, inference=None):
+        # [x1, y1, x2, y2, label, conf] rows keep the stored JSON small
+        compact = [d['box'] + [d['label'], d['conf']] for d in detections]
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO runs (ts, frame_hash, num_detections, mean_conf, green_ratio, yellow_ratio,'
+                ' brown_ratio, discoloured_ratio, detections, inference) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (ts, f'{frame_hash:016x}', metrics['num_detections'], metrics['mean_conf'],
+                 metrics['green_ratio'], metrics['yellow_ratio'], metrics['brown_ratio'],
+                 metrics['discoloured_ratio'], json.dumps(compact, separators=(',', ':')),
+                 json.dumps(inference or {}, separators=(',', ':'))))
+            self._db.commit()
+
+    def query(self, start=None, end=None, limit=1000):
+        sql = ('SELECT ts, frame_hash, num_detections, mean_conf, green_ratio, yellow_ratio,'
+               ' brown_ratio, discoloured_ratio, detections, inference FROM runs WHERE ts >= ? AND ts <= ?'
+               ' ORDER BY ts LIMIT ?')
+        args = (start if start is not None else 0.0,
+                end if end is not None else float('inf'), int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [{
+            'ts': ts,
+            'frame_hash': fh,
+            'num_detections': n,
+            'mean_conf': mc,
+            'green_ratio': g,
+            'yellow_ratio': y,
+            'brown_ratio': b,
+            'discoloured_ratio': dr,
+            'detections': [{'box': d[:4], 'label': d[4], 'conf': d[5]} for d in json.loads(dets)],
+            'inference': json.loads(inf) if inf else {},
+        } for ts, fh, n, mc, g, y, b, dr, dets, inf in rows]
+
+    def latest_hash(self):
+        with self._lock:
+            row = self._db.execute('SELECT frame_hash FROM runs ORDER BY ts DESC LIMIT 1').fetchone()
+        return int(row[0], 16) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class PlantHealthScheduler:
+    """Calls `scan()` every `interval` seconds on a daemon thread."""
+
+    def __init__(self, scan, interval):
+        self.scan = scan
+        self.interval = interval
+        # Each loop gets its own events, so a loop still finishing a slow scan
+        # after stop() cannot be revived by, or run alongside, a later start()
+        self._stop = threading.Event()
+        self._wake = threading.Event()   # set when the interval changes or on stop
+        self._thread = None
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_error = None
+
+    def _loop(self, stop, wake, previous):
+        if previous is not None:
+            previous.join()   # let a scan left over from stop() finish first
+        while not stop.is_set():
+            started = time.time()
+            try:
+                stored = self.scan()
+                if stored:
+                    self.runs += 1
+                else:
+                    self.skipped += 1
+                self.last_run = started
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                print(f"Scheduled plant health scan failed: {e}")
+            # Sleep until the next scan is due, recomputed when the interval changes
+            while not stop.is_set():
+                remaining = self.interval - (time.time() - started)
+                if remaining <= 0:
+                    break
+                wake.wait(remaining)
+                wake.clear()
+
+    def running(self):
+        return (self._thread is not None and self._thread.is_alive()
+                and not self._stop.is_set())
+
+    def start(self, interval=None):
+        if interval is not None and interval != self.interval:
+            self.interval = interval
+            self._wake.set()
+        if self.running():
+            return
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        previous = self._thread if self._thread is not None and self._thread.is_alive() else None
+        self._thread = threading.Thread(target=self._loop, args=(self._stop, self._wake, previous),
+                                        daemon=True, name='plant-health-scheduler')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            # A scan still running after the timeout finishes on its own and
+            # its loop then exits, since its stop event stays set
+            self._thread.join(timeout=5)
+
+    def status(self):
+        return {
+            'running': self.running(),
+            'interval_s': self.interval,
+            'runs': self.runs,
+            'skipped_unchanged': self.skipped,
+            'errors': self.errors,
+            'last_run': self.last_run,
+            'last_error': self.last_error,
+        }
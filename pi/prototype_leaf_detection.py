@@ -3,9 +3,11 @@
 Prototype: On-Demand Leaf Detection and Cropping with YOLOv5 Nano (pre-trained)
 
 - Captures a frame from the Pi webcam using OpenCV
-- Runs YOLOv5 Nano detection on the captured frame
+- Runs YOLOv5 Nano detection on the captured frame in a separate worker
+  process (see inference_worker.py), so torch is never loaded by the web server
 - Crops detected leaves and saves them to leaf_crops/
 - Exposes a Flask endpoint to trigger the process remotely
+- Nothing runs on import; main.create_app() calls start()/stop()
 
 Requirements:
 - torch
@@ -15,42 +17,139 @@ Requirements:
 """
 
 import os
+import time
 import cv2
-import torch
 from pathlib import Path
-from flask import Blueprint, jsonify, send_from_directory
+from flask import Blueprint, jsonify, request, send_from_directory
 
-# Paths
+from metrics import metrics
+from pipeline_timing import SOURCES, RunTimer, record_run, timings_snapshot
+from inference_worker import InferenceWorker
+from detection_cache import DetectionCache, frame_hash, hamming
+from leaf_cascade import CascadeStats, classify
+from plant_health_history import PlantHealthHistory, PlantHealthScheduler, health_metrics
+
+# Paths (created by start())
 CROPS_DIR = Path(__file__).parent / 'leaf_crops'
-CROPS_DIR.mkdir(exist_ok=True)
-
-# Load YOLOv5 Nano model from Torch Hub (internet required for first run)
-model = torch.hub.load('ultralytics/yolov5', 'yolov5n', pretrained=True)
-model.conf = 0.3  # confidence threshold
-
-def capture_and_detect_and_crop():
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        raise RuntimeError("Could not open webcam.")
-    ret, frame = cap.read()
-    cap.release()
+
+# YOLOv5 Nano runs in a worker process, started on the first detection
+# (internet required for the first run to fetch the model from Torch Hub)
+inference_worker = InferenceWorker(model_name='yolov5n', conf=0.3)
+
+# Round trip to the worker (including tiling) per detection run
+INFERENCE_SECONDS = metrics.histogram('inference_duration_seconds', 'Leaf detection inference time',
+                                      ('mode',))
+
+
+@metrics.collector
+def inference_metrics():
+    stats = inference_worker.stats()
+    return [
+        ('inference_worker_up', 'gauge', '1 while the inference worker process is alive',
+         [({}, stats['running'])]),
+        ('inference_requests_total', 'counter', 'Detections sent to the inference worker',
+         [({}, stats['requests'])]),
+        ('inference_failures_total', 'counter', 'Failed inference requests',
+         [({}, stats['failures'])]),
+        ('inference_worker_restarts_total', 'counter', 'Inference worker restarts',
+         [({}, stats['restarts'])]),
+    ]
+
+# Split high-resolution frames into overlapping tiles before detection
+# (can also be enabled per request with ?tiled=1)
+TILED_INFERENCE = False
+
+# Classify frames with a cheap colour model first and only run YOLO when it
+# is unsure (can also be set per request with ?cascade=0/1). Off until
+# leaf_cascade.evaluate() has been run on real plant images: a frame it
+# wrongly calls healthy or no_plant never reaches the detector.
+CASCADE_ENABLED = False
+cascade_stats = CascadeStats()
+
+# Reuse the previous result when the scene has not changed
+DETECTION_CACHE_ENABLED = True
+detection_cache = DetectionCache(ttl=300.0, max_entries=16, max_distance=4)
+
+# Periodic scans stored in plant_health.db (seconds; 0 = start them via the API)
+SCHEDULED_SCAN_INTERVAL = 0
+SCHEDULED_SCAN_TILED = False
+
+# Crop files are overwritten by every run; remember which cached result they belong to
+_crops_on_disk = None
+
+
+def _save_crop(timer, crop, crop_name):
+    """Encode and write one crop; returns the JPEG bytes or None on failure."""
+    with timer.stage('encode'):
+        ok, buffer = cv2.imencode('.jpg', crop)
+    if not ok:
+        print(f"Failed to encode crop {crop_name}")
+        return None
+    data = buffer.tobytes()
+    with timer.stage('write'):
+        (CROPS_DIR / crop_name).write_bytes(data)
+    return data
+
+
+def capture_frame(timer):
+    with timer.stage('capture'):
+        cap = cv2.VideoCapture(0)
+        if not cap.isOpened():
+            raise RuntimeError("Could not open webcam.")
+        ret, frame = cap.read()
+        cap.release()
     if not ret:
         raise RuntimeError("Failed to capture frame from webcam.")
-    results = model(frame)
-    crops = []
-    dets = results.xyxy[0]
-    names = model.names if hasattr(model, 'names') else {}
+    return frame
+
+
+def run_detection(frame, timer, tiled):
+    """Run detection on a captured frame; returns (detections, inference info)."""
+    # Tiled runs are timed as their own stage so both modes can be compared
+    inference = {'mode': 'tiled' if tiled else 'single'}
+    with timer.stage('inference_tiled' if tiled else 'inference'):
+        with INFERENCE_SECONDS.time((inference['mode'],)):
+            dets, tile_info = inference_worker.detect(frame, tiled=tiled)
+        inference.update(tile_info)
+    inference['worker_ms'] = inference_worker.last_inference_ms
+    detections = []
+    names = inference_worker.names
     print(f"Detections: {len(dets)}")
     for i, det in enumerate(dets):
-        x1, y1, x2, y2, conf, cls = det.tolist()
+        x1, y1, x2, y2, conf, cls = det
         label = names.get(int(cls), str(cls))
         print(f"Detection {i}: class={label}, conf={conf:.2f}, box=({x1:.0f},{y1:.0f},{x2:.0f},{y2:.0f})")
-        if conf >= model.conf:
-            crop = frame[int(y1):int(y2), int(x1):int(x2)]
+        detections.append({'box': [round(x1), round(y1), round(x2), round(y2)],
+                           'label': label, 'conf': round(conf, 3)})
+    return detections, inference
+
+
+def detect_and_crop(frame, timer, tiled, use_cascade=False):
+    """Run detection on a BGR frame and save crops; returns (result, crop_bytes)."""
+    cascade = None
+    if use_cascade:
+        with timer.stage('cascade'):
+            decision, colours = classify(frame)
+        cascade_stats.record(decision)
+        cascade = dict(colours, decision=decision)
+    if cascade is None or cascade['decision'] == 'uncertain':
+        detections, inference = run_detection(frame, timer, tiled)
+    else:
+        print(f"Cascade decided '{cascade['decision']}'; skipping YOLO")
+        detections, inference = [], {'mode': 'skipped'}
+    crops = []
+    crop_bytes = {}
+    for i, det in enumerate(detections):
+        x1, y1, x2, y2 = det['box']
+        label = det['label']
+        if det['conf'] >= inference_worker.conf:
+            with timer.stage('crop'):
+                crop = frame[y1:y2, x1:x2]
             crop_name = f"capture_crop_{i}_{label}.jpg"
-            crop_path = CROPS_DIR / crop_name
-            cv2.imwrite(str(crop_path), crop)
-            crops.append(crop_name)
+            data = _save_crop(timer, crop, crop_name)
+            if data is not None:
+                crops.append(crop_name)
+                crop_bytes[crop_name] = data
     if not crops:
         print("No objects detected above confidence threshold. Splitting full frame into grid crops.")
         # Split the frame into a grid (e.g., 4x4)
@@ -60,18 +159,114 @@ def capture_and_detect_and_crop():
         crop_count = 0
         for row in range(grid_rows):
             for col in range(grid_cols):
-                y1 = row * crop_h
-                y2 = (row + 1) * crop_h if row < grid_rows - 1 else h
-                x1 = col * crop_w
-                x2 = (col + 1) * crop_w if col < grid_cols - 1 else w
-                crop = frame[y1:y2, x1:x2]
+                with timer.stage('crop'):
+                    y1 = row * crop_h
+                    y2 = (row + 1) * crop_h if row < grid_rows - 1 else h
+                    x1 = col * crop_w
+                    x2 = (col + 1) * crop_w if col < grid_cols - 1 else w
+                    crop = frame[y1:y2, x1:x2]
                 crop_name = f"capture_crop_grid_{row}_{col}.jpg"
-                crop_path = CROPS_DIR / crop_name
-                cv2.imwrite(str(crop_path), crop)
-                crops.append(crop_name)
-                crop_count += 1
+                data = _save_crop(timer, crop, crop_name)
+                if data is not None:
+                    crops.append(crop_name)
+                    crop_bytes[crop_name] = data
+                    crop_count += 1
         print(f"Saved {crop_count} grid crops.")
-    return crops
+    return {'crops': crops, 'detections': detections, 'inference': inference,
+            'cascade': cascade}, crop_bytes
+
+
+def capture_and_detect_and_crop(timer=None, tiled=None, use_cache=None, use_cascade=None):
+    """
+    Capture a frame, detect objects and save crops.
+
+    Returns a dict with the saved crop file names, the detections
+    ({box, label, conf}), details about how inference was run, the cascade
+    decision and whether the result came from the detection cache.
+    """
+    global _crops_on_disk
+    if timer is None:
+        timer = RunTimer()
+    if tiled is None:
+        tiled = TILED_INFERENCE
+    if use_cache is None:
+        use_cache = DETECTION_CACHE_ENABLED
+    if use_cascade is None:
+        use_cascade = CASCADE_ENABLED
+    frame = capture_frame(timer)
+    if not use_cache:
+        result, _ = detect_and_crop(frame, timer, tiled, use_cascade)
+        _crops_on_disk = None
+        return dict(result, cache='bypass')
+
+    namespace = ('tiled' if tiled else 'single') + ('+cascade' if use_cascade else '')
+    with timer.stage('cache_lookup'):
+        key = frame_hash(frame)
+        entry = detection_cache.get(key, namespace)
+    if entry is not None:
+        result, crop_bytes = entry
+        if _crops_on_disk is not entry:
+            # A later run overwrote the crop files; restore this result's crops
+            with timer.stage('write'):
+                for name, data in crop_bytes.items():
+                    (CROPS_DIR / name).write_bytes(data)
+            _crops_on_disk = entry
+        print(f"Detection cache hit ({len(result['detections'])} detections)")
+        return dict(result, cache='hit')
+
+    entry = detect_and_crop(frame, timer, tiled, use_cascade)
+    detection_cache.put(key, entry, namespace)
+    _crops_on_disk = entry
+    return dict(entry[0], cache='miss')
+
+
+def scheduled_scan():
+    """
+    One scheduled scan: store a history entry unless the scene is unchanged.
+
+    Returns True when a result was stored, False when the run was skipped.
+    """
+    timer = RunTimer()
+    frame = capture_frame(timer)
+    with timer.stage('cache_lookup'):
+        key = frame_hash(frame)
+    last = plant_health_history.latest_hash()
+    if last is not None and hamming(key, last) <= detection_cache.max_distance:
+        return False
+    detections, inference = run_detection(frame, timer, SCHEDULED_SCAN_TILED)
+    metrics = health_metrics(frame, detections)
+    inference['timings_ms'] = record_run(timer, 'scheduled')
+    plant_health_history.add(time.time(), key, detections, metrics, inference)
+    print(f"Scheduled scan stored: {metrics}")
+    return True
+
+
+# Opened by start()
+plant_health_history = None
+plant_health_scheduler = PlantHealthScheduler(scheduled_scan, SCHEDULED_SCAN_INTERVAL)
+
+
+def start():
+    """Create the crops folder, open the history database and start scheduled scans."""
+    global plant_health_history
+    CROPS_DIR.mkdir(exist_ok=True)
+    plant_health_history = PlantHealthHistory()
+    if SCHEDULED_SCAN_INTERVAL > 0:
+        plant_health_scheduler.start()
+
+
+def stop():
+    global plant_health_history
+    plant_health_scheduler.stop()
+    inference_worker.stop()
+    if plant_health_history is not None:
+        plant_health_history.close()
+        plant_health_history = None
+
+
+def _history_closed():
+    # The history database is only opened by start()
+    return jsonify({"status": "error", "message": "plant health history is not running"}), 503
 
 
 # Flask Blueprint for plant health check
@@ -83,9 +278,81 @@ def serve_crop(filename):
 
 @plant_health_api.route('/plant_health/capture_and_detect', methods=['POST', 'GET'])
 def plant_health_capture_and_detect():
+    timer = RunTimer()
+    tiled = request.args.get('tiled')
+    tiled = None if tiled is None else tiled.lower() in ('1', 'true', 'yes')
+    use_cache = request.args.get('cache')
+    use_cache = None if use_cache is None else use_cache.lower() in ('1', 'true', 'yes')
+    use_cascade = request.args.get('cascade')
+    use_cascade = None if use_cascade is None else use_cascade.lower() in ('1', 'true', 'yes')
     try:
-        crops = capture_and_detect_and_crop()
-        crop_urls = [f"/crops/{name}" for name in crops]
-        return jsonify({"status": "ok", "num_crops": len(crop_urls), "crops": crop_urls})
+        result = capture_and_detect_and_crop(timer, tiled=tiled, use_cache=use_cache,
+                                             use_cascade=use_cascade)
+        timings = record_run(timer)
+        crop_urls = [f"/crops/{name}" for name in result['crops']]
+        return jsonify({"status": "ok", "num_crops": len(crop_urls), "crops": crop_urls,
+                        "detections": result['detections'], "inference": result['inference'],
+                        "cascade": result['cascade'], "cache": result['cache'],
+                        "timings_ms": timings})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return jsonify({"status": "error", "message": str(e), "timings_ms": timer.as_dict()}), 500
+
+@plant_health_api.route('/plant_health/timings', methods=['GET'])
+def plant_health_timings():
+    source = request.args.get('source', 'interactive')
+    if source not in SOURCES:
+        return jsonify({"status": "error", "message": f"source must be one of {', '.join(SOURCES)}"}), 400
+    return jsonify(timings_snapshot(source))
+
+@plant_health_api.route('/plant_health/cache', methods=['GET', 'DELETE'])
+def plant_health_cache():
+    global _crops_on_disk
+    if request.method == 'DELETE':
+        detection_cache.clear()
+        _crops_on_disk = None
+    return jsonify(detection_cache.stats())
+
+@plant_health_api.route('/plant_health/history', methods=['GET'])
+def plant_health_history_query():
+    try:
+        start = float(request.args['from']) if 'from' in request.args else None
+        end = float(request.args['to']) if 'to' in request.args else None
+        limit = int(request.args.get('limit', 1000))
+    except ValueError:
+        return jsonify({"status": "error", "message": "from/to must be unix timestamps, limit an integer"}), 400
+    if plant_health_history is None:
+        return _history_closed()
+    runs = plant_health_history.query(start, end, limit)
+    return jsonify({"status": "ok", "count": len(runs), "runs": runs})
+
+@plant_health_api.route('/plant_health/scheduler', methods=['GET', 'POST'])
+def plant_health_scheduler_control():
+    if request.method == 'POST':
+        payload = request.get_json(force=True, silent=True)
+        if payload is None:
+            payload = {}
+        elif not isinstance(payload, dict):
+            return jsonify({"status": "error", "message": "expected a json object"}), 400
+        if payload.get('enabled') is False:
+            plant_health_scheduler.stop()
+        else:
+            try:
+                interval = float(payload['interval']) if 'interval' in payload else None
+            except (TypeError, ValueError):
+                return jsonify({"status": "error", "message": "interval must be a number of seconds"}), 400
+            if interval is not None and interval <= 0:
+                return jsonify({"status": "error", "message": "interval must be positive"}), 400
+            if interval is None and plant_health_scheduler.interval <= 0:
+                return jsonify({"status": "error", "message": "interval is required"}), 400
+            if plant_health_history is None:
+                return _history_closed()
+            plant_health_scheduler.start(interval)
+    return jsonify(plant_health_scheduler.status())
+
+@plant_health_api.route('/plant_health/cascade', methods=['GET'])
+def plant_health_cascade():
+    return jsonify(cascade_stats.as_dict())
+
+@plant_health_api.route('/plant_health/worker', methods=['GET'])
+def plant_health_worker():
+    return jsonify(inference_worker.stats())
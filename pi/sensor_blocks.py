@@ -0,0 +1,447 @@
+"""
+Compressed columnar blocks for sealed sensor history.
+
+A block holds up to BLOCK_RECORDS readings of one device, stored column by
+column with Gorilla-style encodings packed into byte varints:
+
+- timestamps: the float64 bit patterns read as integers (for positive
+  timestamps these order like the values and, within one power of two,
+  count steps of the same size: 2**-22 s for current unix times), as first
+  value, first delta, then the zigzag delta-of-delta: small for a steady
+  sampler and exact for any timestamp
+- float fields: float32 bit patterns XORed with the previous value; an
+  unchanged value is one zero byte, otherwise the XOR is stored without its
+  trailing zero bits (shift count in the low 5 bits of the varint)
+- integer-valued fields (moisture, raw, relay, ...): zigzag deltas
+- fields a reading lacked: a presence bitmap, omitted when every reading (or
+  none) has the field
+
+Each block starts with a header (count, min/max timestamp, byte length of
+every column, per-field min/max), so a range query skips blocks outside the
+range without reading their payload and decodes only the columns it needs.
+Values are float32 and timestamps float64, as in the segment files, and
+blocks reproduce both exactly, so compressing a segment never changes what
+a query returns. (Version 1 blocks stored millisecond timestamps; they are
+still read.)
+
+SensorStore reads `<seq>.blk` block files wherever a sealed `<seq>.seg`
+segment would be; compress_segment() converts one.
+
+    python sensor_blocks.py bench               # bytes/sample and decode speed
+    python sensor_blocks.py compress sensor_history/pico/00000000.seg
+"""
+
+import math
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+
+from sensor_store import FIELDS, HEADER, MAGIC as SEGMENT_MAGIC, RECORD, _unpack_values
+
+BLOCK_RECORDS = 1024          # readings per block (~17 min at 1 Hz)
+TS_SCALE = 1000               # version 1 blocks stored milliseconds
+
+# magic, version, field count, record count, bytes after this header, min_ts, max_ts
+BLOCK_HEADER = struct.Struct('<4sHHIIdd')
+BLOCK_MAGIC = b'PBLK'
+BLOCK_VERSION = 2
+# per field: codec, presence, payload length, min, max
+COLUMN_HEADER = struct.Struct('<BBIff')
+TS_LENGTH = struct.Struct('<I')
+
+CODEC_XOR = 0                 # float32 XOR with trailing zeros stripped
+CODEC_DELTA = 1               # integer zigzag deltas
+PRESENT_NONE = 0
+PRESENT_ALL = 1
+PRESENT_BITMAP = 2
+
+NAN = float('nan')
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varints(data, pos, count):
+    """Decode `count` varints from `data` at `pos`; returns (values, new pos)."""
+    values = []
+    append = values.append
+    for _ in range(count):
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            append(b)
+            continue
+        result = b & 0x7F
+        shift = 7
+        while True:
+            b = data[pos]
+            pos += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values, pos
+
+
+def _encode_ts(ts_values):
+    out = bytearray()
+    prev = prev_delta = 0
+    for i, n in enumerate(array('q', array('d', ts_values).tobytes())):
+        if i == 0:
+            _put_varint(out, _zigzag(n))
+        elif i == 1:
+            prev_delta = n - prev
+            _put_varint(out, _zigzag(prev_delta))
+        else:
+            delta = n - prev
+            _put_varint(out, _zigzag(delta - prev_delta))
+            prev_delta = delta
+        prev = n
+    return bytes(out)
+
+
+def _decode_ts(data, count, version=BLOCK_VERSION):
+    raw, _ = _read_varints(data, 0, count)
+    out = array('q') if version >= 2 else []
+    n = delta = 0
+    for i, v in enumerate(raw):
+        v = _unzigzag(v)
+        if i == 0:
+            n = v
+        elif i == 1:
+            delta = v
+            n += delta
+        else:
+            delta += v
+            n += delta
+        out.append(n if version >= 2 else n / TS_SCALE)
+    if version >= 2:
+        return array('d', out.tobytes()).tolist()
+    return out
+
+
+def _encode_column(values):
+    """Encode one field's float32 values (NaN = absent); returns (header tuple, payload)."""
+    present = [not math.isnan(v) for v in values]
+    kept = [v for v, p in zip(values, present) if p]
+    if not kept:
+        return (CODEC_XOR, PRESENT_NONE, 0, NAN, NAN), b''
+    out = bytearray()
+    if len(kept) == len(values):
+        presence = PRESENT_ALL
+    else:
+        presence = PRESENT_BITMAP
+        bitmap = bytearray((len(values) + 7) // 8)
+        for i, p in enumerate(present):
+            if p:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        out += bitmap
+    if all(v.is_integer() and abs(v) < 2 ** 24 for v in kept):
+        codec = CODEC_DELTA
+        prev = 0
+        for v in kept:
+            n = int(v)
+            _put_varint(out, _zigzag(n - prev))
+            prev = n
+    else:
+        codec = CODEC_XOR
+        prev = 0
+        for bits in array('I', array('f', kept).tobytes()):
+            x = bits ^ prev
+            if x:
+                shift = (x & -x).bit_length() - 1
+                _put_varint(out, (x >> shift) << 5 | shift)
+            else:
+                out.append(0)
+            prev = bits
+    return (codec, presence, len(out), min(kept), max(kept)), bytes(out)
+
+
+def _decode_column(data, count, codec, presence):
+    if presence == PRESENT_NONE:
+        return [NAN] * count
+    pos = 0
+    if presence == PRESENT_BITMAP:
+        nbytes = (count + 7) // 8
+        bitmap = data[:nbytes]
+        pos = nbytes
+        present = [bool(bitmap[i >> 3] & (1 << (i & 7))) for i in range(count)]
+        n = sum(present)
+    else:
+        present = None
+        n = count
+    raw, _ = _read_varints(data, pos, n)
+    if codec == CODEC_DELTA:
+        kept = []
+        prev = 0
+        for v in raw:
+            prev += _unzigzag(v)
+            kept.append(float(prev))
+    else:
+        bits = array('I')
+        prev = 0
+        for v in raw:
+            if v:
+                prev ^= (v >> 5) << (v & 31)
+            bits.append(prev)
+        kept = array('f', bits.tobytes()).tolist()
+    if present is None:
+        return kept
+    out = [NAN] * count
+    it = iter(kept)
+    for i, p in enumerate(present):
+        if p:
+            out[i] = next(it)
+    return out
+
+
+def encode_block(records):
+    """Encode [(ts, floats)] (floats ordered as FIELDS, NaN = absent) sorted by ts."""
+    ts_values = [ts for ts, _ in records]
+    ts_payload = _encode_ts(ts_values)
+    columns = [_encode_column([floats[i] for _, floats in records]) for i in range(len(FIELDS))]
+    body = bytearray(TS_LENGTH.pack(len(ts_payload)))
+    for header, _ in columns:
+        body += COLUMN_HEADER.pack(*header)
+    body += ts_payload
+    for _, payload in columns:
+        body += payload
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION, len(FIELDS), len(records), len(body),
+                               min(ts_values), max(ts_values))
+    return header + bytes(body)
+
+
+class BlockInfo:
+    """Parsed block header: where the block is and what it covers."""
+    __slots__ = ('offset', 'version', 'count', 'min_ts', 'max_ts', 'ts_length', 'columns',
+                 'body_offset', 'size')
+
+    def __init__(self, data, offset):
+        magic, self.version, nfields, self.count, length, self.min_ts, self.max_ts = \
+            BLOCK_HEADER.unpack_from(data, offset)
+        if magic != BLOCK_MAGIC or self.version not in (1, BLOCK_VERSION) or nfields != len(FIELDS):
+            raise ValueError(f'not a sensor block at offset {offset}')
+        self.offset = offset
+        pos = offset + BLOCK_HEADER.size
+        self.ts_length, = TS_LENGTH.unpack_from(data, pos)
+        pos += TS_LENGTH.size
+        self.columns = [COLUMN_HEADER.unpack_from(data, pos + i * COLUMN_HEADER.size)
+                        for i in range(nfields)]
+        self.body_offset = pos + nfields * COLUMN_HEADER.size
+        self.size = BLOCK_HEADER.size + length
+
+    def stats(self):
+        """{field: (min, max)} for the fields present in the block."""
+        return {name: (lo, hi) for name, (_, presence, _, lo, hi) in zip(FIELDS, self.columns)
+                if presence != PRESENT_NONE}
+
+
+def block_infos(data):
+    """Headers of every block in a block file's bytes."""
+    infos = []
+    offset = 0
+    while offset + BLOCK_HEADER.size <= len(data):
+        info = BlockInfo(data, offset)
+        infos.append(info)
+        offset += info.size
+    return infos
+
+
+def decode_block(data, info, fields=None):
+    """Decode a block into (ts list, {field: values}) for the requested fields."""
+    pos = info.body_offset
+    ts = _decode_ts(memoryview(data)[pos:pos + info.ts_length], info.count, info.version)
+    pos += info.ts_length
+    columns = {}
+    for name, (codec, presence, length, _, _) in zip(FIELDS, info.columns):
+        if fields is None or name in fields:
+            columns[name] = _decode_column(memoryview(data)[pos:pos + length], info.count, codec, presence)
+        pos += length
+    return ts, columns
+
+
+def _mapped(path):
+    """Read-only mapping of a block file; only pages that are touched get read."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_range(path, start=-math.inf, end=math.inf, fields=None):
+    """Yield readings with start <= ts <= end from a block file, decoding only overlapping blocks."""
+    data = _mapped(path)
+    try:
+        for info in block_infos(data):
+            if info.max_ts < start or info.min_ts > end:
+                continue
+            ts, columns = decode_block(data, info, fields)
+            cols = [columns.get(name) for name in FIELDS]
+            for k, t in enumerate(ts):
+                if start <= t <= end:
+                    yield _unpack_values(t, [NAN if col is None else col[k] for col in cols])
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def file_summary(path):
+    """(count, min_ts, max_ts) of a block file, from its headers only."""
+    data = _mapped(path)
+    try:
+        infos = block_infos(data)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    if not infos:
+        return 0, 0.0, 0.0
+    return (sum(i.count for i in infos), min(i.min_ts for i in infos), max(i.max_ts for i in infos))
+
+
+def write_blocks(path, records, block_records=BLOCK_RECORDS):
+    """Write [(ts, floats)] to a block file atomically; records are sorted by ts first."""
+    records = sorted(records, key=lambda r: r[0])
+    path = Path(path)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        for i in range(0, len(records), block_records):
+            f.write(encode_block(records[i:i + block_records]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def segment_records(path):
+    """All (ts, floats) records of a segment file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, _, _, count, _, _, _ = HEADER.unpack_from(data, 0)
+    if magic != SEGMENT_MAGIC:
+        raise ValueError(f'{path} is not a sensor segment')
+    out = []
+    for k in range(count):
+        rec = RECORD.unpack_from(data, HEADER.size + k * RECORD.size)
+        out.append((rec[0], rec[1:]))
+    return out
+
+
+def compress_segment(path):
+    """Write `<seq>.blk` next to a sealed segment and return its path (the segment is kept)."""
+    path = Path(path)
+    return write_blocks(path.with_suffix('.blk'), segment_records(path))
+
+
+def _synthetic(n, seed=1):
+    """n readings of a 1 Hz Pico: DHT11 temp/humi steps, digital moisture, W telemetry."""
+    import random
+
+    rng = random.Random(seed)
+    temp, humi, raw = 21.0, 45.0, 30000
+    relay = 0.0
+    out = []
+    ts = 1760000000.0
+    for i in range(n):
+        ts += 1.0 + rng.uniform(-0.02, 0.02)
+        if rng.random() < 0.02:
+            temp += rng.choice((-1.0, 1.0))
+        if rng.random() < 0.05:
+            humi += rng.choice((-1.0, 1.0))
+        raw += rng.randint(-40, 40)
+        if rng.random() < 0.001:
+            relay = 1.0 - relay
+        percent = round(100 - (raw - 20000) / 300, 1)
+        floats = array('f', [temp, humi, 1.0 if percent > 35 else 0.0, percent, raw, relay]).tolist()
+        out.append((ts, floats))
+    return out
+
+
+def benchmark(n=86400):
+    """Compare block files with plain segment rows and JSON for a day of 1 Hz readings."""
+    import json
+    import tempfile
+    import time
+
+    records = _synthetic(n)
+    rows_bytes = n * RECORD.size
+    json_bytes = sum(len(json.dumps(_unpack_values(ts, floats), separators=(',', ':'))) + 1
+                     for ts, floats in records)
+    t0 = time.perf_counter()
+    blocks = [encode_block(records[i:i + BLOCK_RECORDS]) for i in range(0, n, BLOCK_RECORDS)]
+    encode_s = time.perf_counter() - t0
+    data = b''.join(blocks)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        blk = Path(tmp) / 'bench.blk'
+        blk.write_bytes(data)
+        t0 = time.perf_counter()
+        decoded = list(read_range(blk))
+        decode_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for info in block_infos(data):
+            decode_block(data, info, ('temp',))
+        temp_only_s = time.perf_counter() - t0
+        hour_start = records[n // 2][0]
+        t0 = time.perf_counter()
+        hour = list(read_range(blk, hour_start, hour_start + 3600))
+        hour_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rows = bytearray()
+    for ts, floats in records:
+        rows += RECORD.pack(ts, *floats)
+    plain = [_unpack_values(*(lambda r: (r[0], r[1:]))(RECORD.unpack_from(rows, k * RECORD.size)))
+             for k in range(n)]
+    rows_decode_s = time.perf_counter() - t0
+
+    mismatches = sum(1 for (ts, floats), got in zip(records, decoded)
+                     if _unpack_values(ts, floats) != got)
+    return {
+        'samples': n,
+        'json_bytes_per_sample': round(json_bytes / n, 2),
+        'row_bytes_per_sample': round(rows_bytes / n, 2),
+        'block_bytes_per_sample': round(len(data) / n, 2),
+        'compression_vs_rows': round(rows_bytes / len(data), 1),
+        'encode_samples_per_sec': round(n / encode_s),
+        'decode_samples_per_sec': round(n / decode_s),
+        'decode_temp_only_samples_per_sec': round(n / temp_only_s),
+        'rows_decode_samples_per_sec': round(len(plain) / rows_decode_s),
+        'one_hour_query_ms': round(hour_s * 1000, 1),
+        'one_hour_readings': len(hour),
+        'mismatches': mismatches,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compressed sensor history blocks')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_bench = sub.add_parser('bench', help='compare blocks with plain rows')
+    p_bench.add_argument('--samples', type=int, default=86400)
+    p_compress = sub.add_parser('compress', help='write a .blk file for sealed segments')
+    p_compress.add_argument('segments', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        for key, value in benchmark(args.samples).items():
+            print(f"{key}: {value}")
+    else:
+        for segment in args.segments:
+            out = compress_segment(segment)
+            print(f"{segment}: {os.path.getsize(segment)} -> {os.path.getsize(out)} bytes ({out})")
@@ -0,0 +1,224 @@
+"""
+Durable copy of every sensor reading in SQLite.
+
+The ingestion path only appends rows to an in-memory queue; a writer thread
+drains it and commits in batches of up to BATCH_SIZE rows or every
+FLUSH_INTERVAL seconds, whichever comes first. The database runs in WAL
+mode with synchronous=NORMAL, so a commit is an append to the WAL and
+fsync happens at checkpoints, on the writer thread. A slow SD card delays
+commits but never the code that records readings.
+
+Rows are (device, ts, one column per field) with an index on (device, ts)
+for range queries. If the queue fills (QUEUE_SIZE entries, e.g. the card has
+stalled) new rows are dropped and counted rather than blocking ingestion;
+the mmap history in sensor_store.py still has them.
+
+Rows past the raw retention period are deleted by prune() in chunks of
+PRUNE_CHUNK rows, one short transaction each, from the retention thread
+(see sensor_retention.py). SQLite reuses the freed pages for new rows, so
+the file stops growing once the retention period is full.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from sensor_store import BOOL_FIELDS, FIELDS, INT_FIELDS
+
+SENSOR_DB = Path(__file__).parent / 'sensors.db'
+BATCH_SIZE = 500              # rows per commit at most
+FLUSH_INTERVAL = 1.0          # seconds a row may wait in the queue before a commit
+QUEUE_SIZE = 100000           # queued readings (or batches) before new ones are dropped
+SYNCHRONOUS = 'NORMAL'        # 'FULL' fsyncs every commit; NORMAL only at WAL checkpoints
+PRUNE_CHUNK = 5000            # rows deleted per transaction by prune()
+
+# Distinct devices by hopping through the (device, ts) index, one lookup per device
+_DEVICES = '''
+    WITH RECURSIVE d(name) AS (
+        SELECT MIN(device) FROM readings
+        UNION ALL
+        SELECT (SELECT MIN(device) FROM readings WHERE device > d.name) FROM d WHERE d.name IS NOT NULL
+    ) SELECT name FROM d WHERE name IS NOT NULL'''
+_PRUNE = ('DELETE FROM readings WHERE rowid IN ('
+          'SELECT rowid FROM readings WHERE device = ? AND ts < ? ORDER BY ts LIMIT ?)')
+
+_INSERT = (f"INSERT INTO readings (device, ts, {', '.join(FIELDS)}) "
+           f"VALUES (?, ?, {', '.join('?' for _ in FIELDS)})")
+
+
+def _row(device, ts, reading):
+    return (device, ts) + tuple(
+        int(v) if isinstance(v, bool) else v for v in (reading.get(name) for name in FIELDS))
+
+
+class SensorDatabase:
+    def __init__(self, path=SENSOR_DB, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 queue_size=QUEUE_SIZE):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._read_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.execute(f'''
+            CREATE TABLE IF NOT EXISTS readings (
+                device TEXT NOT NULL,
+                ts REAL NOT NULL,
+                {', '.join(f"{name} {'INTEGER' if name in INT_FIELDS + BOOL_FIELDS else 'REAL'}"
+                           for name in FIELDS)}
+            )''')
+        self._writer.execute('CREATE INDEX IF NOT EXISTS readings_device_ts ON readings (device, ts)')
+        self._writer.commit()
+        # Separate connection for queries: in WAL mode readers never wait for the writer
+        self._reader = self._connect()
+        self._pruner = None
+        self._prune_lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error = None
+        self.last_commit_ms = None
+        self.max_commit_ms = 0.0
+        self.pruned = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(f'PRAGMA synchronous={SYNCHRONOUS}')
+        return db
+
+    def add(self, device, ts, reading):
+        """Queue one reading; never blocks."""
+        try:
+            self._queue.put_nowait(_row(device, ts, reading))
+        except queue.Full:
+            self.dropped += 1
+
+    def add_many(self, device, readings):
+        """Queue [(ts, reading)] for a device as a single queue entry."""
+        try:
+            self._queue.put_nowait([_row(device, ts, reading) for ts, reading in readings])
+        except queue.Full:
+            self.dropped += len(readings)
+
+    def _commit(self, rows):
+        t0 = time.perf_counter()
+        try:
+            self._writer.executemany(_INSERT, rows)
+            self._writer.commit()
+        except sqlite3.Error as e:
+            self._writer.rollback()
+            self.failed += len(rows)
+            self.last_error = str(e)
+            print(f"Sensor database write failed ({len(rows)} readings lost): {e}")
+            return
+        self.written += len(rows)
+        self.batches += 1
+        self.last_commit_ms = round((time.perf_counter() - t0) * 1000, 2)
+        self.max_commit_ms = max(self.max_commit_ms, self.last_commit_ms)
+
+    def _run(self):
+        rows = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                stopping = True
+            elif isinstance(item, list):
+                rows.extend(item)
+            elif item:
+                rows.append(item)
+            if rows and deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if rows and (stopping or len(rows) >= self.batch_size or time.monotonic() >= deadline):
+                self._commit(rows)
+                rows = []
+                deadline = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name='sensor-db-writer')
+        self._thread.start()
+
+    def close(self, timeout=10.0):
+        """Commit everything queued so far, then close the database."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+        with self._read_lock:
+            self._reader.close()
+        with self._prune_lock:
+            if self._pruner is not None:
+                self._pruner.close()
+                self._pruner = None
+        self._writer.close()
+
+    def devices(self):
+        with self._read_lock:
+            return [row[0] for row in self._reader.execute(_DEVICES)]
+
+    def prune(self, before, device=None, max_rows=PRUNE_CHUNK):
+        """
+        Delete up to `max_rows` readings older than `before` (of one device,
+        or of each device in turn); returns how many were deleted.
+
+        Runs on its own connection so the writer thread only waits for one
+        chunk's transaction, never for a whole cleanup.
+        """
+        devices = [device] if device is not None else self.devices()
+        deleted = 0
+        for name in devices:
+            if deleted >= max_rows:
+                break
+            with self._prune_lock:
+                if self._pruner is None:
+                    self._pruner = self._connect()
+                cursor = self._pruner.execute(_PRUNE, (name, before, max_rows - deleted))
+                self._pruner.commit()
+            deleted += cursor.rowcount
+        self.pruned += deleted
+        return deleted
+
+    def query(self, device, start=None, end=None, limit=1000):
+        """Readings of a device with start <= ts <= end, oldest first, as store-style dicts."""
+        sql = (f"SELECT ts, {', '.join(FIELDS)} FROM readings"
+               " WHERE device = ? AND ts >= ? AND ts <= ? ORDER BY ts LIMIT ?")
+        args = (device, start if start is not None else float('-inf'),
+                end if end is not None else float('inf'), int(limit))
+        with self._read_lock:
+            rows = self._reader.execute(sql, args).fetchall()
+        out = []
+        for row in rows:
+            reading = {'ts': row[0]}
+            for name, v in zip(FIELDS, row[1:]):
+                if v is not None:
+                    reading[name] = bool(v) if name in BOOL_FIELDS else v
+            out.append(reading)
+        return out
+
+    def status(self):
+        return {
+            'path': self.path,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'last_error': self.last_error,
+            'last_commit_ms': self.last_commit_ms,
+            'max_commit_ms': self.max_commit_ms,
+            'pruned': self.pruned,
+        }
@@ -0,0 +1,117 @@
+"""
+Change notifications for sensor readings, delivered as Server-Sent Events.
+
+record_reading() publishes the fields of each reading that actually changed
+(as reported by the device registry) to the SensorEventHub. Each connected
+client has its own bounded queue and its own device/field filter, so a
+dashboard watching one node's moisture is not woken up for temperature
+changes on another.
+
+Wire format (text/event-stream):
+
+    id: 42
+    event: reading
+    data: {"device": "pico", "ts": 1760000000.1, "changed": {"moisture": 0}}
+
+A comment line is sent every KEEPALIVE_INTERVAL seconds so proxies and
+clients can tell an idle stream from a dead one.
+"""
+
+import json
+import queue
+import threading
+import time
+
+KEEPALIVE_INTERVAL = 15.0
+CLIENT_QUEUE_SIZE = 256     # events buffered per client before the oldest are dropped
+
+
+class Subscription:
+    def __init__(self, devices=None, fields=None):
+        self.devices = set(devices) if devices else None
+        self.fields = set(fields) if fields else None
+        self.queue = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+
+    def wants(self, device, changed):
+        if self.devices is not None and device not in self.devices:
+            return None
+        if self.fields is None:
+            return changed
+        picked = {k: v for k, v in changed.items() if k in self.fields}
+        return picked or None
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow client: drop its oldest event rather than block ingestion
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped += 1
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+class SensorEventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._event_id = 0
+
+    def publish(self, device, ts, changed):
+        """Queue an event with a device's changed fields for every interested client."""
+        with self._lock:
+            self._event_id += 1
+            event_id = self._event_id
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            picked = sub.wants(device, changed)
+            if picked is not None:
+                sub.offer((event_id, {'device': device, 'ts': ts, 'changed': picked}))
+        return event_id
+
+    def subscribe(self, devices=None, fields=None):
+        sub = Subscription(devices, fields)
+        with self._lock:
+            self._subscribers.append(sub)
+            event_id = self._event_id
+        return sub, event_id
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, snapshot, devices=None, fields=None):
+        """
+        Generator of SSE text for one client.
+
+        `snapshot()` returns {device: values}; it is called after subscribing
+        so no change can fall between the snapshot and the first event.
+        """
+        sub, event_id = self.subscribe(devices, fields)
+        try:
+            yield 'retry: 3000\n\n'
+            for device, values in sorted(snapshot().items()):
+                picked = sub.wants(device, values)
+                if picked is not None:
+                    data = json.dumps({'device': device, 'ts': time.time(), 'changed': picked})
+                    yield f'id: {event_id}\nevent: snapshot\ndata: {data}\n\n'
+            while True:
+                try:
+                    eid, payload = sub.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'id: {eid}\nevent: reading\ndata: {json.dumps(payload)}\n\n'
+        finally:
+            self.unsubscribe(sub)
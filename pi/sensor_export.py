@@ -0,0 +1,157 @@
+"""
+Streaming export of the sensor history.
+
+Readings are pulled from SensorStore.query() one at a time and written out
+in chunks of about CHUNK_BYTES, so an export of any length holds only one
+chunk, one reading per device and one open segment per device in memory
+(more while a backlog stored out of order is merged back into time order).
+
+Formats:
+
+    csv       ts,device,temp,humi,... (empty cells for fields a reading lacks)
+    ndjson    one {"device", "ts", <fields>} object per line
+    columnar  one {"device", "columns": {"ts": [...], "temp": [...], ...}}
+              object per line with up to COLUMNAR_BLOCK_ROWS readings of one
+              device; each line is a valid body for POST /pico/sensors/batch
+
+csv and ndjson interleave devices in time order; columnar writes one device
+after another. With gzip the stream is compressed on the fly.
+
+    python sensor_export.py --format csv --from 1760000000 > export.csv
+"""
+
+import heapq
+import json
+import math
+import zlib
+
+from sensor_store import FIELDS
+
+FORMATS = ('csv', 'ndjson', 'columnar')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'columnar': 'application/x-ndjson'}
+EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'columnar': 'columns.ndjson'}
+CHUNK_BYTES = 64 * 1024       # output is yielded in pieces of about this size
+COLUMNAR_BLOCK_ROWS = 1000    # readings per columnar line
+GZIP_LEVEL = 6
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    if value is True or value is False:
+        return '1' if value else '0'
+    return str(value)
+
+
+def _tagged(store, device, start, end, fields):
+    for reading in store.query(device, start, end, fields=fields):
+        yield reading['ts'], device, reading
+
+
+def _merged(store, devices, start, end, fields):
+    """(ts, device, reading) for all devices, interleaved by timestamp."""
+    return heapq.merge(*[_tagged(store, device, start, end, fields) for device in devices],
+                       key=lambda item: item[0])
+
+
+def _csv_lines(store, devices, start, end, fields):
+    yield ','.join(('ts', 'device') + fields) + '\n'
+    for ts, device, reading in _merged(store, devices, start, end, fields):
+        cells = [repr(ts), device]
+        cells += [_csv_cell(reading.get(name)) for name in fields]
+        yield ','.join(cells) + '\n'
+
+
+def _ndjson_lines(store, devices, start, end, fields):
+    for ts, device, reading in _merged(store, devices, start, end, fields):
+        row = {'device': device, 'ts': ts}
+        for name in fields:
+            if name in reading:
+                row[name] = reading[name]
+        yield json.dumps(row, separators=(',', ':')) + '\n'
+
+
+def _columnar_lines(store, devices, start, end, fields, block_rows=COLUMNAR_BLOCK_ROWS):
+    for device in devices:
+        columns = {name: [] for name in ('ts',) + fields}
+        for reading in store.query(device, start, end, fields=fields):
+            for name, column in columns.items():
+                column.append(reading.get(name))
+            if len(columns['ts']) >= block_rows:
+                yield json.dumps({'device': device, 'columns': columns}, separators=(',', ':')) + '\n'
+                columns = {name: [] for name in columns}
+        if columns['ts']:
+            yield json.dumps({'device': device, 'columns': columns}, separators=(',', ':')) + '\n'
+
+
+_WRITERS = {'csv': _csv_lines, 'ndjson': _ndjson_lines, 'columnar': _columnar_lines}
+
+
+def export(store, devices=None, start=None, end=None, fmt='csv', fields=None, gzip=False,
+           chunk_bytes=CHUNK_BYTES):
+    """
+    Yield the export as byte chunks.
+
+    `devices` defaults to every device in the store and `fields` to all
+    FIELDS; `start`/`end` are unix timestamps (inclusive, open if None).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    fields = tuple(FIELDS if not fields else fields)
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    devices = store.devices() if devices is None else list(devices)
+    start = -math.inf if start is None else start
+    end = math.inf if end is None else end
+    lines = _WRITERS[fmt](store, devices, start, end, fields)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            data = ''.join(pending).encode()
+            pending.clear()
+            size = 0
+            if compressor is not None:
+                data = compressor.compress(data)
+                if not data:
+                    continue        # zlib is still filling its window
+            yield data
+    data = ''.join(pending).encode()
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def filename(fmt, gzip=False):
+    return f"sensor-export.{EXTENSIONS[fmt]}{'.gz' if gzip else ''}"
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from sensor_store import STORE_DIR, SensorStore
+
+    parser = argparse.ArgumentParser(description='Export stored sensor readings')
+    parser.add_argument('--store', default=str(STORE_DIR))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--device', action='append', help='device to export (repeatable; default all)')
+    parser.add_argument('--from', dest='start', type=float)
+    parser.add_argument('--to', dest='end', type=float)
+    parser.add_argument('--fields', help='comma-separated subset of ' + ','.join(FIELDS))
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+
+    export_store = SensorStore(args.store)
+    try:
+        for chunk in export(export_store, args.device, args.start, args.end, args.format,
+                            args.fields.split(',') if args.fields else None, args.gzip):
+            sys.stdout.buffer.write(chunk)
+    finally:
+        export_store.close()
@@ -0,0 +1,308 @@
+"""
+Decoding of sensor payloads posted to the sensor API.
+
+A single reading is a JSON object such as
+
+    {"temp": 21.5, "humi": 48.0, "moisture_percent": 37.2, "raw": 41230, "relay": false}
+
+A batch carries many timestamped readings, either as rows
+
+    [{"ts": 1760000000, "temp": 21.5, ...}, ...]
+    {"device": "bed2", "readings": [{"ts": 1760000000, "temp": 21.5, ...}, ...]}
+
+or in a compact columnar form, one list per field (null where a reading has
+no value for that field):
+
+    {"device": "bed2", "columns": {"ts": [1760000000, 1760000060], "temp": [21.5, 21.6]}}
+
+Each batched reading needs a `ts` (unix seconds) or an `age` (seconds before
+the batch was sent, for devices without a synced clock).
+
+Devices can also send readings as fixed-size binary records
+(Content-Type: application/x-sensor-struct), one record for a single
+reading or several back to back for a batch. Each 21-byte little-endian
+record is
+
+    B  schema version (1)
+    B  flags: which of the fields below are present
+    I  ts (unix seconds)
+    f  temp
+    f  humi
+    f  moisture_percent
+    H  raw ADC value
+    B  bits: bit 0 relay, bit 1 moisture
+
+pico-w/experiments/02/02-main.py has the matching MicroPython encoder.
+Compare sizes and encode/decode times against JSON with:
+
+    python sensor_payloads.py
+"""
+
+import math
+import struct
+import time
+
+MAX_BATCH_READINGS = 10000
+MAX_FUTURE_SKEW = 300.0      # seconds a reading may be ahead of the Pi's clock
+MAX_BATCH_ERRORS = 20        # rejected readings described in a batch response
+
+BINARY_CONTENT_TYPE = 'application/x-sensor-struct'
+BINARY_VERSION = 1
+BINARY_RECORD = struct.Struct('<BBIfffHB')
+FLAG_TS = 0x01
+FLAG_TEMP = 0x02
+FLAG_HUMI = 0x04
+FLAG_MOISTURE_PERCENT = 0x08
+FLAG_RAW = 0x10
+FLAG_RELAY = 0x20
+FLAG_MOISTURE = 0x40
+
+
+TRUE_STRINGS = ('1', 'true', 'yes', 'on')
+FALSE_STRINGS = ('0', 'false', 'no', 'off')
+
+
+def parse_bool(value):
+    """JSON true/false, 0/1 or a string such as "false"/"on"; raises ValueError otherwise."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in TRUE_STRINGS:
+            return True
+        if text in FALSE_STRINGS:
+            return False
+    raise ValueError(f'not a boolean: {value!r}')
+
+
+def _convert(payload, key, convert, strict):
+    try:
+        return convert(payload[key])
+    except Exception:
+        if strict:
+            raise ValueError(f'invalid {key}: {payload[key]!r}')
+        return None
+
+
+def parse_payload(payload, strict=False):
+    """
+    Turn a JSON object into a reading dict.
+
+    Malformed fields are skipped, or raise ValueError when `strict`.
+    Null values count as missing.
+    """
+    payload = {k: v for k, v in payload.items() if v is not None}
+    reading = {}
+    # Update temp/humi if present
+    for key in ('temp', 'humi'):
+        if key in payload:
+            value = _convert(payload, key, float, strict)
+            if value is not None:
+                reading[key] = value
+
+    # Accept explicit moisture (0/1)
+    if 'moisture' in payload:
+        value = _convert(payload, 'moisture', int, strict)
+        if value is not None:
+            reading['moisture'] = value
+    # Or accept moisture_percent and map to 0/1 using a 50% threshold
+    elif 'moisture_percent' in payload:
+        mp = _convert(payload, 'moisture_percent', float, strict)
+        if mp is not None:
+            reading['moisture'] = 0 if mp <= 50.0 else 1
+            # also store the raw percent for richer UI if desired
+            reading['moisture_percent'] = round(mp, 1)
+
+    # Raw ADC value and pump relay state sent by the Pico W telemetry
+    if 'raw' in payload:
+        value = _convert(payload, 'raw', int, strict)
+        if value is not None:
+            reading['raw'] = value
+    if 'relay' in payload:
+        # Not bool(): the string "false" would count as on
+        value = _convert(payload, 'relay', parse_bool, strict)
+        if value is not None:
+            reading['relay'] = value
+    return reading
+
+
+def _batch_rows(body):
+    """Normalise a batch body to (device or None, list of row dicts)."""
+    if isinstance(body, list):
+        return None, body
+    if not isinstance(body, dict):
+        raise ValueError('expected a json array or object')
+    device = body.get('device')
+    if 'readings' in body:
+        rows = body['readings']
+        if not isinstance(rows, list):
+            raise ValueError('readings must be an array')
+        return device, rows
+    columns = body.get('columns')
+    if not isinstance(columns, dict) or not columns:
+        raise ValueError('expected "readings" or "columns"')
+    lengths = {len(col) if isinstance(col, list) else -1 for col in columns.values()}
+    if len(lengths) != 1 or -1 in lengths:
+        raise ValueError('columns must be arrays of equal length')
+    names = list(columns)
+    return device, [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def _timestamp(row, now):
+    if row.get('ts') is not None:
+        ts = float(row['ts'])
+    elif row.get('age') is not None:
+        ts = now - float(row['age'])
+    else:
+        raise ValueError('missing ts')
+    if not math.isfinite(ts) or ts <= 0:
+        raise ValueError(f'invalid ts: {ts!r}')
+    if ts > now + MAX_FUTURE_SKEW:
+        raise ValueError(f'ts {ts} is in the future')
+    return ts
+
+
+def parse_batch(body, now=None):
+    """
+    Validate a batch body.
+
+    Returns (device or None, [(ts, reading)] sorted by ts, errors) where
+    errors is a list of {'index', 'error'} for rejected readings. Raises
+    ValueError if the body as a whole is malformed.
+    """
+    now = time.time() if now is None else now
+    device, rows = _batch_rows(body)
+    if len(rows) > MAX_BATCH_READINGS:
+        raise ValueError(f'too many readings (max {MAX_BATCH_READINGS})')
+    accepted = []
+    errors = []
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('expected an object')
+            ts = _timestamp(row, now)
+            reading = parse_payload(row, strict=True)
+            if not reading:
+                raise ValueError('no sensor fields')
+        except (TypeError, ValueError) as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        accepted.append((ts, reading))
+    accepted.sort(key=lambda item: item[0])
+    return device, accepted, errors
+
+
+def encode_binary(reading):
+    """Pack a reading dict (optionally with 'ts') into one binary record."""
+    flags = bits = 0
+    values = []
+    for key, flag in (('ts', FLAG_TS), ('temp', FLAG_TEMP), ('humi', FLAG_HUMI),
+                      ('moisture_percent', FLAG_MOISTURE_PERCENT), ('raw', FLAG_RAW)):
+        value = reading.get(key)
+        if value is not None:
+            flags |= flag
+        values.append(value or 0)
+    if reading.get('relay') is not None:
+        flags |= FLAG_RELAY
+        bits |= 0x1 if reading['relay'] else 0
+    if reading.get('moisture') is not None:
+        flags |= FLAG_MOISTURE
+        bits |= 0x2 if reading['moisture'] else 0
+    ts, temp, humi, mp, raw = values
+    return BINARY_RECORD.pack(BINARY_VERSION, flags, int(ts), temp, humi, mp, int(raw), bits)
+
+
+def decode_binary(data):
+    """
+    Unpack concatenated binary records into payload dicts.
+
+    The dicts use the JSON field names, so they go through the same
+    parse_payload/parse_batch validation as JSON bodies.
+    """
+    if not data or len(data) % BINARY_RECORD.size:
+        raise ValueError(f'body must be a multiple of {BINARY_RECORD.size} bytes')
+    if len(data) // BINARY_RECORD.size > MAX_BATCH_READINGS:
+        raise ValueError(f'too many readings (max {MAX_BATCH_READINGS})')
+    rows = []
+    for version, flags, ts, temp, humi, mp, raw, bits in BINARY_RECORD.iter_unpack(data):
+        if version != BINARY_VERSION:
+            raise ValueError(f'unsupported record version {version}')
+        row = {}
+        if flags & FLAG_TS:
+            row['ts'] = ts
+        if flags & FLAG_TEMP:
+            row['temp'] = round(temp, 2)
+        if flags & FLAG_HUMI:
+            row['humi'] = round(humi, 2)
+        if flags & FLAG_MOISTURE_PERCENT:
+            row['moisture_percent'] = round(mp, 1)
+        if flags & FLAG_RAW:
+            row['raw'] = raw
+        if flags & FLAG_RELAY:
+            row['relay'] = bool(bits & 0x1)
+        if flags & FLAG_MOISTURE:
+            row['moisture'] = (bits >> 1) & 0x1
+        rows.append(row)
+    return rows
+
+
+def compare_formats(iterations=20000, batch_size=100):
+    """Size and encode/decode time of JSON vs binary for a typical telemetry reading."""
+    import json
+
+    reading = {'raw': 41230, 'moisture_percent': 37.2, 'relay': False, 'ts': 1760000000}
+    batch = [dict(reading, ts=reading['ts'] + 60 * i) for i in range(batch_size)]
+
+    def timed(fn):
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - t0) / iterations * 1e6
+
+    json_single = json.dumps(reading).encode()
+    binary_single = encode_binary(reading)
+    json_batch = json.dumps(batch).encode()
+    binary_batch = b''.join(encode_binary(r) for r in batch)
+    batch_iterations = max(1, iterations // batch_size)
+
+    def timed_batch(fn):
+        t0 = time.perf_counter()
+        for _ in range(batch_iterations):
+            fn()
+        return (time.perf_counter() - t0) / batch_iterations * 1e6
+
+    return {
+        'single': {
+            'json_bytes': len(json_single),
+            'binary_bytes': len(binary_single),
+            'json_encode_us': round(timed(lambda: json.dumps(reading).encode()), 2),
+            'binary_encode_us': round(timed(lambda: encode_binary(reading)), 2),
+            'json_decode_us': round(timed(lambda: parse_payload(json.loads(json_single))), 2),
+            'binary_decode_us': round(timed(lambda: parse_payload(decode_binary(binary_single)[0])), 2),
+        },
+        f'batch_{batch_size}': {
+            'json_bytes': len(json_batch),
+            'binary_bytes': len(binary_batch),
+            'json_encode_us': round(timed_batch(lambda: json.dumps(batch).encode()), 2),
+            'binary_encode_us': round(timed_batch(
+                lambda: b''.join(encode_binary(r) for r in batch)), 2),
+            'json_decode_us': round(timed_batch(lambda: parse_batch(json.loads(json_batch))), 2),
+            'binary_decode_us': round(timed_batch(lambda: parse_batch(decode_binary(binary_batch))), 2),
+        },
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare JSON and binary sensor payloads')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    for name, result in compare_formats(args.iterations, args.batch_size).items():
+        print(f"{name}:")
+        for key, value in result.items():
+            print(f"  {key}: {value}")
@@ -0,0 +1,133 @@
+"""
+Per-device sensor state keyed by device id.
+
+Each device has an immutable DeviceState snapshot (latest values, version,
+last-seen time, source). An update builds a new snapshot from the old one and
+swaps the reference in the registry dict, so readers never take a lock and
+never see a half-applied reading. Writers to the same device serialize on a
+per-device lock (writers to different devices don't contend), and the cost of
+an update is independent of the number of devices.
+
+Callers waiting for a device to change (long-poll) block on a shared
+condition and re-check that device's version when woken.
+"""
+
+import re
+import threading
+import time
+
+DEVICE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def valid_device_id(device):
+    return bool(device) and DEVICE_ID_PATTERN.match(device) is not None
+
+
+class DeviceState:
+    __slots__ = ('device', 'values', 'version', 'last_seen', 'source', 'updates')
+
+    def __init__(self, device, values, version=0, last_seen=None, source=None, updates=0):
+        self.device = device
+        self.values = values          # never mutated once published
+        self.version = version
+        self.last_seen = last_seen
+        self.source = source
+        self.updates = updates
+
+    def age(self, now=None):
+        """Seconds since the last reading, or None if the device never reported."""
+        if self.last_seen is None:
+            return None
+        return (time.time() if now is None else now) - self.last_seen
+
+    def is_stale(self, stale_after, now=None):
+        age = self.age(now)
+        return age is None or age > stale_after
+
+    def as_dict(self, now=None, stale_after=None):
+        age = self.age(now)
+        out = {
+            'values': self.values,
+            'version': self.version,
+            'last_seen': self.last_seen,
+            'age_s': round(age, 3) if age is not None else None,
+            'source': self.source,
+            'updates': self.updates,
+        }
+        if stale_after is not None:
+            out['stale'] = self.is_stale(stale_after, now)
+        return out
+
+
+class DeviceRegistry:
+    def __init__(self, initial_values=None):
+        # Values every new device starts from (keeps /pico/sensors' shape stable)
+        self.initial_values = dict(initial_values or {})
+        self._states = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._changed = threading.Condition()
+
+    def _lock_for(self, device):
+        lock = self._locks.get(device)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(device, threading.Lock())
+        return lock
+
+    def get(self, device):
+        """Latest DeviceState for a device, or None if it never reported."""
+        return self._states.get(device)
+
+    def values(self, device):
+        state = self._states.get(device)
+        return state.values if state is not None else dict(self.initial_values)
+
+    def devices(self):
+        return sorted(self._states)
+
+    def snapshot(self):
+        """{device: DeviceState} at one point in time."""
+        return dict(self._states)
+
+    def ensure(self, device):
+        """Register a device with the initial values so it is listed before its first reading."""
+        with self._lock_for(device):
+            if device not in self._states:
+                self._states[device] = DeviceState(device, dict(self.initial_values))
+
+    def update(self, device, reading, ts=None, source=None, count=1):
+        """
+        Apply a reading to a device and return the fields whose value changed.
+
+        The version only moves when something changed, so it can be used as
+        an ETag for the device's values. `count` is the number of readings
+        `reading` stands for (a batch is applied as its merged latest values).
+        """
+        ts = time.time() if ts is None else ts
+        with self._lock_for(device):
+            old = self._states.get(device)
+            old_values = old.values if old is not None else self.initial_values
+            missing = object()
+            changed = {k: v for k, v in reading.items() if old_values.get(k, missing) != v}
+            if old is None or changed:
+                values = dict(old_values)
+                values.update(reading)
+            else:
+                values = old.values
+            version = (old.version if old is not None else 0) + (1 if changed else 0)
+            updates = (old.updates if old is not None else 0) + count
+            self._states[device] = DeviceState(device, values, version, ts, source, updates)
+        if changed:
+            with self._changed:
+                self._changed.notify_all()
+        return changed
+
+    def wait_for_change(self, device, since, timeout):
+        """Block until the device's version differs from `since` or the timeout expires."""
+        def moved():
+            state = self._states.get(device)
+            return (state.version if state is not None else 0) != since
+
+        with self._changed:
+            return self._changed.wait_for(moved, timeout=timeout)
@@ -0,0 +1,230 @@
+"""
+Tiered retention for the sensor history.
+
+Readings are kept at full resolution for RAW_RETENTION and as rollups for
+as long as ROLLUP_RETENTION says per resolution (None = forever):
+
+    raw        14 days     sensor_history/ segments and blocks, sensors.db rows
+    1 minute   90 days     rollups/<device>/60/
+    1 hour     forever     rollups/<device>/3600/
+    1 day      forever     rollups/<device>/86400/
+
+Rollups are built as readings arrive (sensor_rollups.py), so downsampling
+costs nothing here. A RetentionTask thread wakes every COMPACTION_INTERVAL
+seconds and, one bounded step at a time with a STEP_PAUSE between steps:
+
+    1. snapshots the rollups, then compresses sealed segments that snapshot
+       covers into block files, one file per step (blocks are sorted by ts,
+       so a crash replay could not find late readings in them otherwise)
+    2. deletes raw files whose newest reading is past RAW_RETENTION *and*
+       covered by that snapshot, one file per step
+    3. drops expired rollup rows, ROLLUP_CHUNK rows per table per step
+    4. deletes expired SQLite rows, PRUNE_CHUNK rows per transaction
+
+Each step holds a lock only for a list swap or one small transaction, so
+ingestion and queries never wait for a whole cleanup. Once every tier has
+filled, storage stays flat apart from the hourly and daily rollups (about
+1 MB per device per year).
+
+    python sensor_retention.py            # one pass over the on-disk history
+"""
+
+import threading
+import time
+from pathlib import Path
+
+from sensor_db import PRUNE_CHUNK
+
+DAY = 86400
+RAW_RETENTION = 14 * DAY       # seconds of full-resolution readings kept
+# Seconds of rollup rows kept per resolution (None = keep forever). Rollup
+# tables live in RAM (128 bytes per row and device), so 90 days of 1-minute
+# rows cost ~16 MB per device.
+ROLLUP_RETENTION = {60: 90 * DAY, 3600: None, 86400: None}
+COMPACTION_INTERVAL = 300.0    # seconds between passes
+STEP_PAUSE = 0.05              # seconds slept between bounded steps of a pass
+ROLLUP_CHUNK = 10000           # rollup rows dropped per table and step
+
+
+def directory_bytes(path):
+    """Total size of the files under `path` (0 if it does not exist)."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    if path.exists():
+        for f in path.rglob('*'):
+            try:
+                if f.is_file():
+                    total += f.stat().st_size
+            except FileNotFoundError:
+                pass        # expired while we walked
+    return total
+
+
+class RetentionTask:
+    """Compacts and expires the sensor history every `interval` seconds on a daemon thread."""
+
+    def __init__(self, store, rollups, db=None, raw_retention=RAW_RETENTION,
+                 rollup_retention=ROLLUP_RETENTION, interval=COMPACTION_INTERVAL):
+        self.store = store
+        self.rollups = rollups
+        self.db = db
+        self.raw_retention = raw_retention
+        self.rollup_retention = dict(rollup_retention)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_duration_s = None
+        self.last_error = None
+        self.compressed = 0
+        self.expired_files = 0
+        self.freed_bytes = 0
+        self.expired_rollup_rows = 0
+        self.pruned_rows = 0
+
+    def _pause(self):
+        # Returns True when stopping, so a pass ends between steps
+        return self._stop.wait(STEP_PAUSE)
+
+    def run_once(self, now=None):
+        """One full pass; returns what it did."""
+        now = time.time() if now is None else now
+        started = time.monotonic()
+        done = {'compressed': 0, 'expired_files': 0, 'freed_bytes': 0,
+                'expired_rollup_rows': 0, 'pruned_rows': 0}
+
+        # Raw files may only be compressed or deleted once the rollups built
+        # from them are on disk; otherwise a crash would leave nothing to
+        # rebuild them from
+        self.rollups.save()
+        covered = {device: self.rollups.saved_position(device) for device in self.store.devices()}
+        while not self._stop.is_set() and self.store.compress_sealed(max_segments=1, upto=covered):
+            done['compressed'] += 1
+            self._pause()
+
+        cutoff = now - self.raw_retention
+        for device in self.store.devices():
+            if covered.get(device) is None:
+                continue
+            while not self._stop.is_set():
+                files, freed = self.store.expire_sealed(cutoff, device, max_files=1, upto=covered[device])
+                if not files:
+                    break
+                done['expired_files'] += files
+                done['freed_bytes'] += freed
+                self._pause()
+
+        while not self._stop.is_set():
+            rows = self.rollups.expire(self.rollup_retention, now, ROLLUP_CHUNK)
+            done['expired_rollup_rows'] += rows
+            if not rows:
+                break
+            self._pause()
+
+        if self.db is not None:
+            while not self._stop.is_set():
+                rows = self.db.prune(cutoff, max_rows=PRUNE_CHUNK)
+                done['pruned_rows'] += rows
+                if rows < PRUNE_CHUNK:
+                    break
+                self._pause()
+
+        self.compressed += done['compressed']
+        self.expired_files += done['expired_files']
+        self.freed_bytes += done['freed_bytes']
+        self.expired_rollup_rows += done['expired_rollup_rows']
+        self.pruned_rows += done['pruned_rows']
+        self.runs += 1
+        self.last_run = now
+        self.last_duration_s = round(time.monotonic() - started, 3)
+        return done
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                print(f"Sensor history compaction failed: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.time() - started)))
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='sensor-retention')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def usage(self):
+        """Bytes on disk per tier."""
+        out = {'raw': directory_bytes(self.store.directory),
+               'rollups': directory_bytes(self.rollups.directory)}
+        if self.db is not None:
+            out['db'] = sum(directory_bytes(self.db.path + suffix) for suffix in ('', '-wal', '-shm'))
+        return out
+
+    def status(self):
+        return {
+            'running': self.running(),
+            'interval_s': self.interval,
+            'raw_retention_s': self.raw_retention,
+            'rollup_retention_s': {str(r): keep for r, keep in sorted(self.rollup_retention.items())},
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run': self.last_run,
+            'last_duration_s': self.last_duration_s,
+            'last_error': self.last_error,
+            'compressed_segments': self.compressed,
+            'expired_files': self.expired_files,
+            'freed_bytes': self.freed_bytes,
+            'expired_rollup_rows': self.expired_rollup_rows,
+            'pruned_db_rows': self.pruned_rows,
+            'rollup_snapshots': self.rollups.snapshots,
+            'last_rollup_snapshot_bytes': self.rollups.last_snapshot_bytes,
+            'last_rollup_snapshot_ms': self.rollups.last_snapshot_ms,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from sensor_db import SENSOR_DB, SensorDatabase
+    from sensor_rollups import ROLLUP_DIR, SensorRollups
+    from sensor_store import STORE_DIR, SensorStore
+
+    parser = argparse.ArgumentParser(description='Compact and expire the stored sensor history once')
+    parser.add_argument('--store', default=str(STORE_DIR))
+    parser.add_argument('--rollups', default=str(ROLLUP_DIR))
+    parser.add_argument('--db', default=str(SENSOR_DB))
+    parser.add_argument('--raw-days', type=float, default=RAW_RETENTION / DAY)
+    args = parser.parse_args()
+
+    cli_store = SensorStore(args.store)
+    cli_rollups = SensorRollups(args.rollups)
+    cli_rollups.catch_up(cli_store)
+    cli_db = SensorDatabase(args.db) if Path(args.db).exists() else None
+    task = RetentionTask(cli_store, cli_rollups, cli_db, args.raw_days * DAY)
+    try:
+        before = task.usage()
+        print(json.dumps({'before': before, 'done': task.run_once(), 'after': task.usage()}, indent=2))
+    finally:
+        cli_rollups.save()
+        cli_store.close()
+        if cli_db is not None:
+            cli_db.close()
@@ -0,0 +1,515 @@
+"""
+Incremental min/max/mean/count rollups of sensor readings.
+
+Every ingested reading is folded into per-device rollup tables at several
+resolutions (1 minute, 1 hour, 1 day). Each table is column-oriented: one
+`array` of bucket start times plus count/sum/min/max arrays per field, kept
+sorted by bucket start. In-order readings only touch the last row; late
+readings are placed with a binary search.
+
+A bucketed query picks the coarsest resolution that evenly divides the
+requested bucket size and still covers the requested range, then merges
+rollup rows into the requested buckets. The number of rows read depends on
+range / resolution, not on how many raw samples were stored, so query
+latency stays flat as history grows.
+
+Tables are snapshotted by a background thread every SNAPSHOT_INTERVAL
+seconds, in partitions of PARTITION_ROWS rows:
+
+    rollups/<device>/<resolution>/<partition>.bin
+    rollups/<device>/watermark
+
+Only partitions changed since the last snapshot are rewritten (normally the
+newest one of each table, a few KB), and the watermark is written last: the
+newest ts covered and the sensor store position (see sensor_store.py) up to
+which every reading is folded in. At startup the readings that arrived after
+that position are replayed from the store, including a backlog older than the
+newest ts; a partition saved after the watermark (a snapshot cut short by a
+crash) skips the readings it already holds. Old rows are dropped by
+expire(), which sensor_retention.py calls with the retention of each
+resolution; the next snapshot deletes partitions left empty.
+"""
+
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from sensor_store import FIELDS, safe_device_name
+
+ROLLUP_DIR = Path(__file__).parent / 'rollups'
+RESOLUTIONS = (60, 3600, 86400)
+SNAPSHOT_INTERVAL = 60.0
+PARTITION_ROWS = 120          # buckets per snapshot file (2 h of 1-minute rows, ~15 KB)
+
+SNAPSHOT_HEADER = struct.Struct('<4sHIId')   # magic, version, resolution, rows, watermark
+POSITION = struct.Struct('<qq')              # store position (seq, index) after the header since version 3
+SNAPSHOT_MAGIC = b'PROL'
+SNAPSHOT_VERSION = 3          # 1 was one file per table, 2 had no position; both still read
+WATERMARK = struct.Struct('<dqq')            # newest ts, store position; version 2 files hold only the ts
+NO_POSITION = (-1, 0)
+
+
+class RollupTable:
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.span = resolution * PARTITION_ROWS
+        self.dirty = set()      # partitions changed since the last snapshot
+        self.saved = set()      # partitions with a file on disk
+        self.replayed = {}      # partition -> (watermark, position) it was saved with, while catching up
+        self.starts = array('d')
+        self.count = {f: array('I') for f in FIELDS}
+        self.total = {f: array('d') for f in FIELDS}
+        self.min = {f: array('f') for f in FIELDS}
+        self.max = {f: array('f') for f in FIELDS}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _row(self, bucket):
+        n = len(self.starts)
+        if n and self.starts[-1] == bucket:
+            return n - 1
+        i = n if not n or bucket > self.starts[-1] else bisect_left(self.starts, bucket)
+        if i < n and self.starts[i] == bucket:
+            return i
+        self.starts.insert(i, bucket)
+        for f in FIELDS:
+            self.count[f].insert(i, 0)
+            self.total[f].insert(i, 0.0)
+            self.min[f].insert(i, math.inf)
+            self.max[f].insert(i, -math.inf)
+        return i
+
+    def add(self, ts, values, position=None):
+        bucket = math.floor(ts / self.resolution) * self.resolution
+        key = int(bucket // self.span)
+        if self.replayed and key in self.replayed:
+            wm, saved_at = self.replayed[key]
+            if position is not None and saved_at is not None:
+                if position <= saved_at:
+                    return      # arrived before this partition's snapshot
+            elif ts <= wm:
+                return          # already in this partition's snapshot
+        self.dirty.add(key)
+        i = self._row(bucket)
+        for f, v in values.items():
+            if v is None or f not in self.count:
+                continue
+            v = float(v)
+            self.count[f][i] += 1
+            self.total[f][i] += v
+            if v < self.min[f][i]:
+                self.min[f][i] = v
+            if v > self.max[f][i]:
+                self.max[f][i] = v
+
+    def expire(self, before, max_rows=None):
+        """Drop up to `max_rows` of the oldest rows starting before `before`; returns how many."""
+        n = bisect_left(self.starts, before)
+        if max_rows is not None:
+            n = min(n, max_rows)
+        if n:
+            del self.starts[:n]
+            for f in FIELDS:
+                del self.count[f][:n]
+                del self.total[f][:n]
+                del self.min[f][:n]
+                del self.max[f][:n]
+            if self.starts:
+                # The oldest partition may have lost only some rows
+                self.dirty.add(int(self.starts[0] // self.span))
+        return n
+
+    def extend(self, other):
+        """Append the rows of `other`, which all start after ours."""
+        self.starts.extend(other.starts)
+        for f in FIELDS:
+            self.count[f].extend(other.count[f])
+            self.total[f].extend(other.total[f])
+            self.min[f].extend(other.min[f])
+            self.max[f].extend(other.max[f])
+
+    def oldest(self):
+        return self.starts[0] if self.starts else None
+
+    def rows(self, start, end):
+        """Row indexes whose bucket lies within [start, end]."""
+        lo = 0
+        if math.isfinite(start):
+            lo = bisect_left(self.starts, math.floor(start / self.resolution) * self.resolution)
+        hi = bisect_left(self.starts, end + 1e-9 if math.isfinite(end) else math.inf)
+        return range(lo, hi)
+
+    def partition_bytes(self, key, watermark, position=None):
+        """Snapshot of the rows in partition `key`, or None if it has none."""
+        lo = bisect_left(self.starts, key * self.span)
+        hi = bisect_left(self.starts, (key + 1) * self.span)
+        if lo == hi:
+            return None
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.resolution,
+                                      hi - lo, watermark),
+                 POSITION.pack(*(position or NO_POSITION)), self.starts[lo:hi].tobytes()]
+        for f in FIELDS:
+            parts += [self.count[f][lo:hi].tobytes(), self.total[f][lo:hi].tobytes(),
+                      self.min[f][lo:hi].tobytes(), self.max[f][lo:hi].tobytes()]
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, resolution, rows, watermark = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version not in (1, 2, SNAPSHOT_VERSION):
+            raise ValueError('not a rollup snapshot')
+        table = cls(resolution)
+        offset = SNAPSHOT_HEADER.size
+        position = None
+        if version >= 3:
+            position = POSITION.unpack_from(data, offset)
+            offset += POSITION.size
+            if position == NO_POSITION:
+                position = None
+
+        def take(arr):
+            nonlocal offset
+            size = rows * arr.itemsize
+            arr.frombytes(data[offset:offset + size])
+            offset += size
+
+        take(table.starts)
+        for f in FIELDS:
+            take(table.count[f])
+            take(table.total[f])
+            take(table.min[f])
+            take(table.max[f])
+        return table, watermark, position
+
+
+def _finish(acc):
+    c, total, lo, hi = acc
+    if not c:
+        return None
+    return {'count': c, 'mean': round(total / c, 3), 'min': round(lo, 3), 'max': round(hi, 3)}
+
+
+def aggregate_readings(readings, fields, bucket, max_buckets=None):
+    """
+    Bucket raw readings directly, for bucket sizes no rollup table divides.
+
+    Raises ValueError as soon as more than `max_buckets` buckets are needed,
+    so an open-ended range stops scanning instead of reading all history.
+    """
+    out = []
+    current = None
+    for reading in readings:
+        b = math.floor(reading['ts'] / bucket) * bucket
+        if current is None or current['ts'] != b:
+            if max_buckets is not None and len(out) >= max_buckets:
+                raise ValueError(f'too many buckets (max {max_buckets})')
+            current = {'ts': b, '_acc': {f: [0, 0.0, math.inf, -math.inf] for f in fields}}
+            out.append(current)
+        for f in fields:
+            v = reading.get(f)
+            if v is None:
+                continue
+            acc = current['_acc'][f]
+            acc[0] += 1
+            acc[1] += float(v)
+            acc[2] = min(acc[2], float(v))
+            acc[3] = max(acc[3], float(v))
+    for row in out:
+        for f, acc in row.pop('_acc').items():
+            row[f] = _finish(acc)
+    return out
+
+
+class SensorRollups:
+    def __init__(self, directory=ROLLUP_DIR, resolutions=RESOLUTIONS):
+        self.directory = Path(directory)
+        self.resolutions = tuple(sorted(resolutions))
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()     # one save() at a time
+        self._tables = {}       # device -> {resolution: RollupTable}
+        self._watermark = {}    # device -> newest ts folded in
+        self._position = {}     # device -> store position up to which every reading is folded in
+        self._saved = {}        # device -> watermark of the last snapshot on disk
+        self._saved_position = {}
+        self._legacy = []       # version 1 snapshot files, removed after the first save
+        self._stop = threading.Event()
+        self._thread = None
+        self.snapshots = 0
+        self.last_snapshot_bytes = 0
+        self.last_snapshot_ms = None
+        self._load()
+
+    def _new_tables(self):
+        return {r: RollupTable(r) for r in self.resolutions}
+
+    def _load_file(self, path):
+        try:
+            return RollupTable.from_bytes(path.read_bytes())
+        except (ValueError, struct.error) as e:
+            print(f"Ignoring unreadable rollup snapshot {path}: {e}")
+            return None, None, None
+
+    def _load(self):
+        if not self.directory.exists():
+            return
+        for sub in self.directory.iterdir():
+            if not sub.is_dir():
+                continue
+            tables = self._new_tables()
+            watermark = position = None
+            marker = sub / 'watermark'
+            if marker.exists():
+                data = marker.read_bytes()
+                if len(data) >= WATERMARK.size:
+                    watermark, *position = WATERMARK.unpack_from(data)
+                    position = None if tuple(position) == NO_POSITION else tuple(position)
+                else:
+                    watermark, = struct.unpack_from('<d', data)
+            for r, table in tables.items():
+                legacy = sub / f'{r}.bin'
+                migrate = legacy.exists() and not marker.exists()
+                if legacy.exists():
+                    self._legacy.append(legacy)
+                if migrate:
+                    # Version 1 snapshot: load it whole, the next save splits it into partitions
+                    old, wm, _ = self._load_file(legacy)
+                    if old is not None:
+                        table.extend(old)
+                        table.dirty.update(int(start // table.span) for start in old.starts)
+                        watermark = wm if watermark is None else min(watermark, wm)
+                partitions = sub / str(r)
+                if not partitions.is_dir():
+                    continue
+                for path in sorted(partitions.glob('*.bin')):
+                    part, wm, saved_at = self._load_file(path)
+                    if part is None:
+                        continue
+                    key = int(path.stem)
+                    table.saved.add(key)
+                    if migrate:
+                        continue
+                    table.extend(part)
+                    if position is not None and saved_at is not None:
+                        newer = saved_at > position
+                    else:
+                        newer = watermark is None or wm > watermark
+                    if newer:
+                        table.replayed[key] = (wm, saved_at)
+            self._tables[sub.name] = tables
+            if watermark is not None:
+                self._watermark[sub.name] = watermark
+                self._saved[sub.name] = watermark
+            if position is not None:
+                self._position[sub.name] = position
+                self._saved_position[sub.name] = position
+
+    def catch_up(self, store):
+        """
+        Fold in readings stored after the last snapshot (e.g. after a crash).
+
+        Must run before the store takes new readings (as start_storage() does).
+        """
+        for device in store.devices():
+            position = self._position.get(device)
+            if position is not None:
+                for after, reading in store.arrived_since(device, position):
+                    ts = reading.pop('ts')
+                    self.add(device, ts, reading, after)
+            else:
+                # Snapshot from before positions were kept: replay by ts
+                since = self._watermark.get(device)
+                for reading in store.query(device, None if since is None else since + 1e-6):
+                    ts = reading.pop('ts')
+                    self.add(device, ts, reading)
+            with self._lock:
+                self._position[device] = store.position(device)
+        with self._lock:
+            for tables in self._tables.values():
+                for table in tables.values():
+                    table.replayed.clear()
+
+    def add(self, device, ts, values, position=None):
+        self.add_many(device, [(ts, values)], position)
+
+    def add_many(self, device, readings, position=None):
+        """
+        Fold [(ts, values)] for a device into every resolution; `position` is
+        the store position just after them (SensorStore.append_many()).
+        """
+        with self._lock:
+            tables = self._tables.get(device)
+            if tables is None:
+                tables = self._tables[device] = self._new_tables()
+            for ts, values in readings:
+                for table in tables.values():
+                    table.add(ts, values, position)
+                if ts > self._watermark.get(device, -math.inf):
+                    self._watermark[device] = ts
+            if position is not None and position > self._position.get(device, NO_POSITION):
+                self._position[device] = position
+
+    def save(self):
+        """Write the partitions changed since the last save, then each device's watermark."""
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        t0 = time.perf_counter()
+        writes = []         # (path, bytes or None to delete)
+        taken = []          # (table, keys) to mark dirty again if writing fails
+        with self._lock:
+            watermarks = dict(self._watermark)
+            positions = dict(self._position)
+            for device, tables in self._tables.items():
+                sub = self.directory / safe_device_name(device)
+                wm = watermarks.get(device, 0.0)
+                position = positions.get(device)
+                changed = len(writes)
+                for r, table in tables.items():
+                    first = int(table.starts[0] // table.span) if table.starts else math.inf
+                    gone = {key for key in table.saved if key < first}
+                    keys = table.dirty | gone
+                    for key in sorted(keys):
+                        blob = table.partition_bytes(key, wm, position)
+                        writes.append((sub / str(r) / f'{key:08d}.bin', blob))
+                        if blob is None:
+                            table.saved.discard(key)
+                        else:
+                            table.saved.add(key)
+                    taken.append((table, table.dirty))
+                    table.dirty = set()
+                if (len(writes) > changed or wm != self._saved.get(device)
+                        or position != self._saved_position.get(device)):
+                    writes.append((sub / 'watermark', WATERMARK.pack(wm, *(position or NO_POSITION))))
+        written = 0
+        try:
+            for path, blob in writes:
+                if blob is None:
+                    path.unlink(missing_ok=True)
+                    continue
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(f'{path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+                tmp.write_bytes(blob)
+                tmp.replace(path)
+                written += len(blob)
+        except OSError:
+            with self._lock:
+                for table, keys in taken:
+                    table.dirty |= keys
+            raise
+        for path in self._legacy:
+            path.unlink(missing_ok=True)
+        self._legacy = []
+        with self._lock:
+            for device, wm in watermarks.items():
+                if wm > self._saved.get(device, -math.inf):
+                    self._saved[device] = wm
+            for device, position in positions.items():
+                if position > self._saved_position.get(device, NO_POSITION):
+                    self._saved_position[device] = position
+        self.snapshots += 1
+        self.last_snapshot_bytes = written
+        self.last_snapshot_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    def _loop(self):
+        while not self._stop.wait(SNAPSHOT_INTERVAL):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Rollup snapshot failed: {e}")
+
+    def start(self):
+        """Snapshot every SNAPSHOT_INTERVAL seconds on a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='rollup-snapshots')
+        self._thread.start()
+
+    def stop(self):
+        """Stop the snapshot thread and write a last snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.save()
+
+    def saved_position(self, device):
+        """Store position of `device` up to which a snapshot on disk covers every reading (None if unknown)."""
+        with self._lock:
+            return self._saved_position.get(device)
+
+    def expire(self, retention, now=None, max_rows=None):
+        """
+        Drop rows older than `retention` ({resolution: seconds or None to keep
+        forever}); at most `max_rows` per table. Returns the rows dropped.
+        """
+        now = time.time() if now is None else now
+        dropped = 0
+        with self._lock:
+            for tables in self._tables.values():
+                for r, table in tables.items():
+                    keep = retention.get(r)
+                    if keep is not None:
+                        dropped += table.expire(now - keep, max_rows)
+        return dropped
+
+    def choose_resolution(self, device, start, bucket):
+        """Coarsest resolution dividing `bucket` whose table reaches back to `start`."""
+        tables = self._tables.get(device, {})
+        candidates = [r for r in self.resolutions if r <= bucket and bucket % r == 0]
+        for r in reversed(candidates):
+            table = tables.get(r)
+            oldest = table.oldest() if table is not None else None
+            if oldest is not None and (start is None or oldest <= start):
+                return r
+        # No table covers the whole range: use the one reaching back furthest
+        best = None
+        for r in candidates:
+            table = tables.get(r)
+            if table is not None and len(table):
+                if best is None or table.oldest() < tables[best].oldest():
+                    best = r
+        return best
+
+    def aggregate(self, device, fields, start, end, bucket):
+        """
+        Merge rollup rows into `bucket`-second buckets.
+
+        Returns (resolution, buckets) where buckets is a list of
+        {'ts', field: {'count', 'mean', 'min', 'max'}}; resolution is None if
+        no rollup table can answer the query.
+        """
+        start = -math.inf if start is None else start
+        end = math.inf if end is None else end
+        with self._lock:
+            resolution = self.choose_resolution(device, start if math.isfinite(start) else None, bucket)
+            if resolution is None:
+                return None, []
+            table = self._tables[device][resolution]
+            out = []
+            current = None
+            for i in table.rows(start, end):
+                b = math.floor(table.starts[i] / bucket) * bucket
+                if current is None or current['ts'] != b:
+                    current = {'ts': b, '_acc': {f: [0, 0.0, math.inf, -math.inf] for f in fields}}
+                    out.append(current)
+                for f in fields:
+                    c = table.count[f][i]
+                    if not c:
+                        continue
+                    acc = current['_acc'][f]
+                    acc[0] += c
+                    acc[1] += table.total[f][i]
+                    acc[2] = min(acc[2], table.min[f][i])
+                    acc[3] = max(acc[3], table.max[f][i])
+        for row in out:
+            for f, acc in row.pop('_acc').items():
+                row[f] = _finish(acc)
+        return resolution, out
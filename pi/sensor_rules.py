@@ -0,0 +1,472 @@
+"""
+Alert rules evaluated incrementally as sensor readings arrive.
+
+Each rule watches one field (or, for `missing`, a whole device):
+
+    threshold  {"type": "threshold", "field": "temp", "op": ">", "value": 30}
+    sustained  {"type": "sustained", "field": "moisture", "op": "==", "value": 0, "for": 60}
+               the condition held on every reading for at least `for` seconds
+    rate       {"type": "rate", "field": "temp", "op": ">", "value": 5, "window": 600}
+               change of the field over the last `window` seconds
+    missing    {"type": "missing", "after": 60}
+               no reading from the device for `after` seconds
+
+Every rule has a unique "name" and may limit itself to "devices": [...].
+Rules are indexed by field, so a reading only touches the rules that watch
+one of its fields, and each (rule, device) pair keeps O(1) state (the rate
+window is a deque trimmed from the left). History is never rescanned.
+
+Alerts are edge-triggered: one "firing" alert when a condition starts and
+one "resolved" alert when it ends. They are kept in a short in-memory log
+and handed to an optional WebhookNotifier, whose queue and delivery thread
+keep slow or unreachable webhooks off the ingestion path.
+
+    python sensor_rules.py stub --port 9000        # print alerts POSTed to it
+    python sensor_rules.py bench --rules 200 --devices 10
+"""
+
+import json
+import operator
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+RULE_TYPES = ('threshold', 'sustained', 'rate', 'missing')
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+             '==': operator.eq, '!=': operator.ne}
+RECENT_ALERTS = 200           # alerts kept for GET /pico/alerts
+MISSING_CHECK_INTERVAL = 1.0  # seconds between checks for devices that went quiet
+WEBHOOK_QUEUE_SIZE = 1000     # undelivered alerts kept before new ones are dropped
+WEBHOOK_TIMEOUT = 5.0
+WEBHOOK_RETRIES = 3
+
+# Mirrors the firmware: the Pico flashes orange when the soil is dry, shows
+# red above 30 °C and blue below 20 °C; the Pico W caps watering at 10 s
+DEFAULT_RULES = [
+    {'name': 'soil_dry', 'type': 'sustained', 'field': 'moisture', 'op': '==', 'value': 0, 'for': 60},
+    {'name': 'too_hot', 'type': 'threshold', 'field': 'temp', 'op': '>', 'value': 30},
+    {'name': 'too_cold', 'type': 'sustained', 'field': 'temp', 'op': '<', 'value': 20, 'for': 300},
+    {'name': 'temp_rising_fast', 'type': 'rate', 'field': 'temp', 'op': '>', 'value': 5, 'window': 600},
+    {'name': 'relay_stuck_on', 'type': 'sustained', 'field': 'relay', 'op': '==', 'value': True, 'for': 15},
+    {'name': 'sensor_missing', 'type': 'missing', 'after': 60},
+]
+
+
+def _number(value, key):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'{key}' must be a number")
+    return value
+
+
+class Rule:
+    __slots__ = ('name', 'type', 'field', 'op', 'op_name', 'value', 'duration', 'devices')
+
+    def __init__(self, name, type, field=None, op='>', value=None, duration=0.0, devices=None):
+        self.name = name
+        self.type = type
+        self.field = field
+        self.op_name = op
+        self.op = OPERATORS[op]
+        self.value = value
+        self.duration = duration      # 'for', 'window' or 'after' seconds, by type
+        self.devices = frozenset(devices) if devices else None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a rule from its JSON form; raises ValueError describing the problem."""
+        if not isinstance(data, dict):
+            raise ValueError('a rule must be an object')
+        name = data.get('name')
+        if not isinstance(name, str) or not name:
+            raise ValueError("'name' is required")
+        kind = data.get('type')
+        if kind not in RULE_TYPES:
+            raise ValueError(f"{name}: 'type' must be one of {', '.join(RULE_TYPES)}")
+        devices = data.get('devices')
+        if devices is not None and (not isinstance(devices, list) or not all(isinstance(d, str) for d in devices)):
+            raise ValueError(f"{name}: 'devices' must be a list of device ids")
+        if kind == 'missing':
+            return cls(name, kind, duration=_number(data.get('after'), 'after'), devices=devices)
+        field = data.get('field')
+        if not isinstance(field, str) or not field:
+            raise ValueError(f"{name}: 'field' is required")
+        op = data.get('op', '>')
+        if op not in OPERATORS:
+            raise ValueError(f"{name}: 'op' must be one of {' '.join(OPERATORS)}")
+        value = data.get('value')
+        if value is None or isinstance(value, (dict, list)):
+            raise ValueError(f"{name}: 'value' is required")
+        duration = 0.0
+        if kind == 'sustained':
+            duration = _number(data.get('for'), 'for')
+        elif kind == 'rate':
+            duration = _number(data.get('window'), 'window')
+            value = _number(value, 'value')
+        return cls(name, kind, field, op, value, duration, devices)
+
+    def as_dict(self):
+        out = {'name': self.name, 'type': self.type}
+        if self.type != 'missing':
+            out.update(field=self.field, op=self.op_name, value=self.value)
+        key = {'sustained': 'for', 'rate': 'window', 'missing': 'after'}.get(self.type)
+        if key:
+            out[key] = self.duration
+        if self.devices:
+            out['devices'] = sorted(self.devices)
+        return out
+
+    def applies_to(self, device):
+        return self.devices is None or device in self.devices
+
+
+class _RuleState:
+    __slots__ = ('firing', 'since', 'window', 'last_ts', 'value')
+
+    def __init__(self):
+        self.firing = False
+        self.since = None             # when a sustained condition started holding
+        self.window = None            # deque of (ts, value) for rate rules
+        self.last_ts = float('-inf')
+        self.value = None
+
+
+def load_rules(items):
+    """Parse a list of rule dicts; raises ValueError on the first bad or duplicate rule."""
+    if not isinstance(items, list):
+        raise ValueError('rules must be a list')
+    rules = [Rule.from_dict(item) for item in items]
+    names = [rule.name for rule in rules]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate rule names: {', '.join(duplicates)}")
+    return rules
+
+
+class RulesEngine:
+    def __init__(self, rules=(), notifier=None):
+        self.notifier = notifier
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._last_seen = {}          # device -> ts of its newest reading
+        self._started_at = time.time()
+        self.recent = deque(maxlen=RECENT_ALERTS)
+        self.evaluations = 0
+        self.alerts = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        """Replace the rules; state of rules whose definition is unchanged is kept."""
+        rules = list(rules)
+        by_field = {}
+        for rule in rules:
+            if rule.type != 'missing':
+                by_field.setdefault(rule.field, []).append(rule)
+        old = getattr(self, '_rules', {})
+        old_states = getattr(self, '_states', {})
+        keep = {r.name for r in rules if r.name in old and old[r.name].as_dict() == r.as_dict()}
+        states = {key: s for key, s in old_states.items() if key[0] in keep}
+        # Swapped as a whole so readings in flight see either the old or new rules
+        self._rules = {rule.name: rule for rule in rules}
+        self._by_field = {field: tuple(rs) for field, rs in by_field.items()}
+        self._missing = tuple(r for r in rules if r.type == 'missing')
+        self._states = states
+
+    def rules(self):
+        return list(self._rules.values())
+
+    def _lock_for(self, device):
+        lock = self._locks.get(device)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(device, threading.Lock())
+        return lock
+
+    def observe(self, device, ts, reading):
+        """Evaluate the rules watching any field of one reading."""
+        self.observe_many(device, ((ts, reading),))
+
+    def observe_many(self, device, readings):
+        """Evaluate a device's (ts, reading) pairs in time order."""
+        readings = list(readings)
+        if not readings:
+            return
+        by_field = self._by_field
+        states = self._states
+        fired = []
+        with self._lock_for(device):
+            for ts, reading in readings:
+                for field, value in reading.items():
+                    rules = by_field.get(field)
+                    if not rules or value is None:
+                        continue
+                    for rule in rules:
+                        if rule.devices is not None and device not in rule.devices:
+                            continue
+                        key = (rule.name, device)
+                        state = states.get(key)
+                        if state is None:
+                            state = states[key] = _RuleState()
+                        if ts < state.last_ts:
+                            continue      # replayed backlog; windows only move forward
+                        state.last_ts = ts
+                        state.value = value
+                        self.evaluations += 1
+                        try:
+                            active = self._evaluate(rule, state, ts, value)
+                        except TypeError:
+                            continue      # e.g. a string compared with a number
+                        if active != state.firing:
+                            state.firing = active
+                            fired.append(self._alert(rule, device, active, ts, value))
+                if ts > self._last_seen.get(device, float('-inf')):
+                    self._last_seen[device] = ts
+            for rule in self._missing:
+                state = states.get((rule.name, device))
+                if state is not None and state.firing and rule.applies_to(device):
+                    state.firing = False
+                    fired.append(self._alert(rule, device, False, self._last_seen[device], None))
+        for alert in fired:
+            self._emit(alert)
+
+    @staticmethod
+    def _evaluate(rule, state, ts, value):
+        if rule.type == 'threshold':
+            return rule.op(value, rule.value)
+        if rule.type == 'sustained':
+            if not rule.op(value, rule.value):
+                state.since = None
+                return False
+            if state.since is None:
+                state.since = ts
+            return ts - state.since >= rule.duration
+        # rate: change against the oldest reading still inside the window
+        window = state.window
+        if window is None:
+            window = state.window = deque()
+        window.append((ts, value))
+        while ts - window[0][0] > rule.duration:
+            window.popleft()
+        return rule.op(value - window[0][1], rule.value)
+
+    def check_missing(self, now=None):
+        """Fire `missing` rules for devices that stopped reporting; called periodically."""
+        if not self._missing:
+            return
+        now = time.time() if now is None else now
+        fired = []
+        devices = set(self._last_seen)
+        for rule in self._missing:
+            if rule.devices is not None:
+                devices.update(rule.devices)
+        for device in devices:
+            with self._lock_for(device):
+                last = self._last_seen.get(device)
+                age = now - (last if last is not None else self._started_at)
+                for rule in self._missing:
+                    if not rule.applies_to(device):
+                        continue
+                    key = (rule.name, device)
+                    state = self._states.get(key)
+                    if state is None:
+                        state = self._states[key] = _RuleState()
+                    if not state.firing and age > rule.duration:
+                        state.firing = True
+                        state.last_ts = now
+                        state.value = round(age, 1)
+                        fired.append(self._alert(rule, device, True, now, round(age, 1)))
+        for alert in fired:
+            self._emit(alert)
+
+    def _alert(self, rule, device, firing, ts, value):
+        if rule.type == 'missing':
+            message = (f"{device}: no reading for {value:g} s" if firing
+                       else f"{device}: reporting again")
+        else:
+            message = f"{device}: {rule.field} {value!r} ({rule.type} {rule.op_name} {rule.value!r})"
+        return {'rule': rule.name, 'type': rule.type, 'device': device,
+                'state': 'firing' if firing else 'resolved', 'ts': ts, 'value': value,
+                'message': message}
+
+    def _emit(self, alert):
+        self.alerts += 1
+        self.recent.append(alert)
+        print(f"Alert {alert['state']}: {alert['rule']} {alert['message']}")
+        if self.notifier is not None:
+            self.notifier.notify(alert)
+
+    def firing(self):
+        return [{'rule': name, 'device': device, 'ts': state.last_ts, 'value': state.value}
+                for (name, device), state in list(self._states.items()) if state.firing]
+
+    def _loop(self):
+        while not self._stop.wait(MISSING_CHECK_INTERVAL):
+            try:
+                self.check_missing()
+            except Exception as e:
+                print(f"Missing-data check failed: {e}")
+
+    def start(self):
+        if self.notifier is not None:
+            self.notifier.start()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='sensor-rules')
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.notifier is not None:
+            self.notifier.stop(timeout)
+
+    def status(self):
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'rules': len(self._rules),
+            'evaluations': self.evaluations,
+            'alerts': self.alerts,
+            'firing': self.firing(),
+            'webhook': self.notifier.status() if self.notifier is not None else None,
+        }
+
+
+class WebhookNotifier:
+    """POSTs each alert as JSON to `url` from a background thread."""
+
+    def __init__(self, url, queue_size=WEBHOOK_QUEUE_SIZE, timeout=WEBHOOK_TIMEOUT, retries=WEBHOOK_RETRIES):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def notify(self, alert):
+        """Queue an alert; never blocks the caller."""
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+
+    def _post(self, alert):
+        body = json.dumps(alert).encode()
+        req = urllib.request.Request(self.url, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+    def _loop(self):
+        while True:
+            alert = self._queue.get()
+            if alert is None:
+                return
+            delay = 1.0
+            for attempt in range(self.retries):
+                try:
+                    self._post(alert)
+                    self.sent += 1
+                    break
+                except (urllib.error.URLError, OSError, ValueError) as e:
+                    self.last_error = str(e)
+                    if attempt + 1 < self.retries:
+                        time.sleep(delay)
+                        delay *= 2
+            else:
+                self.failed += 1
+                print(f"Webhook delivery failed: {self.last_error}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='alert-webhook')
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def status(self):
+        return {'url': self.url, 'queued': self._queue.qsize(), 'sent': self.sent,
+                'failed': self.failed, 'dropped': self.dropped, 'last_error': self.last_error}
+
+
+def run_stub(port):
+    """Webhook stub that prints every alert POSTed to it."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            print(body.decode('utf-8', 'replace'), flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Webhook stub listening on http://127.0.0.1:{port}/")
+    HTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+def benchmark(n_rules=200, n_devices=10, n_readings=20000):
+    """Readings per second through `n_rules` rules spread over the sensor fields."""
+    kinds = [
+        {'type': 'threshold', 'field': 'temp', 'op': '>', 'value': 30},
+        {'type': 'sustained', 'field': 'moisture', 'op': '==', 'value': 0, 'for': 60},
+        {'type': 'rate', 'field': 'temp', 'op': '>', 'value': 5, 'window': 600},
+        {'type': 'threshold', 'field': 'humi', 'op': '<', 'value': 20},
+    ]
+    rules = load_rules([dict(kinds[i % len(kinds)], name=f'rule{i}') for i in range(n_rules)])
+    engine = RulesEngine(rules)
+    devices = [f'pico{i}' for i in range(n_devices)]
+    engine._emit = lambda alert: None
+    t0 = time.perf_counter()
+    for i in range(n_readings):
+        engine.observe(devices[i % n_devices], 1000.0 + i,
+                       {'temp': 20 + i % 15, 'humi': 40.0 + i % 30, 'moisture': i // 50 % 2})
+    elapsed = time.perf_counter() - t0
+    return {
+        'rules': n_rules,
+        'devices': n_devices,
+        'readings': n_readings,
+        'readings_per_sec': round(n_readings / elapsed),
+        'rule_evaluations_per_sec': round(engine.evaluations / elapsed),
+        'us_per_reading': round(elapsed / n_readings * 1e6, 1),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sensor alert rules tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_stub = sub.add_parser('stub', help='run a webhook stub that prints alerts')
+    p_stub.add_argument('--port', type=int, default=9000)
+    p_bench = sub.add_parser('bench', help='measure rule evaluation throughput')
+    p_bench.add_argument('--rules', type=int, default=200)
+    p_bench.add_argument('--devices', type=int, default=10)
+    p_bench.add_argument('--readings', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'stub':
+        run_stub(args.port)
+    else:
+        for key, value in benchmark(args.rules, args.devices, args.readings).items():
+            print(f"{key}: {value}")
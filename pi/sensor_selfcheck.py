@@ -0,0 +1,190 @@
+"""
+Self-check of the sensor history against backlogs that arrive out of order.
+
+A Pico W that was offline posts its buffered readings after newer ones are
+already stored, so segments and the ring hold records out of time order.
+The checks run in a temporary directory:
+
+    backlog_order   a backlog batch older than the latest reading still comes
+                    back oldest first from /pico/sensors/history (also with a
+                    limit), /pico/sensors/aggregate (raw and rollup) and
+                    /pico/sensors/export (csv and ndjson, two devices)
+    segment_merge   a backlog spread over segments whose time ranges overlap
+                    is merged into one ordered stream
+    crash_replay    a backlog that arrived after the last rollup snapshot is
+                    replayed into the rollups after a crash, although it is
+                    older than the snapshot's newest reading
+
+    python sensor_selfcheck.py            # exit status 1 if a check fails
+"""
+
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sensor_rollups import SensorRollups
+from sensor_store import SensorStore
+
+FIELDS = ('temp', 'humi')
+
+
+def _reading(ts):
+    return {'temp': round(20 + (ts % 7), 2), 'humi': round(40 + (ts % 11), 2)}
+
+
+def _ordered(values):
+    return all(a <= b for a, b in zip(values, values[1:]))
+
+
+def check_backlog_order():
+    import sensors_data_api
+    from main import create_app
+
+    problems = []
+    directory = Path(tempfile.mkdtemp(prefix='sensor-selfcheck-'))
+    app = create_app(services=('sensors',))
+    sensors_data_api.start_storage(directory / 'sensor_history', directory / 'rollups',
+                                   directory / 'sensors.db')
+    try:
+        client = app.test_client()
+        now = int(time.time())
+        live = [now - 600 + 60 * k for k in range(10)]
+        backlog = [now - 3600 + 30 * k for k in range(100)]
+        for device in ('pico', 'node2'):
+            for ts in live:
+                client.post('/pico/sensors/batch', json={'device': device,
+                                                         'readings': [dict(_reading(ts), ts=ts)]})
+            r = client.post('/pico/sensors/batch', json={
+                'device': device, 'readings': [dict(_reading(ts), ts=ts) for ts in backlog]})
+            if r.status_code != 200 or r.get_json().get('accepted') != len(backlog):
+                return [f'backlog batch for {device} was not stored: {r.get_json()}']
+        expected = sorted(live + backlog)
+
+        got = [r['ts'] for r in client.get('/pico/sensors/history?from=0').get_json()['readings']]
+        if got != expected:
+            problems.append('history is not oldest first')
+        got = [r['ts'] for r in client.get('/pico/sensors/history?from=0&limit=5').get_json()['readings']]
+        if got != expected[:5]:
+            problems.append(f'history with a limit returned {got}, not the 5 oldest')
+
+        for bucket, source in ((90, 'raw'), (300, 'rollup')):
+            body = client.get(f'/pico/sensors/aggregate?from={now - 4000}&to={now}'
+                              f'&bucket={bucket}&fields=temp').get_json()
+            starts = [b['ts'] for b in body['buckets']]
+            total = sum(b['temp']['count'] for b in body['buckets'] if b['temp'])
+            if not body['source'].startswith(source):
+                problems.append(f"bucket {bucket}: expected a {source} aggregate, got {body['source']}")
+            if starts != sorted(set(starts)) or total != len(expected):
+                problems.append(f'{source} aggregate has split or missing buckets '
+                                f'({len(starts)} buckets, {total} of {len(expected)} readings)')
+
+        csv_rows = client.get('/pico/sensors/export?format=csv').get_data(as_text=True).splitlines()[1:]
+        csv_ts = [float(row.split(',')[0]) for row in csv_rows]
+        if len(csv_ts) != 2 * len(expected) or not _ordered(csv_ts):
+            problems.append('csv export does not interleave devices in time order')
+        ndjson = client.get('/pico/sensors/export?format=ndjson').get_data(as_text=True).splitlines()
+        nd_ts = [json.loads(line)['ts'] for line in ndjson]
+        if nd_ts != csv_ts:
+            problems.append('ndjson export order differs from csv')
+    finally:
+        sensors_data_api.stop_storage()
+        shutil.rmtree(directory)
+    return problems
+
+
+def check_segment_merge():
+    problems = []
+    directory = tempfile.mkdtemp(prefix='sensor-selfcheck-')
+    try:
+        store = SensorStore(directory, ring_capacity=5, segment_capacity=10)
+        arrived = [float(ts) for ts in range(100, 130)] + [100.5 + k for k in range(25)]
+        for ts in arrived:
+            store.append('pico', ts, _reading(ts))
+        got = [r['ts'] for r in store.query('pico', 0)]
+        if got != sorted(arrived):
+            problems.append('overlapping segments are not merged in time order')
+        got = [r['ts'] for r in store.query('pico', 110, 115)]
+        if got != sorted(ts for ts in arrived if 110 <= ts <= 115):
+            problems.append(f'range over overlapping segments returned {got}')
+        got = [r['ts'] for r in store.query('pico', 0, limit=4)]
+        if got != sorted(arrived)[:4]:
+            problems.append(f'limit returned {got}, not the 4 oldest')
+        ring = [r['ts'] for r in store.query('pico', 120)]
+        if ring != sorted(ts for ts in arrived if ts >= 120):
+            problems.append('unsorted recent readings are not returned in time order')
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+    return problems
+
+
+def check_crash_replay():
+    problems = []
+    directory = Path(tempfile.mkdtemp(prefix='sensor-selfcheck-'))
+    try:
+        store = SensorStore(directory / 'history', segment_capacity=50)
+        rollups = SensorRollups(directory / 'rollups')
+        arrived = [1760000000.0 + 10 * k for k in range(120)]
+        arrived += [1760000000.0 + 10 * k + 5 for k in range(60)]     # backlog, after the snapshot
+        for k, ts in enumerate(arrived):
+            position = store.append('pico', ts, _reading(ts))
+            rollups.add('pico', ts, _reading(ts), position)
+            if k == 119:
+                rollups.save()
+        store.close()         # crash: the rollups are never saved again
+
+        store = SensorStore(directory / 'history', segment_capacity=50)
+        replayed = SensorRollups(directory / 'rollups')
+        replayed.catch_up(store)
+        fresh = SensorRollups(directory / 'fresh')
+        for ts in arrived:
+            fresh.add('pico', ts, _reading(ts))
+        for bucket in (60, 3600):
+            got = replayed.aggregate('pico', FIELDS, None, None, bucket)
+            want = fresh.aggregate('pico', FIELDS, None, None, bucket)
+            if got != want:
+                problems.append(f'{bucket} s rollups after the replay differ from a full rebuild')
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+    return problems
+
+
+CHECKS = {
+    'backlog_order': check_backlog_order,
+    'segment_merge': check_segment_merge,
+    'crash_replay': check_crash_replay,
+}
+
+
+def run(names=None):
+    """Run the checks; returns {name: [problems]} (empty lists pass)."""
+    results = {}
+    for name in names or CHECKS:
+        try:
+            results[name] = CHECKS[name]()
+        except Exception as e:
+            results[name] = [f'{type(e).__name__}: {e}']
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check the sensor history against out-of-order backlogs')
+    parser.add_argument('checks', nargs='*', help=f"any of {', '.join(CHECKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = False
+    for check, found in run(args.checks).items():
+        print(f"{'ok  ' if not found else 'FAIL'} {check}")
+        for problem in found:
+            print(f"       {problem}")
+        failed = failed or bool(found)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,601 @@
+"""
+Append-only time-series store for sensor readings.
+
+Every reading is a fixed-size record: a float64 timestamp followed by one
+float32 per field (NaN when the reading did not carry that field). Recent
+readings are kept per device in a fixed-capacity in-memory ring built on
+`array`, so the common "last few minutes" query never touches the SD card.
+All readings are also appended to memory-mapped segment files on disk:
+
+    sensor_history/<device>/<seq>.seg
+
+A segment is a 32-byte header (magic, version, flags, count, capacity,
+min_ts, max_ts) followed by `capacity` records. Appending is a memcpy into
+the mapping plus a header update; the OS writes pages back in the background.
+Range queries only open segments whose [min_ts, max_ts] overlaps the request
+and binary-search the records inside them, yielding readings one at a time so
+months of 1 Hz data never need to fit in RAM.
+
+Records are kept in the order they arrived. A backlog posted after newer
+readings makes a segment (and the ring) unsorted: such a segment is read by
+sorting the timestamps of its matching records, and segments whose time
+ranges overlap are merged, so queries always return readings oldest first.
+A position (segment seq, record index) names a point in the arrival order;
+the rollups use it to replay exactly the readings that arrived after their
+last snapshot, whatever their timestamps.
+
+A sealed segment can be replaced by a compressed `<seq>.blk` block file
+(see sensor_blocks.py, about a quarter of the size); queries read either.
+Sealed files whose newest reading is past the retention period are deleted
+by expire_sealed() (see sensor_retention.py).
+
+Only one process may open a store: SensorStore takes an exclusive lock on
+sensor_history/.lock and raises RuntimeError when another process holds it.
+"""
+
+import fcntl
+import heapq
+import math
+import mmap
+import re
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+FIELDS = ('temp', 'humi', 'moisture', 'moisture_percent', 'raw', 'relay')
+INT_FIELDS = ('moisture', 'raw')
+BOOL_FIELDS = ('relay',)
+
+STORE_DIR = Path(__file__).parent / 'sensor_history'
+RING_CAPACITY = 3600            # readings kept in RAM per device (1 h at 1 Hz)
+SEGMENT_CAPACITY = 86400        # records per segment file (1 day at 1 Hz, ~2.7 MB)
+LOCK_FILE = '.lock'             # held by the one process that owns the store
+
+RECORD = struct.Struct('<d' + 'f' * len(FIELDS))
+HEADER = struct.Struct('<4sHHIIdd')
+MAGIC = b'PSEG'
+VERSION = 1
+FLAG_UNSORTED = 0x1             # set when a record arrived older than its predecessor
+
+NAN = float('nan')
+
+
+def safe_device_name(device):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(device)) or '_'
+
+
+def _pack_values(values):
+    out = []
+    for name in FIELDS:
+        v = values.get(name)
+        out.append(NAN if v is None else float(v))
+    return out
+
+
+def _unpack_values(ts, floats):
+    reading = {'ts': ts}
+    for name, v in zip(FIELDS, floats):
+        if math.isnan(v):
+            continue
+        if name in INT_FIELDS:
+            v = int(v)
+        elif name in BOOL_FIELDS:
+            v = bool(v)
+        else:
+            v = round(v, 2)
+        reading[name] = v
+    return reading
+
+
+class Ring:
+    """Fixed-capacity ring of recent readings, stored column-wise in arrays."""
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.ts = array('d', [0.0]) * capacity
+        self.columns = {name: array('f', [0.0]) * capacity for name in FIELDS}
+        self.start = 0
+        self.size = 0
+        # appends left until an out-of-order reading has rotated out again
+        self._unsorted_for = 0
+
+    @property
+    def sorted(self):
+        return self._unsorted_for == 0
+
+    def append(self, ts, floats):
+        if self._unsorted_for:
+            self._unsorted_for -= 1
+        if self.size and ts < self.ts[(self.start + self.size - 1) % self.capacity]:
+            self._unsorted_for = self.capacity
+        if self.size < self.capacity:
+            i = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.ts[i] = ts
+        for name, v in zip(FIELDS, floats):
+            self.columns[name][i] = v
+
+    def oldest(self):
+        return self.ts[self.start] if self.size else None
+
+    def _index(self, k):
+        return (self.start + k) % self.capacity
+
+    def range(self, start, end):
+        """Yield readings with start <= ts <= end, oldest first."""
+        if self.sorted:
+            first = bisect_left(_RingView(self), start)
+            indexes = (self._index(k) for k in range(first, self.size))
+        else:
+            indexes = sorted((i for i in map(self._index, range(self.size))
+                              if start <= self.ts[i] <= end), key=self.ts.__getitem__)
+        for i in indexes:
+            ts = self.ts[i]
+            if ts > end:
+                break
+            if ts < start:
+                continue
+            yield _unpack_values(ts, [self.columns[name][i] for name in FIELDS])
+
+
+class _RingView:
+    """Sequence view of ring timestamps so bisect can search it."""
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __len__(self):
+        return self.ring.size
+
+    def __getitem__(self, k):
+        return self.ring.ts[self.ring._index(k)]
+
+
+class Segment:
+    def __init__(self, path, capacity=SEGMENT_CAPACITY, create=False):
+        self.path = Path(path)
+        size = HEADER.size + capacity * RECORD.size
+        if create:
+            with open(self.path, 'wb') as f:
+                f.truncate(size)
+                f.write(HEADER.pack(MAGIC, VERSION, 0, 0, capacity, 0.0, 0.0))
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, self.flags, self.count, self.capacity, self.min_ts, self.max_ts = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{self.path} is not a sensor segment")
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, ts, floats):
+        if self.count:
+            if ts < self.max_ts:
+                self.flags |= FLAG_UNSORTED
+            self.min_ts = min(self.min_ts, ts)
+            self.max_ts = max(self.max_ts, ts)
+        else:
+            self.min_ts = self.max_ts = ts
+        RECORD.pack_into(self._map, HEADER.size + self.count * RECORD.size, ts, *floats)
+        self.count += 1
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.flags, self.count,
+                         self.capacity, self.min_ts, self.max_ts)
+
+    def overlaps(self, start, end):
+        return self.count and self.min_ts <= end and self.max_ts >= start
+
+    def _ts_at(self, k):
+        return struct.unpack_from('<d', self._map, HEADER.size + k * RECORD.size)[0]
+
+    def range(self, start, end, count=None):
+        """Yield readings with start <= ts <= end among the first `count` records, oldest first."""
+        count = self.count if count is None else min(count, self.count)
+        if self.flags & FLAG_UNSORTED:
+            # Sort (ts, index) pairs of the matching records, not whole readings
+            hits = []
+            for k in range(count):
+                ts = self._ts_at(k)
+                if start <= ts <= end:
+                    hits.append((ts, k))
+            hits.sort()
+            for ts, k in hits:
+                rec = RECORD.unpack_from(self._map, HEADER.size + k * RECORD.size)
+                yield _unpack_values(ts, rec[1:])
+            return
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts_at(mid) < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        for k in range(lo, count):
+            rec = RECORD.unpack_from(self._map, HEADER.size + k * RECORD.size)
+            ts = rec[0]
+            if ts > end:
+                break
+            yield _unpack_values(ts, rec[1:])
+
+    def records(self, first, count):
+        """Yield (index, reading) for records first..count-1 in arrival order."""
+        for k in range(first, min(count, self.count)):
+            rec = RECORD.unpack_from(self._map, HEADER.size + k * RECORD.size)
+            yield k, _unpack_values(rec[0], rec[1:])
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        try:
+            self._map.flush()
+            self._map.close()
+        finally:
+            self._file.close()
+
+
+def _seq(path):
+    return int(path.stem)
+
+
+def covered(seq, count, position):
+    """Whether the first `count` records of segment `seq` arrived before `position`."""
+    return position is not None and (seq < position[0] or (seq == position[0] and count <= position[1]))
+
+
+class _DeviceLog:
+    def __init__(self, directory, ring_capacity, segment_capacity):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_capacity = segment_capacity
+        self.ring = Ring(ring_capacity)
+        self.sealed = []            # (path, count, min_ts, max_ts, flags) of full segments
+        self.active = None
+        self.next_seq = 0
+        blocks = {path.stem: path for path in self.directory.glob('*.blk')}
+        if blocks:
+            from sensor_blocks import file_summary
+        for path in sorted(list(self.directory.glob('*.seg')) + list(blocks.values())):
+            if path.suffix == '.blk':
+                count, min_ts, max_ts = file_summary(path)
+                self.sealed.append((path, count, min_ts, max_ts, 0))
+                self.next_seq = max(self.next_seq, int(path.stem) + 1)
+                continue
+            if path.stem in blocks:
+                # Compressed before a crash but the segment was not removed yet
+                path.unlink()
+                continue
+            seg = Segment(path)
+            self.next_seq = max(self.next_seq, int(path.stem) + 1)
+            if seg.full():
+                self.sealed.append((path, seg.count, seg.min_ts, seg.max_ts, seg.flags))
+                seg.close()
+            else:
+                if self.active is not None:
+                    self._seal()
+                self.active = seg
+
+    def _seal(self):
+        seg = self.active
+        seg.flush()
+        self.sealed.append((seg.path, seg.count, seg.min_ts, seg.max_ts, seg.flags))
+        seg.close()
+        self.active = None
+
+    def append(self, ts, floats):
+        if self.active is not None and self.active.full():
+            self._seal()
+        if self.active is None:
+            path = self.directory / f'{self.next_seq:08d}.seg'
+            self.next_seq += 1
+            self.active = Segment(path, self.segment_capacity, create=True)
+        self.active.append(ts, floats)
+        self.ring.append(ts, floats)
+
+    def position(self):
+        """(seq, index) just after the newest record in arrival order."""
+        if self.active is None:
+            return (self.next_seq, 0)
+        return (_seq(self.active.path), self.active.count)
+
+    def replace_sealed(self, seg_path, blk_path):
+        """Swap a sealed segment for its block file; returns False if it is not sealed here."""
+        for i, (path, count, min_ts, max_ts, flags) in enumerate(self.sealed):
+            if path == seg_path:
+                self.sealed[i] = (blk_path, count, min_ts, max_ts, 0)
+                return True
+        return False
+
+    def remove_sealed(self, before, max_files=None, upto=None):
+        """
+        Take sealed files whose newest reading is older than `before` (and,
+        with `upto`, that arrived entirely before that position) off the list;
+        returns their paths.
+        """
+        keep = []
+        removed = []
+        for entry in self.sealed:
+            if (entry[3] < before and (upto is None or covered(_seq(entry[0]), entry[1], upto))
+                    and (max_files is None or len(removed) < max_files)):
+                removed.append(entry[0])
+            else:
+                keep.append(entry)
+        self.sealed = keep
+        return removed
+
+    def segments_overlapping(self, start, end):
+        """(path, count, min_ts, max_ts) of segments that may hold readings in [start, end]."""
+        out = [(path, count, min_ts, max_ts) for path, count, min_ts, max_ts, flags in self.sealed
+               if count and min_ts <= end and max_ts >= start]
+        if self.active is not None and self.active.overlaps(start, end):
+            # Records below the current count are never rewritten, so readers
+            # can map the file on their own and stop at this count
+            out.append((self.active.path, self.active.count, self.active.min_ts, self.active.max_ts))
+        return out
+
+    def segments_after(self, position):
+        """(path, first, count) of segments holding records that arrived at or after `position`."""
+        out = [(path, position[1] if _seq(path) == position[0] else 0, count)
+               for path, count, *_ in self.sealed if not covered(_seq(path), count, position)]
+        if self.active is not None and not covered(_seq(self.active.path), self.active.count, position):
+            path = self.active.path
+            out.append((path, position[1] if _seq(path) == position[0] else 0, self.active.count))
+        return out
+
+
+def _only(readings, fields):
+    keep = set(fields) | {'ts'}
+    for reading in readings:
+        yield {k: v for k, v in reading.items() if k in keep}
+
+
+def _read_arrived(path, first, count):
+    """Yield (position after the record, reading) for records first..count-1 of one file."""
+    seq = _seq(path)
+    if path.suffix == '.seg':
+        try:
+            seg = Segment(path)
+        except FileNotFoundError:
+            path = path.with_suffix('.blk')
+        else:
+            try:
+                for k, reading in seg.records(first, count):
+                    yield (seq, k + 1), reading
+            finally:
+                seg.close()
+            return
+    from sensor_blocks import read_range
+    if first:
+        # Blocks are sorted by ts, so arrival order within the file is gone;
+        # compress_sealed() only compresses segments the caller has covered
+        print(f"Cannot replay {path} from record {first}; replaying all of it")
+    try:
+        for k, reading in enumerate(read_range(path)):
+            yield (seq, k + 1), reading
+    except FileNotFoundError:
+        return
+
+
+def _read_source(path, start, end, count, fields=None):
+    if path.suffix == '.seg':
+        try:
+            seg = Segment(path)
+        except FileNotFoundError:
+            # Compressed since the query listed it
+            path = path.with_suffix('.blk')
+        else:
+            try:
+                readings = seg.range(start, end, count)
+                yield from readings if fields is None else _only(readings, fields)
+            finally:
+                seg.close()
+            return
+    from sensor_blocks import read_range
+    try:
+        # Block files decode only the requested columns
+        yield from read_range(path, start, end, fields)
+    except FileNotFoundError:
+        # Expired since the query listed it
+        return
+
+
+def _lock_directory(directory):
+    """
+    Take an exclusive lock on the store directory for this process.
+
+    Segments are mapped and appended to without any coordination between
+    processes, so a second process opening the same store (another WSGI
+    worker, or a CLI tool while the server runs) would corrupt it.
+    """
+    f = open(directory / LOCK_FILE, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise RuntimeError(f'{directory} is in use by another process '
+                           '(sensor storage is single-process)') from None
+    return f
+
+
+class SensorStore:
+    def __init__(self, directory=STORE_DIR, ring_capacity=RING_CAPACITY,
+                 segment_capacity=SEGMENT_CAPACITY):
+        self.directory = Path(directory)
+        self.ring_capacity = ring_capacity
+        self.segment_capacity = segment_capacity
+        self._lock = threading.RLock()
+        self._devices = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._owner = _lock_directory(self.directory)
+        for sub in sorted(p for p in self.directory.iterdir() if p.is_dir()):
+            self._devices[sub.name] = _DeviceLog(sub, ring_capacity, segment_capacity)
+
+    def _log(self, device):
+        name = safe_device_name(device)
+        log = self._devices.get(name)
+        if log is None:
+            log = self._devices[name] = _DeviceLog(self.directory / name, self.ring_capacity,
+                                                   self.segment_capacity)
+        return log
+
+    def devices(self):
+        with self._lock:
+            return sorted(self._devices)
+
+    def append(self, device, ts, values):
+        """Append one reading (a dict with any of FIELDS) for a device; returns the position after it."""
+        floats = _pack_values(values)
+        with self._lock:
+            log = self._log(device)
+            log.append(ts, floats)
+            return log.position()
+
+    def append_many(self, device, readings):
+        """Append [(ts, values)] for a device under a single lock acquisition; returns the position after them."""
+        packed = [(ts, _pack_values(values)) for ts, values in readings]
+        with self._lock:
+            log = self._log(device)
+            for ts, floats in packed:
+                log.append(ts, floats)
+            return log.position()
+
+    def position(self, device):
+        """Position just after the newest reading of a device, in arrival order."""
+        with self._lock:
+            log = self._devices.get(safe_device_name(device))
+            return log.position() if log is not None else (0, 0)
+
+    def arrived_since(self, device, position):
+        """
+        Yield (position after it, reading) for every reading of a device that
+        arrived at or after `position`, in arrival order.
+        """
+        with self._lock:
+            log = self._devices.get(safe_device_name(device))
+            if log is None:
+                return
+            sources = log.segments_after(position)
+        for path, first, count in sources:
+            yield from _read_arrived(path, first, count)
+
+    def query(self, device, start=None, end=None, limit=None, fields=None):
+        """
+        Yield readings for a device with start <= ts <= end, oldest first.
+
+        Served from the in-memory ring when it covers the whole range,
+        otherwise from the on-disk segments; segments whose time ranges
+        overlap (a backlog stored after newer readings) are merged. With
+        `fields`, readings only carry those fields (and ts).
+        """
+        start = -math.inf if start is None else start
+        end = math.inf if end is None else end
+        with self._lock:
+            log = self._devices.get(safe_device_name(device))
+            if log is None:
+                return
+            oldest = log.ring.oldest()
+            if oldest is not None and start >= oldest and log.ring.sorted:
+                # Copy under the lock: ring slots are overwritten in place
+                readings = list(log.ring.range(start, end))
+                sources = []
+            else:
+                readings = None
+                sources = log.segments_overlapping(start, end)
+        if readings is not None:
+            readings = readings[:limit]
+            yield from readings if fields is None else _only(readings, fields)
+            return
+        sources.sort(key=lambda source: source[2])
+        if all(a[3] <= b[2] for a, b in zip(sources, sources[1:])):
+            merged = (reading for path, count, _, _ in sources
+                      for reading in _read_source(path, start, end, count, fields))
+        else:
+            merged = heapq.merge(*[_read_source(path, start, end, count, fields)
+                                   for path, count, _, _ in sources], key=lambda r: r['ts'])
+        n = 0
+        for reading in merged:
+            if limit is not None and n >= limit:
+                return
+            n += 1
+            yield reading
+
+    def compress_sealed(self, device=None, max_segments=None, upto=None):
+        """
+        Replace sealed segments by compressed block files; returns how many.
+
+        Blocks are sorted by ts, which loses the arrival order, so with `upto`
+        ({device: position}) only segments that arrived entirely before the
+        device's position are compressed. Encoding runs without the store
+        lock (sealed segments never change), only the swap in the segment
+        list takes it.
+        """
+        from sensor_blocks import compress_segment
+
+        done = 0
+        with self._lock:
+            names = [safe_device_name(device)] if device is not None else sorted(self._devices)
+            todo = [(self._devices[name], path) for name in names if name in self._devices
+                    for path, count, *_ in self._devices[name].sealed
+                    if path.suffix == '.seg' and (upto is None or covered(_seq(path), count, upto.get(name)))]
+        for log, path in todo:
+            if max_segments is not None and done >= max_segments:
+                break
+            blk = compress_segment(path)
+            with self._lock:
+                swapped = log.replace_sealed(path, blk)
+            if swapped:
+                path.unlink()
+                done += 1
+            else:
+                blk.unlink()
+        return done
+
+    def expire_sealed(self, before, device=None, max_files=None, upto=None):
+        """
+        Delete sealed segment/block files holding only readings older than
+        `before` (and, with `upto`, that arrived before that position of
+        `device`); returns (files, bytes) removed.
+
+        Only the list update takes the store lock; files are unlinked after
+        it is released (queries that already mapped one keep reading it).
+        """
+        with self._lock:
+            names = [safe_device_name(device)] if device is not None else sorted(self._devices)
+            paths = []
+            for name in names:
+                log = self._devices.get(name)
+                if log is None:
+                    continue
+                left = None if max_files is None else max_files - len(paths)
+                if left is not None and left <= 0:
+                    break
+                paths += log.remove_sealed(before, left, upto)
+        freed = 0
+        for path in paths:
+            try:
+                freed += path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return len(paths), freed
+
+    def flush(self):
+        with self._lock:
+            for log in self._devices.values():
+                if log.active is not None:
+                    log.active.flush()
+
+    def close(self):
+        with self._lock:
+            for log in self._devices.values():
+                if log.active is not None:
+                    log.active.close()
+                    log.active = None
+            # Closing the file releases the lock
+            self._owner.close()
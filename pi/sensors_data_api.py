@@ -1,81 +1,538 @@
 # sensors_data_api.py
 # Flask blueprint to expose Pico sensor data via HTTP endpoint
+# Nothing runs on import: main.create_app() calls start_storage()/start_serial()
 
-from flask import Blueprint, jsonify, request
-import serial
-import threading
+from flask import Blueprint, Response, current_app, jsonify, request
+import json
+import os
+import time
+from pathlib import Path
+import uuid
+
+from metrics import metrics
+from sensor_db import SENSOR_DB, SensorDatabase
+from sensor_events import SensorEventHub
+from sensor_export import CONTENT_TYPES, FORMATS, export, filename
+from sensor_payloads import (BINARY_CONTENT_TYPE, MAX_BATCH_ERRORS, decode_binary,
+                             parse_batch, parse_payload)
+from sensor_registry import DeviceRegistry, valid_device_id
+from sensor_retention import RetentionTask
+from sensor_rollups import ROLLUP_DIR, SensorRollups, aggregate_readings
+from sensor_rules import DEFAULT_RULES, RulesEngine, WebhookNotifier, load_rules
+from sensor_store import FIELDS, STORE_DIR, SensorStore
+from serial_reader import SerialIngest
+from serial_recorder import SerialRecorder
 
 sensors_api = Blueprint('sensors_api', __name__)
 
-sensor_data = {'temp': None, 'humi': None, 'moisture': None}
-SERIAL_PORT = '/dev/ttyACM0'  # Update if your Pico appears as a different device
+# Picos on these ports are picked up as they are plugged in
+SERIAL_PORT_PATTERNS = ('/dev/ttyACM*', '/dev/ttyUSB*')
+SERIAL_PORTS = ()  # extra ports outside those patterns, always tried and trusted
 BAUDRATE = 115200
+SERIAL_RECORDING_DIR = Path(__file__).parent / 'serial_recordings'
+DEFAULT_DEVICE = 'pico'
+# Device ids for serial ports; other ports use their name (e.g. 'ttyACM1')
+SERIAL_DEVICE_IDS = {'/dev/ttyACM0': DEFAULT_DEVICE}
+DEVICE_ID_HEADER = 'X-Device-Id'
 
-# Serial reader thread
+HISTORY_QUERY_LIMIT = 10000  # max readings returned by one /pico/sensors/history call
+MAX_AGGREGATE_BUCKETS = 10000  # max buckets returned by one /pico/sensors/aggregate call
+LONG_POLL_MAX_WAIT = 60.0  # upper bound for ?wait= on /pico/sensors
+STALE_AFTER = 30.0  # seconds without a reading before a device is reported stale
+# Alert rules (see sensor_rules.py); DEFAULT_RULES are used until rules are
+# saved with PUT /pico/rules. Alerts are POSTed to the webhook when set,
+# e.g. 'http://127.0.0.1:9000/' for `python sensor_rules.py stub`
+RULES_FILE = Path(__file__).parent / 'sensor_rules.json'
+ALERT_WEBHOOK_URL = None
 
-def serial_reader():
-    try:
-        ser = serial.Serial(SERIAL_PORT, BAUDRATE, timeout=1)
-        while True:
-            line = ser.readline().decode().strip()
-            if line:
-                try:
-                    parts = line.split(',')
-                    if len(parts) == 3:
-                        temp, humi, moisture = parts
-                        sensor_data['temp'] = float(temp)
-                        sensor_data['humi'] = float(humi)
-                        sensor_data['moisture'] = int(moisture)
-                    elif len(parts) == 2:
-                        temp, humi = parts
-                        sensor_data['temp'] = float(temp)
-                        sensor_data['humi'] = float(humi)
-                        sensor_data['moisture'] = None
-                except Exception:
-                    continue
-    except Exception as e:
-        print(f"Serial error: {e}")
+# Latest values per device; readings without a device id go to DEFAULT_DEVICE
+sensor_registry = DeviceRegistry({'temp': None, 'humi': None, 'moisture': None})
+sensor_registry.ensure(DEFAULT_DEVICE)
+# Append-only history of every reading (in-memory ring + mmap'd segments on
+# disk) and incremental 1 min / 1 h / 1 day rollups for bucketed chart
+# queries; both are opened by start_storage()
+sensor_store = None
+sensor_rollups = None
+# Durable SQLite copy of every reading, written in batches by a background
+# thread (see sensor_db.py); also opened by start_storage()
+sensor_db = None
+# Compresses, downsamples and expires the history per the retention tiers in
+# sensor_retention.py; created by start_retention()
+sensor_retention = None
+# Pushes changed values to /pico/sensors/stream clients
+sensor_events = SensorEventHub()
+# Evaluates alert rules on every reading; rules are loaded by start_rules()
+sensor_rules = RulesEngine()
+
+# Each device's version moves whenever its values change; ETags embed a
+# per-boot id so a restarted server never matches a pre-restart version
+_BOOT_ID = uuid.uuid4().hex[:8]
+# GET /pico/sensors bodies serialized once per device version:
+# {device: (version, quoted etag, json bytes)}
+_response_cache = {}
+
+
+def serial_device_id(port):
+    return SERIAL_DEVICE_IDS.get(port) or os.path.basename(port)
+
+
+def record_reading(reading, device=DEFAULT_DEVICE, ts=None, source=None):
+    """Update the device's latest values and append the reading to the history store."""
+    if not reading:
+        return
+    if ts is None:
+        ts = time.time()
+    changed = sensor_registry.update(device, reading, ts, source)
+    position = sensor_store.append(device, ts, reading)
+    sensor_rollups.add(device, ts, reading, position)
+    sensor_db.add(device, ts, reading)
+    sensor_rules.observe(device, ts, reading)
+    if changed:
+        sensor_events.publish(device, ts, changed)
+
+
+def record_readings(readings, device=DEFAULT_DEVICE, source=None):
+    """
+    Store a batch of (ts, reading) pairs sorted by ts.
+
+    All readings go to the store and rollups in one locked pass each. The
+    latest values only move forward: a replayed backlog older than what the
+    device last reported is kept as history but does not overwrite them.
+    """
+    if not readings:
+        return
+    position = sensor_store.append_many(device, readings)
+    sensor_rollups.add_many(device, readings, position)
+    sensor_db.add_many(device, readings)
+    sensor_rules.observe_many(device, readings)
+    newest = readings[-1][0]
+    state = sensor_registry.get(device)
+    if state is not None and state.last_seen is not None and newest < state.last_seen:
+        return
+    latest = {}
+    for _, reading in readings:
+        latest.update(reading)
+    changed = sensor_registry.update(device, latest, newest, source, count=len(readings))
+    if changed:
+        sensor_events.publish(device, newest, changed)
+
+
+def request_device_id(payload=None, default=DEFAULT_DEVICE):
+    """Device id from the X-Device-Id header, then the payload's 'device' field."""
+    device = request.headers.get(DEVICE_ID_HEADER)
+    if not device and isinstance(payload, dict):
+        device = payload.get('device')
+    return str(device) if device else default
+
+def record_serial_reading(port, reading):
+    record_reading(reading, device=serial_device_id(port), source=port)
+
+
+# One selector loop reading every Pico's USB serial port
+serial_ingest = SerialIngest(record_serial_reading, SERIAL_PORT_PATTERNS, SERIAL_PORTS, BAUDRATE)
+
+
+@metrics.collector
+def sensor_metrics():
+    # Read at scrape time from state the ingestion path keeps anyway, so
+    # /metrics adds nothing to the per-reading cost
+    now = time.time()
+    snapshot = sensor_registry.snapshot()
+    ports = serial_ingest.health()['ports']
+    db = sensor_db.status() if sensor_db is not None else None
+    usage = sensor_retention.usage() if sensor_retention is not None else {}
+    return [
+        ('sensor_readings_total', 'counter', 'Readings received per device',
+         [({'device': d}, s.updates) for d, s in snapshot.items()]),
+        ('sensor_age_seconds', 'gauge', 'Seconds since the device last reported (NaN if never)',
+         [({'device': d}, s.age(now)) for d, s in snapshot.items()]),
+        ('sensor_stale', 'gauge', f'1 if the device has not reported for {STALE_AFTER:g} s',
+         [({'device': d}, s.is_stale(STALE_AFTER, now)) for d, s in snapshot.items()]),
+        ('serial_lines_total', 'counter', 'Lines read per serial port',
+         [({'port': p['port']}, p['lines']) for p in ports]),
+        ('serial_parse_errors_total', 'counter', 'Serial lines that could not be parsed',
+         [({'port': p['port']}, p['parse_errors']) for p in ports]),
+        ('serial_bytes_total', 'counter', 'Bytes read per serial port',
+         [({'port': p['port']}, p['bytes']) for p in ports]),
+        ('serial_reconnects_total', 'counter', 'Serial port reopens after a disconnect',
+         [({'port': p['port']}, p['reconnects']) for p in ports]),
+        ('serial_lines_per_second', 'gauge', 'Lines per second over the reader rate window',
+         [({'port': p['port']}, p['lines_per_sec']) for p in ports]),
+        ('serial_connected', 'gauge', '1 while the serial port is open',
+         [({'port': p['port']}, p['connected']) for p in ports]),
+        ('sensor_db_queued', 'gauge', 'Readings waiting for the SQLite writer',
+         [({}, db['queued'])] if db else []),
+        ('sensor_db_written_total', 'counter', 'Readings committed to SQLite',
+         [({}, db['written'])] if db else []),
+        ('sensor_db_lost_total', 'counter', 'Readings not persisted to SQLite (queue full or write error)',
+         [({}, db['dropped'] + db['failed'])] if db else []),
+        ('sensor_storage_bytes', 'gauge', 'Bytes on disk per history tier',
+         [({'tier': tier}, size) for tier, size in usage.items()]),
+        ('sensor_retention_freed_bytes_total', 'counter', 'Bytes of expired raw history deleted',
+         [({}, sensor_retention.freed_bytes)] if sensor_retention else []),
+        ('sensor_rule_evaluations_total', 'counter', 'Alert rule evaluations',
+         [({}, sensor_rules.evaluations)]),
+        ('sensor_alerts_total', 'counter', 'Alerts raised or resolved', [({}, sensor_rules.alerts)]),
+        ('sensor_alerts_firing', 'gauge', 'Alert rules currently firing',
+         [({}, len(sensor_rules.firing()))]),
+    ]
+
+
+def start_storage(store_dir=STORE_DIR, rollup_dir=ROLLUP_DIR, db_path=SENSOR_DB):
+    """Open the history store, rollups and SQLite database, replaying readings the rollups missed."""
+    global sensor_store, sensor_rollups, sensor_db
+    sensor_store = SensorStore(store_dir)
+    sensor_rollups = SensorRollups(rollup_dir)
+    sensor_rollups.catch_up(sensor_store)
+    sensor_rollups.start()
+    sensor_db = SensorDatabase(db_path)
+    sensor_db.start()
+
+
+def stop_storage():
+    if sensor_rollups is not None:
+        # Writes a last snapshot
+        sensor_rollups.stop()
+    if sensor_store is not None:
+        sensor_store.close()
+    if sensor_db is not None:
+        # Commits whatever is still queued
+        sensor_db.close()
+
+
+def _require_storage():
+    # Another process owns the store when start_storage() failed here
+    if sensor_store is None:
+        raise RuntimeError('sensor storage is not running in this process')
+
+
+def start_retention():
+    """Run compaction and expiry of the history in the background (needs start_storage() first)."""
+    global sensor_retention
+    _require_storage()
+    sensor_retention = RetentionTask(sensor_store, sensor_rollups, sensor_db)
+    sensor_retention.start()
+
+
+def stop_retention():
+    if sensor_retention is not None:
+        sensor_retention.stop()
+
+
+def start_serial():
+    # Readings from the serial ports are stored, so only the storage owner reads them
+    _require_storage()
+    serial_ingest.start()
+
+
+def stop_serial():
+    serial_ingest.stop()
+    stop_recording()
+
+
+def start_rules():
+    """Load the rules from RULES_FILE (or the defaults) and start missing-data checks and the webhook."""
+    items = DEFAULT_RULES
+    if RULES_FILE.exists():
+        with open(RULES_FILE) as f:
+            items = json.load(f)
+    sensor_rules.set_rules(load_rules(items))
+    if ALERT_WEBHOOK_URL and sensor_rules.notifier is None:
+        sensor_rules.notifier = WebhookNotifier(ALERT_WEBHOOK_URL)
+    sensor_rules.start()
+
+
+def stop_rules():
+    sensor_rules.stop()
+
+
+def save_rules(rules):
+    tmp = RULES_FILE.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump([rule.as_dict() for rule in rules], f, indent=2)
+    os.replace(tmp, RULES_FILE)
+
+
+def start_recording():
+    """Record every received serial line to a new file in SERIAL_RECORDING_DIR."""
+    if serial_ingest.recorder is None:
+        SERIAL_RECORDING_DIR.mkdir(parents=True, exist_ok=True)
+        path = SERIAL_RECORDING_DIR / time.strftime('%Y%m%d-%H%M%S.psr')
+        serial_ingest.recorder = SerialRecorder(path)
+    return serial_ingest.recorder
+
+
+def stop_recording():
+    recorder = serial_ingest.recorder
+    serial_ingest.recorder = None
+    if recorder is not None:
+        recorder.close()
+    return recorder
+
+
+def _storage_closed():
+    # create_app() without start=True registers the routes but opens no storage
+    return jsonify({'error': 'sensor storage is not running'}), 503
+
+
+def _device_sensors(device):
+    if request.method == 'POST':
+        if sensor_store is None:
+            return _storage_closed()
+        if request.mimetype == BINARY_CONTENT_TYPE:
+            try:
+                records = decode_binary(request.get_data())
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if len(records) != 1:
+                return jsonify({'error': 'expected one record; post several to the batch endpoint'}), 400
+            payload = records[0]
+        else:
+            try:
+                payload = request.get_json(force=True)
+            except Exception:
+                return jsonify({'error': 'invalid json'}), 400
+            if not isinstance(payload, dict):
+                return jsonify({'error': 'expected a json object'}), 400
+        if device is None:
+            device = request_device_id(payload)
+        if not valid_device_id(device):
+            return jsonify({'error': 'invalid device id'}), 400
+
+        record_reading(parse_payload(payload), device=device, source=request.remote_addr)
+        return jsonify({'status': 'ok'}), 200
+
+    if device is None:
+        device = request.headers.get(DEVICE_ID_HEADER) or DEFAULT_DEVICE
+    if sensor_registry.get(device) is None:
+        return jsonify({'error': f'unknown device {device}'}), 404
+
+    # Long-poll: ?since=<version>&wait=<seconds> blocks until the version moves
+    args = request.args
+    since = args.get('since', type=int) if args else None
+    wait = min(max(args.get('wait', 0.0, type=float), 0.0), LONG_POLL_MAX_WAIT) if args else 0.0
+    if since is not None and wait > 0:
+        sensor_registry.wait_for_change(device, since, wait)
+
+    state = sensor_registry.get(device)
+    version, etag, body = _cached_body(device, state)
+    headers = {'X-Sensor-Version': str(version), 'Cache-Control': 'no-cache', 'ETag': etag}
+    age = state.age()
+    if age is not None:
+        headers['X-Sensor-Age'] = f'{age:.1f}'
+    if state.is_stale(STALE_AFTER):
+        headers['X-Sensor-Stale'] = '1'
+    if since == version or etag[1:-1] in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    # GET returns latest sensor data (unchanged behavior), from the cached bytes
+    return Response(body, mimetype='application/json', headers=headers)
+
+
+def _cached_body(device, state):
+    """Serialized values of a device state; recomputed only when its version moves."""
+    cached = _response_cache.get(device)
+    if cached is None or cached[0] != state.version:
+        # States are immutable snapshots, so version and values always agree.
+        # Two requests racing here both store the same bytes.
+        body = current_app.json.response(state.values).get_data()
+        cached = (state.version, f'"{_BOOT_ID}-{device}-{state.version}"', body)
+        _response_cache[device] = cached
+    return cached
 
 @sensors_api.route('/pico/sensors', methods=['GET', 'POST'])
 def pico_sensors():
+    return _device_sensors(None)
+
+@sensors_api.route('/pico/<device>/sensors', methods=['GET', 'POST'])
+def pico_device_sensors(device):
+    return _device_sensors(device)
+
+def _device_sensors_batch(device):
+    if sensor_store is None:
+        return _storage_closed()
+    if request.mimetype == BINARY_CONTENT_TYPE:
+        body = request.get_data()
+    else:
+        try:
+            body = request.get_json(force=True)
+        except Exception:
+            return jsonify({'error': 'invalid json'}), 400
+    try:
+        if isinstance(body, bytes):
+            body = decode_binary(body)
+        body_device, readings, errors = parse_batch(body)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if device is None:
+        device = request_device_id({'device': body_device})
+    if not valid_device_id(device):
+        return jsonify({'error': 'invalid device id'}), 400
+
+    record_readings(readings, device=device, source=request.remote_addr)
+    return jsonify({'status': 'ok', 'device': device, 'accepted': len(readings),
+                    'rejected': len(errors), 'errors': errors[:MAX_BATCH_ERRORS]}), 200
+
+@sensors_api.route('/pico/sensors/batch', methods=['POST'])
+def pico_sensors_batch():
+    return _device_sensors_batch(None)
+
+@sensors_api.route('/pico/<device>/sensors/batch', methods=['POST'])
+def pico_device_sensors_batch(device):
+    return _device_sensors_batch(device)
+
+@sensors_api.route('/pico/devices', methods=['GET'])
+def pico_devices():
+    now = time.time()
+    snapshot = sensor_registry.snapshot()
+    return jsonify({'count': len(snapshot), 'stale_after': STALE_AFTER,
+                    'devices': {d: state.as_dict(now, STALE_AFTER) for d, state in snapshot.items()}})
+
+@sensors_api.route('/pico/serial', methods=['GET'])
+def pico_serial():
+    return jsonify(serial_ingest.health())
+
+@sensors_api.route('/pico/serial/recording', methods=['GET', 'POST'])
+def pico_serial_recording():
     if request.method == 'POST':
+        payload = request.get_json(force=True, silent=True)
+        if payload is None:
+            payload = {}
+        elif not isinstance(payload, dict):
+            return jsonify({'error': 'expected a json object'}), 400
+        if payload.get('enabled') is False:
+            recorder = stop_recording()
+            return jsonify({'recording': False, 'last': recorder.status() if recorder else None})
+        start_recording()
+    recorder = serial_ingest.recorder
+    return jsonify({'recording': recorder is not None,
+                    'current': recorder.status() if recorder else None})
+
+@sensors_api.route('/pico/rules', methods=['GET', 'PUT'])
+def pico_rules():
+    if request.method == 'PUT':
         try:
-            payload = request.get_json(force=True)
+            rules = load_rules(request.get_json(force=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception:
             return jsonify({'error': 'invalid json'}), 400
+        sensor_rules.set_rules(rules)
+        save_rules(rules)
+    return jsonify({'rules': [rule.as_dict() for rule in sensor_rules.rules()],
+                    'status': sensor_rules.status()})
 
-        # Update temp/humi if present
-        if 'temp' in payload:
-            try:
-                sensor_data['temp'] = float(payload['temp'])
-            except Exception:
-                pass
-        if 'humi' in payload:
-            try:
-                sensor_data['humi'] = float(payload['humi'])
-            except Exception:
-                pass
+@sensors_api.route('/pico/alerts', methods=['GET'])
+def pico_alerts():
+    limit = max(request.args.get('limit', 50, type=int), 1)
+    recent = list(sensor_rules.recent)[-limit:]
+    return jsonify({'firing': sensor_rules.firing(), 'recent': recent[::-1]})
 
-        # Accept explicit moisture (0/1)
-        if 'moisture' in payload:
-            try:
-                sensor_data['moisture'] = int(payload['moisture'])
-            except Exception:
-                pass
-        # Or accept moisture_percent and map to 0/1 using a 50% threshold
-        elif 'moisture_percent' in payload:
-            try:
-                mp = float(payload['moisture_percent'])
-                sensor_data['moisture'] = 0 if mp <= 50.0 else 1
-                # also store the raw percent for richer UI if desired
-                sensor_data['moisture_percent'] = round(mp, 1)
-            except Exception:
-                pass
+@sensors_api.route('/pico/sensors/history', methods=['GET'])
+def pico_sensors_history():
+    if sensor_store is None:
+        return _storage_closed()
+    try:
+        start = float(request.args['from']) if 'from' in request.args else None
+        end = float(request.args['to']) if 'to' in request.args else None
+        limit = min(int(request.args.get('limit', HISTORY_QUERY_LIMIT)), HISTORY_QUERY_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'from/to must be unix timestamps, limit an integer'}), 400
+    device = request.args.get('device', DEFAULT_DEVICE)
+    if request.args.get('source') == 'db':
+        readings = sensor_db.query(device, start, end, limit)
+    else:
+        readings = list(sensor_store.query(device, start, end, limit))
+    return jsonify({'device': device, 'count': len(readings), 'readings': readings})
 
-        return jsonify({'status': 'ok'}), 200
+@sensors_api.route('/pico/sensors/db', methods=['GET'])
+def pico_sensors_db():
+    if sensor_db is None:
+        return _storage_closed()
+    return jsonify(sensor_db.status())
+
+@sensors_api.route('/pico/sensors/retention', methods=['GET'])
+def pico_sensors_retention():
+    if sensor_retention is None:
+        return jsonify({'error': 'retention service is not running'}), 503
+    return jsonify(dict(sensor_retention.status(), usage_bytes=sensor_retention.usage()))
+
+@sensors_api.route('/pico/sensors/export', methods=['GET'])
+def pico_sensors_export():
+    if sensor_store is None:
+        return _storage_closed()
+    try:
+        start = float(request.args['from']) if 'from' in request.args else None
+        end = float(request.args['to']) if 'to' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'from/to must be unix timestamps'}), 400
+    fmt = request.args.get('format', 'csv')
+    devices = request.args.get('devices')
+    devices = devices.split(',') if devices else None
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else None
+    gzip = request.args.get('gzip', '0') in ('1', 'true')
+    try:
+        chunks = export(sensor_store, devices, start, end, fmt, fields, gzip)
+        # Validate the arguments now rather than halfway through the response
+        first = next(chunks, b'')
+    except ValueError as e:
+        return jsonify({'error': str(e), 'formats': list(FORMATS)}), 400
+
+    def body():
+        yield first
+        yield from chunks
+
+    mimetype = 'application/gzip' if gzip else CONTENT_TYPES[fmt]
+    return Response(body(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename(fmt, gzip)}"',
+        'Cache-Control': 'no-store',
+    })
+
+@sensors_api.route('/pico/sensors/aggregate', methods=['GET'])
+def pico_sensors_aggregate():
+    if sensor_store is None:
+        return _storage_closed()
+    try:
+        start = float(request.args['from']) if 'from' in request.args else None
+        end = float(request.args['to']) if 'to' in request.args else None
+        bucket = int(request.args.get('bucket', 3600))
+    except ValueError:
+        return jsonify({'error': 'from/to must be unix timestamps, bucket an integer'}), 400
+    if bucket <= 0:
+        return jsonify({'error': 'bucket must be a positive number of seconds'}), 400
+    if start is not None and end is not None and (end - start) / bucket > MAX_AGGREGATE_BUCKETS:
+        return jsonify({'error': f'too many buckets (max {MAX_AGGREGATE_BUCKETS})'}), 400
+    fields = [f for f in request.args.get('fields', ','.join(FIELDS)).split(',') if f]
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        return jsonify({'error': f'unknown fields: {", ".join(unknown)}'}), 400
+    device = request.args.get('device', DEFAULT_DEVICE)
+
+    resolution, buckets = sensor_rollups.aggregate(device, fields, start, end, bucket)
+    source = f'rollup_{resolution}s'
+    if resolution is None:
+        # Bucket size not a multiple of any rollup resolution: scan raw readings
+        try:
+            buckets = aggregate_readings(sensor_store.query(device, start, end, fields=fields), fields, bucket,
+                                         MAX_AGGREGATE_BUCKETS)
+        except ValueError as e:
+            return jsonify({'error': f'{e}; narrow from/to'}), 400
+        source = 'raw'
+    if len(buckets) > MAX_AGGREGATE_BUCKETS:
+        return jsonify({'error': f'too many buckets (max {MAX_AGGREGATE_BUCKETS}); narrow from/to'}), 400
+    return jsonify({'device': device, 'bucket': bucket, 'source': source,
+                    'count': len(buckets), 'buckets': buckets})
 
-    # GET returns latest sensor data (unchanged behavior)
-    return jsonify(sensor_data)
+@sensors_api.route('/pico/sensors/stream', methods=['GET'])
+def pico_sensors_stream():
+    devices = [d for d in request.args.get('device', '').split(',') if d]
+    fields = [f for f in request.args.get('fields', '').split(',') if f]
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        return jsonify({'error': f'unknown fields: {", ".join(unknown)}'}), 400
+    snapshot = lambda: {d: state.values for d, state in sensor_registry.snapshot().items()}
+    return Response(sensor_events.stream(snapshot, devices or None, fields or None),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-# Start the serial reader thread when this module is imported
-threading.Thread(target=serial_reader, daemon=True).start()
@@ -0,0 +1,452 @@
+"""
+USB serial ingestion from the Picos.
+
+Each Pico prints one CSV line per reading ("temp,humi,moisture" or
+"temp,humi"). SerialIngest reads every port from one thread with a
+selector, so tens of Picos cost one thread and no polling:
+
+- /dev/ttyACM* and /dev/ttyUSB* are rescanned every DISCOVERY_INTERVAL
+  seconds; new ports are opened and vanished ones dropped
+- a discovered port whose USB vendor id is in ALLOWED_USB_VIDS is trusted
+  straight away; one with another vendor id is left closed until it is
+  unplugged. A port without USB information (e.g. a pty, or when pyserial
+  cannot tell) is only ingested after a handshake: HANDSHAKE_LINES
+  consecutive Pico CSV lines within HANDSHAKE_TIMEOUT seconds of opening. A
+  port that misses it is closed and retried with the reconnect backoff, so a
+  slow boot or a few failed sensor reads only delay ingestion. Ports
+  configured explicitly are trusted
+- each wake-up reads whatever a port has buffered and splits it into
+  lines, keeping a partial line for the next read
+- a Pico reboot or USB unplug closes that port only; it is reopened with
+  exponential backoff while the device node exists
+- each port keeps health counters (lines/sec, parse errors, reconnects,
+  last line) for the /pico/serial endpoint
+
+Without a Pico, point it at a pseudo-terminal (os.openpty()) and write CSV
+lines to the master side; closing the master looks like an unplug.
+serial_selfcheck.py does this for partial lines, garbage, reconnects,
+several ports, hot-plug, the handshake and slow or flaky senders.
+"""
+
+import glob
+import os
+import selectors
+import threading
+import time
+
+import serial
+
+BAUDRATE = 115200
+PORT_PATTERNS = ('/dev/ttyACM*', '/dev/ttyUSB*')
+DISCOVERY_INTERVAL = 2.0      # seconds between scans for new or vanished ports
+READ_SIZE = 4096
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+MAX_LINE_LENGTH = 1024        # longer lines are garbage (e.g. wrong baud rate) and dropped
+RATE_WINDOW = 10.0            # seconds over which lines/sec is measured
+# USB vendor ids trusted without a handshake (None = any); 0x2E8A is Raspberry Pi
+ALLOWED_USB_VIDS = (0x2E8A,)
+HANDSHAKE_LINES = 3           # consecutive valid lines before a port without a USB vendor id is ingested
+HANDSHAKE_TIMEOUT = 15.0      # seconds such a port has to send them before it is closed and retried
+
+
+def usb_vendor_id(path):
+    """USB vendor id of a serial device node, or None if it has none (or it is unknown)."""
+    from serial.tools import list_ports
+
+    real = os.path.realpath(path)
+    for info in list_ports.comports():
+        if info.device in (path, real):
+            return info.vid
+    return None
+
+
+def parse_line(line):
+    """Parse a 'temp,humi[,moisture]' line into a reading dict; raises ValueError."""
+    parts = line.split(',')
+    if len(parts) == 3:
+        temp, humi, moisture = parts
+        return {'temp': float(temp), 'humi': float(humi), 'moisture': int(moisture)}
+    if len(parts) == 2:
+        temp, humi = parts
+        return {'temp': float(temp), 'humi': float(humi), 'moisture': None}
+    raise ValueError(f'expected 2 or 3 fields, got {len(parts)}')
+
+
+class LineSplitter:
+    """Turns arbitrary chunks of bytes into complete text lines."""
+
+    def __init__(self, max_length=MAX_LINE_LENGTH):
+        self.max_length = max_length
+        self._partial = b''
+        self.overflows = 0
+
+    def feed(self, data):
+        chunks = (self._partial + data).split(b'\n')
+        self._partial = chunks.pop()
+        if len(self._partial) > self.max_length:
+            self._partial = b''
+            self.overflows += 1
+        lines = []
+        for chunk in chunks:
+            if len(chunk) > self.max_length:
+                self.overflows += 1
+                continue
+            line = chunk.strip().decode('utf-8', 'replace')
+            if line:
+                lines.append(line)
+        return lines
+
+    def reset(self):
+        self._partial = b''
+
+
+class ReaderStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lines = 0
+        self.readings = 0
+        self.parse_errors = 0
+        self.bytes = 0
+        self.reconnects = 0
+        self.connected = False
+        self.connected_since = None
+        self.last_line_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self._window_start = time.monotonic()
+        self._window_lines = 0
+        self.lines_per_sec = 0.0
+
+    def count(self, nbytes, lines, readings, errors):
+        now = time.monotonic()
+        with self._lock:
+            self.bytes += nbytes
+            self.lines += lines
+            self.readings += readings
+            self.parse_errors += errors
+            self._window_lines += lines
+            if lines:
+                self.last_line_at = time.time()
+            elapsed = now - self._window_start
+            if elapsed >= RATE_WINDOW:
+                self.lines_per_sec = self._window_lines / elapsed
+                self._window_start = now
+                self._window_lines = 0
+
+    def opened(self):
+        with self._lock:
+            if self.connected_since is not None:
+                self.reconnects += 1
+            self.connected = True
+            self.connected_since = time.time()
+
+    def closed(self):
+        with self._lock:
+            self.connected = False
+
+    def error(self, message):
+        with self._lock:
+            self.last_error = message
+            self.last_error_at = time.time()
+
+    def as_dict(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._window_start
+            rate = self.lines_per_sec
+            if elapsed >= RATE_WINDOW:
+                # No data since the window closed
+                rate = self._window_lines / elapsed
+            now = time.time()
+            return {
+                'connected': self.connected,
+                'connected_since': self.connected_since,
+                'lines': self.lines,
+                'readings': self.readings,
+                'parse_errors': self.parse_errors,
+                'bytes': self.bytes,
+                'reconnects': self.reconnects,
+                'lines_per_sec': round(rate, 2),
+                'last_line_at': self.last_line_at,
+                'last_line_age_s': round(now - self.last_line_at, 3) if self.last_line_at else None,
+                'last_error': self.last_error,
+                'last_error_at': self.last_error_at,
+            }
+
+
+class SerialPort:
+    """One serial port: its connection, line buffer, backoff and health."""
+
+    def __init__(self, path, on_reading, baudrate=BAUDRATE, fixed=False):
+        self.path = path
+        self.baudrate = baudrate
+        self.on_reading = on_reading
+        self.fixed = fixed            # configured explicitly rather than discovered
+        self.trusted = fixed          # readings are delivered only once trusted
+        self.rejected = None          # why a discovered port is left closed
+        self.handshake = []           # valid readings received before the handshake completed
+        self.handshake_failures = 0
+        self.opened_at = None
+        self.present = True
+        self.serial = None
+        self.fd = None
+        self.stats = ReaderStats()
+        self.splitter = LineSplitter()
+        self.delay = RECONNECT_MIN_DELAY
+        self.next_attempt = 0.0
+        self._reported = False
+
+    def open(self):
+        try:
+            ser = serial.Serial(self.path, self.baudrate, timeout=0)
+        except (serial.SerialException, OSError) as e:
+            self.stats.error(str(e))
+            if not self._reported:
+                print(f"Serial error: {e} (retrying)")
+                self._reported = True
+            self._backoff()
+            return False
+        print(f"Serial port {self.path} open")
+        self._reported = False
+        self.serial = ser
+        self.fd = ser.fileno()
+        self.opened_at = time.monotonic()
+        self.handshake = []
+        self.splitter.reset()
+        self.stats.opened()
+        return True
+
+    def close(self, error=None):
+        if error is not None:
+            self.stats.error(error)
+            print(f"Serial port {self.path} lost: {error}")
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except Exception:
+                pass
+        self.serial = None
+        self.fd = None
+        self.stats.closed()
+        self._backoff()
+
+    def reject(self, reason):
+        """Close a discovered port that is not a Pico and leave it closed while it stays plugged in."""
+        print(f"Serial port {self.path} ignored: {reason}")
+        self.rejected = reason
+        self.handshake = []
+        if self.serial is not None:
+            self.close()
+
+    def forget(self):
+        """The device node went away: whatever appears under this path next must prove itself again."""
+        self.present = False
+        if not self.fixed:
+            self.trusted = False
+            self.rejected = None
+
+    def _backoff(self):
+        self.next_attempt = time.monotonic() + self.delay
+        self.delay = min(self.delay * 2, RECONNECT_MAX_DELAY)
+
+    def read(self, recorder=None):
+        """Read everything buffered; raises OSError when the device went away."""
+        data = os.read(self.fd, READ_SIZE)
+        if not data:
+            raise OSError('device disconnected')
+        self.handle(data, recorder)
+        if self.trusted:
+            # Only a port that delivers readings earns a quick reconnect
+            self.delay = RECONNECT_MIN_DELAY
+
+    def handle(self, data, recorder=None):
+        """Split a chunk of bytes into lines and deliver the readings."""
+        if recorder is not None:
+            # Raw bytes, so a replay goes through the splitter again
+            recorder.write_chunk(self.path, time.time(), data)
+        readings = errors = 0
+        lines = self.splitter.feed(data)
+        for line in lines:
+            try:
+                reading = parse_line(line)
+            except ValueError:
+                errors += 1
+                # The handshake needs consecutive valid lines
+                self.handshake = []
+                continue
+            if not self.trusted:
+                self.handshake.append(reading)
+                if len(self.handshake) < HANDSHAKE_LINES:
+                    continue
+                print(f"Serial port {self.path} sends Pico readings, ingesting")
+                self.trusted = True
+                pending, self.handshake = self.handshake, []
+            else:
+                pending = [reading]
+            for reading in pending:
+                readings += 1
+                try:
+                    self.on_reading(self.path, reading)
+                except Exception as e:
+                    print(f"Serial reading handler failed: {e}")
+        self.stats.count(len(data), len(lines), readings, errors)
+
+    def handshake_timed_out(self):
+        """Close a port that missed its handshake; it is retried after the reconnect backoff."""
+        self.handshake_failures += 1
+        self.handshake = []
+        self.close(f'no {HANDSHAKE_LINES} valid lines in a row within {HANDSHAKE_TIMEOUT:g} s')
+
+    def handshake_deadline(self):
+        """Monotonic time by which an open, untrusted port must complete the handshake."""
+        if self.serial is None or self.trusted:
+            return None
+        return self.opened_at + HANDSHAKE_TIMEOUT
+
+    def health(self):
+        health = self.stats.as_dict()
+        health['port'] = self.path
+        health['present'] = self.present
+        health['trusted'] = self.trusted
+        health['rejected'] = self.rejected
+        health['handshake_failures'] = self.handshake_failures
+        health['line_overflows'] = self.splitter.overflows
+        return health
+
+
+class SerialIngest:
+    """
+    Reads every serial port from a single thread.
+
+    Ports matching `patterns` are picked up when they appear and dropped
+    when they disappear; `ports` are always tried. `on_reading(port, reading)`
+    is called from the ingestion thread for every parsed line.
+    """
+
+    def __init__(self, on_reading, patterns=PORT_PATTERNS, ports=(), baudrate=BAUDRATE):
+        self.on_reading = on_reading
+        self.patterns = tuple(patterns)
+        self.fixed_ports = tuple(ports)
+        self.baudrate = baudrate
+        self._ports = {}              # path -> SerialPort
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self.wakeups = 0
+        # Optional SerialRecorder that gets every chunk read (see serial_recorder.py)
+        self.recorder = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run, name='serial-ingest', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        os.write(self._wake_w, b'x')
+        self._thread.join(timeout)
+        self._thread = None
+        for port in self.ports():
+            if port.serial is not None:
+                port.close()
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def ports(self):
+        with self._lock:
+            return list(self._ports.values())
+
+    def discover(self):
+        """Add ports that appeared and mark vanished ones as absent."""
+        found = set(self.fixed_ports)
+        for pattern in self.patterns:
+            found.update(glob.glob(pattern))
+        with self._lock:
+            new = [path for path in found
+                   if path not in self._ports or not self._ports[path].present]
+        # Outside the lock: listing USB devices reads sysfs
+        vendors = {path: usb_vendor_id(path) for path in new if path not in self.fixed_ports}
+        with self._lock:
+            for path in new:
+                port = self._ports.get(path)
+                if port is None:
+                    port = self._ports[path] = SerialPort(path, self.on_reading, self.baudrate,
+                                                          fixed=path in self.fixed_ports)
+                    print(f"Serial port {path} discovered")
+                else:
+                    port.present = True
+                    port.delay = RECONNECT_MIN_DELAY
+                    port.next_attempt = 0.0
+                vid = vendors.get(path)
+                if vid is None:
+                    continue                  # no USB information: must handshake
+                if ALLOWED_USB_VIDS is None or vid in ALLOWED_USB_VIDS:
+                    port.trusted = True
+                else:
+                    port.reject(f'USB vendor id {vid:04x} is not in ALLOWED_USB_VIDS')
+            for path, port in self._ports.items():
+                if path not in found and not port.fixed and port.present:
+                    port.forget()
+
+    def _run(self):
+        next_discovery = 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_discovery:
+                self.discover()
+                next_discovery = now + DISCOVERY_INTERVAL
+            wake_at = next_discovery
+            for port in self.ports():
+                deadline = port.handshake_deadline()
+                if deadline is not None:
+                    if now >= deadline:
+                        self._selector.unregister(port.fd)
+                        port.handshake_timed_out()
+                    else:
+                        wake_at = min(wake_at, deadline)
+                if port.serial is not None or not port.present or port.rejected:
+                    continue
+                if now >= port.next_attempt and port.open():
+                    self._selector.register(port.fd, selectors.EVENT_READ, port)
+                elif port.serial is None:
+                    wake_at = min(wake_at, port.next_attempt)
+
+            # Sleeps until a port has data, a reconnect is due or it is time to rescan
+            events = self._selector.select(max(0.0, wake_at - time.monotonic()))
+            self.wakeups += 1
+            for key, _ in events:
+                port = key.data
+                if port is None:
+                    try:
+                        os.read(self._wake_r, 64)
+                    except BlockingIOError:
+                        pass
+                    continue
+                try:
+                    port.read(self.recorder)
+                except BlockingIOError:
+                    continue
+                except (serial.SerialException, OSError) as e:
+                    self._selector.unregister(port.fd)
+                    port.close(str(e) or 'device disconnected')
+
+    def health(self):
+        ports = sorted(self.ports(), key=lambda p: p.path)
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'patterns': list(self.patterns),
+            'wakeups': self.wakeups,
+            'recording': self.recorder.path if self.recorder is not None else None,
+            'ports': [port.health() for port in ports],
+        }
@@ -0,0 +1,324 @@
+"""
+Record raw serial data from the Picos and replay it.
+
+A recording holds every chunk of bytes SerialIngest read, exactly as read
+and with the time it was read, before line splitting. Replaying it sends the
+same bytes through the LineSplitter again, so partial lines, CRLF endings,
+garbage and over-long lines seen in production can be reproduced later. The
+file is a 16-byte header (magic, version, start time) followed by records of
+
+    d  receive time (unix seconds)
+    H  port id, or 0xFFFF for a port declaration
+    H  payload length
+       payload: the raw chunk, or the port path (UTF-8) for a declaration
+
+Ports are declared once, before their first chunk, and then referred to by
+id. Files ending in .gz are gzip-compressed. Version 1 recordings held
+split lines instead of chunks; they are still read, as one chunk per line.
+
+Record from the running server with POST /pico/serial/recording, or
+straight from a port:
+
+    python serial_recorder.py record /dev/ttyACM0 capture.psr
+
+Replay through pseudo-terminals into the sensor ingestion path (serial
+reader, registry, store and rollups; history goes to a temporary directory
+unless --store is given):
+
+    python serial_recorder.py replay capture.psr --speed 1      # real time
+    python serial_recorder.py replay capture.psr --speed 10     # 10x
+    python serial_recorder.py replay capture.psr --speed max    # throughput benchmark
+
+or print the pseudo-terminal paths and only feed them (--external), for a
+server started with those paths in SERIAL_PORTS.
+"""
+
+import gzip
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+FILE_HEADER = struct.Struct('<4sHxxd')
+MAGIC = b'PSRC'
+VERSION = 2
+LINES_VERSION = 1          # earlier recordings of split lines
+RECORD = struct.Struct('<dHH')
+PORT_DECLARATION = 0xFFFF
+WRITE_BUFFER = 64 * 1024
+FLUSH_INTERVAL = 1.0       # seconds between flushes while recording
+
+
+def _open(path, mode):
+    path = str(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode, buffering=WRITE_BUFFER if 'w' in mode else -1)
+
+
+class SerialRecorder:
+    """Appends received chunks to a recording; safe to call from the ingestion thread."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._file = _open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self._ports = {}
+        self._last_flush = time.monotonic()
+        self.chunks = 0
+        self.bytes = 0
+        self.closed = False
+
+    def write_chunk(self, port, ts, data):
+        with self._lock:
+            if self.closed:
+                return
+            port_id = self._ports.get(port)
+            if port_id is None:
+                port_id = self._ports[port] = len(self._ports)
+                name = port.encode()
+                self._file.write(RECORD.pack(ts, PORT_DECLARATION, len(name)) + name)
+            # Reads are at most READ_SIZE bytes, but keep every record in range
+            for i in range(0, len(data), 0xFFFF):
+                piece = data[i:i + 0xFFFF]
+                self._file.write(RECORD.pack(ts, port_id, len(piece)) + piece)
+            self.chunks += 1
+            self.bytes += len(data)
+            if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self._file.close()
+
+    def status(self):
+        return {'path': self.path, 'chunks': self.chunks, 'bytes': self.bytes,
+                'ports': sorted(self._ports)}
+
+
+def read_recording(path):
+    """Yield (ts, port, data) for every recorded chunk."""
+    with _open(path, 'rb') as f:
+        header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError(f'{path} is not a serial recording')
+        magic, version, _ = FILE_HEADER.unpack(header)
+        if magic != MAGIC or version not in (VERSION, LINES_VERSION):
+            raise ValueError(f'{path} is not a serial recording')
+        ports = []
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return          # end of file, or a record cut off by a crash
+            ts, port_id, length = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if port_id == PORT_DECLARATION:
+                ports.append(payload.decode())
+            elif version == LINES_VERSION:
+                yield ts, ports[port_id], payload + b'\n'
+            else:
+                yield ts, ports[port_id], payload
+
+
+def recorded_lines(path):
+    """Yield (ts, port, line) by running each port's chunks through a LineSplitter."""
+    from serial_reader import LineSplitter
+
+    splitters = {}
+    for ts, port, data in read_recording(path):
+        splitter = splitters.get(port)
+        if splitter is None:
+            splitter = splitters[port] = LineSplitter()
+        for line in splitter.feed(data):
+            yield ts, port, line
+
+
+def recorded_ports(path):
+    return sorted({port for _, port, _ in read_recording(path)})
+
+
+def feed(path, masters, speed=None):
+    """
+    Write a recording to pty masters ({recorded port: fd}), chunk by chunk.
+
+    `speed` is a time multiplier (1.0 = as recorded); None replays as fast
+    as the readers drain the ptys, so chunks may then be read merged.
+    Returns (chunks, bytes) written.
+    """
+    chunks = written = 0
+    start_wall = time.perf_counter()
+    start_ts = None
+    for ts, port, data in read_recording(path):
+        if start_ts is None:
+            start_ts = ts
+        if speed:
+            delay = (ts - start_ts) / speed - (time.perf_counter() - start_wall)
+            if delay > 0:
+                time.sleep(delay)
+        fd = masters[port]
+        written += len(data)
+        while data:
+            data = data[os.write(fd, data):]
+        chunks += 1
+    return chunks, written
+
+
+def open_ptys(ports):
+    """Create one raw pseudo-terminal per recorded port; returns {port: (master, slave path, slave fd)}."""
+    import pty
+    import tty
+
+    ptys = {}
+    for port in ports:
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        ptys[port] = (master, os.ttyname(slave), slave)
+    return ptys
+
+
+def replay(path, speed=None, store_dir=None, drain_timeout=30.0):
+    """
+    Replay a recording into an in-process copy of the sensor ingestion path.
+
+    Returns a summary with the replay time and ingestion throughput.
+    """
+    import tempfile
+
+    import sensors_data_api
+    from serial_reader import SerialIngest
+
+    ports = recorded_ports(path)
+    ptys = open_ptys(ports)
+    by_slave = {slave_path: port for port, (_, slave_path, _) in ptys.items()}
+    if store_dir is None:
+        store_dir = tempfile.mkdtemp(prefix='serial-replay-')
+    sensors_data_api.start_storage(Path(store_dir) / 'sensor_history', Path(store_dir) / 'rollups',
+                                   Path(store_dir) / 'sensors.db')
+
+    def on_reading(slave_path, reading):
+        # Attribute readings to the recorded port so device ids match production
+        sensors_data_api.record_serial_reading(by_slave[slave_path], reading)
+
+    ingest = SerialIngest(on_reading, patterns=(), ports=tuple(by_slave))
+    ingest.start()
+    try:
+        deadline = time.monotonic() + 5.0
+        while not all(p['connected'] for p in ingest.health()['ports']) or len(ingest.ports()) < len(ptys):
+            if time.monotonic() > deadline:
+                raise RuntimeError('ingestion did not open the pseudo-terminals')
+            time.sleep(0.05)
+        t0 = time.perf_counter()
+        chunks, written = feed(path, {port: master for port, (master, _, _) in ptys.items()}, speed)
+        fed_s = time.perf_counter() - t0
+        deadline = time.monotonic() + drain_timeout
+        while sum(p['bytes'] for p in ingest.health()['ports']) < written:
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        total_s = time.perf_counter() - t0
+        health = ingest.health()['ports']
+    finally:
+        ingest.stop()
+        sensors_data_api.stop_storage()
+        for master, _, slave in ptys.values():
+            os.close(master)
+            os.close(slave)
+    lines = sum(p['lines'] for p in health)
+    readings = sum(p['readings'] for p in health)
+    return {
+        'recording': str(path),
+        'ports': ports,
+        'speed': speed or 'max',
+        'chunks_written': chunks,
+        'bytes_written': written,
+        'bytes_ingested': sum(p['bytes'] for p in health),
+        'lines_ingested': lines,
+        'readings': readings,
+        'parse_errors': sum(p['parse_errors'] for p in health),
+        'feed_s': round(fed_s, 3),
+        'total_s': round(total_s, 3),
+        'lines_per_sec': round(lines / total_s, 1) if total_s else None,
+        'store': str(store_dir),
+    }
+
+
+def replay_external(path, speed=None):
+    """Feed a recording into ptys read by a separately running server."""
+    ptys = open_ptys(recorded_ports(path))
+    for port, (_, slave_path, _) in ptys.items():
+        print(f"{port} -> {slave_path}")
+    input('Add these paths to SERIAL_PORTS, start the server and press Enter to replay... ')
+    try:
+        chunks, written = feed(path, {port: master for port, (master, _, _) in ptys.items()}, speed)
+        print(f"Replayed {chunks} chunks ({written} bytes)")
+    finally:
+        for master, _, slave in ptys.values():
+            os.close(master)
+            os.close(slave)
+
+
+def record(ports, path, duration=None):
+    """Record straight from serial ports without running the server."""
+    from serial_reader import SerialIngest
+
+    ingest = SerialIngest(lambda port, reading: None, patterns=(), ports=tuple(ports))
+    ingest.recorder = SerialRecorder(path)
+    ingest.start()
+    print(f"Recording {', '.join(ports)} to {path} (Ctrl+C to stop)")
+    try:
+        if duration:
+            time.sleep(duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingest.stop()
+        ingest.recorder.close()
+    print(f"Recorded {ingest.recorder.chunks} chunks ({ingest.recorder.bytes} bytes)")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Record and replay Pico serial streams')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_record = sub.add_parser('record', help='record raw data from serial ports')
+    p_record.add_argument('ports', nargs='+')
+    p_record.add_argument('output')
+    p_record.add_argument('--duration', type=float, help='seconds to record (default: until Ctrl+C)')
+    p_replay = sub.add_parser('replay', help='replay a recording through pseudo-terminals')
+    p_replay.add_argument('recording')
+    p_replay.add_argument('--speed', default='1', help="time multiplier, or 'max' (default 1)")
+    p_replay.add_argument('--store', help='directory for the replayed history (default: a temp dir)')
+    p_replay.add_argument('--external', action='store_true',
+                          help='only feed the ptys, for a separately running server')
+    p_dump = sub.add_parser('dump', help='print a recording')
+    p_dump.add_argument('recording')
+    p_dump.add_argument('--chunks', action='store_true',
+                        help='print the raw chunks instead of the lines they split into')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.ports, args.output, args.duration)
+    elif args.command == 'replay':
+        replay_speed = None if args.speed == 'max' else float(args.speed)
+        if args.external:
+            replay_external(args.recording, replay_speed)
+        else:
+            for key, value in replay(args.recording, replay_speed, args.store).items():
+                print(f"{key}: {value}")
+    elif args.chunks:
+        for chunk_ts, chunk_port, chunk in read_recording(args.recording):
+            print(f"{chunk_ts:.6f} {chunk_port} {chunk!r}")
+    else:
+        for line_ts, line_port, text in recorded_lines(args.recording):
+            print(f"{line_ts:.6f} {line_port} {text}")
@@ -0,0 +1,353 @@
+"""
+Self-check of the serial ingestion against pseudo-terminal stand-ins for Picos.
+
+Each fake Pico is a pty whose slave side is reached through a symlink, so
+an unplug (closing the master and removing the link) and a replug (a new
+pty behind the same name) look to SerialIngest like the real device node
+going away and coming back. The checks write to the master side:
+
+    partial_lines   a line split over several writes (and CRLF endings)
+                    arrives once, whole
+    garbage         non-UTF-8 bytes, malformed CSV and over-long lines are
+                    counted and skipped without losing the lines around them
+    reconnect       a Pico reboot closes the port; the reader reopens it
+                    with backoff, counts a reconnect and resumes ingestion
+    multi_port      discovered ports are read side by side, readings tagged
+                    with their port
+    hot_plug        a Pico plugged in while running is picked up, an unplug
+                    is noticed, and a replug has to handshake again
+    handshake       a port without a USB vendor id is only ingested after
+                    HANDSHAKE_LINES valid lines; one that never sends them
+                    is closed and retried, never ingested
+    slow_sender     a Pico that boots slowly, prints a banner and misses
+                    sensor reads fails its first handshake but is ingested
+                    on a later attempt
+    allow_list      a Pico vendor id is trusted without a handshake; another
+                    vendor id is never opened
+
+    python serial_selfcheck.py            # exit status 1 if a check fails
+"""
+
+import os
+import pty
+import sys
+import tempfile
+import time
+import tty
+
+import serial_reader
+from serial_reader import SerialIngest
+
+CHECK_TIMEOUT = 5.0           # seconds a check waits for ingestion to catch up
+
+
+class FakePico:
+    """A pty behind a stable path; plug()/unplug() simulate USB hot-plug."""
+
+    def __init__(self, path):
+        self.path = path
+        self.master = self.slave = None
+        self.plug()
+
+    def plug(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.symlink(os.ttyname(self.slave), self.path)
+
+    def unplug(self):
+        os.unlink(self.path)
+        os.close(self.master)
+        os.close(self.slave)
+        self.master = self.slave = None
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.master, data):]
+
+    def close(self):
+        if self.master is not None:
+            self.unplug()
+
+
+def wait_for(predicate, timeout=CHECK_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def _port_health(ingest, path):
+    for health in ingest.health()['ports']:
+        if health['port'] == path:
+            return health
+    return None
+
+
+class _Harness:
+    """One SerialIngest over fake Picos in a temporary directory."""
+
+    def __init__(self, names=('ttyACM0',), fixed=True):
+        self.dir = tempfile.mkdtemp(prefix='serial-selfcheck-')
+        self.picos = {}
+        for name in names:
+            self.add(name)
+        self.readings = []
+        paths = tuple(p.path for p in self.picos.values())
+        self.ingest = SerialIngest(lambda port, reading: self.readings.append((port, reading)),
+                                   patterns=() if fixed else (os.path.join(self.dir, 'tty*'),),
+                                   ports=paths if fixed else ())
+
+    def __enter__(self):
+        self.ingest.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.ingest.stop()
+        for pico in self.picos.values():
+            pico.close()
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+        return False
+
+    def add(self, name):
+        self.picos[name] = FakePico(os.path.join(self.dir, name))
+        return self.picos[name]
+
+    def connected(self, name):
+        health = _port_health(self.ingest, self.picos[name].path)
+        return health is not None and health['connected']
+
+    def health(self, name):
+        return _port_health(self.ingest, self.picos[name].path)
+
+
+def check_partial_lines():
+    problems = []
+    with _Harness() as h:
+        if not wait_for(lambda: h.connected('ttyACM0')):
+            return ['port never opened']
+        pico = h.picos['ttyACM0']
+        for piece in (b'21.', b'5,4', b'0,1\n22,41\r', b'\n'):
+            pico.write(piece)
+            time.sleep(0.05)       # separate reads, so the splitter sees fragments
+        wait_for(lambda: len(h.readings) >= 2)
+        got = [reading for _, reading in h.readings]
+        expected = [{'temp': 21.5, 'humi': 40.0, 'moisture': 1},
+                    {'temp': 22.0, 'humi': 41.0, 'moisture': None}]
+        if got != expected:
+            problems.append(f'expected {expected}, got {got}')
+    return problems
+
+
+def check_garbage():
+    problems = []
+    with _Harness() as h:
+        if not wait_for(lambda: h.connected('ttyACM0')):
+            return ['port never opened']
+        h.picos['ttyACM0'].write(b'\xff\xfe\x00noise\n21.5,40\n' + b'7' * 2000 + b'\n'
+                                 + b'1,2,3,4\n22,41,1\n')
+        wait_for(lambda: len(h.readings) >= 2 and h.health('ttyACM0')['parse_errors'] >= 2)
+        health = h.health('ttyACM0')
+        got = [reading for _, reading in h.readings]
+        if got != [{'temp': 21.5, 'humi': 40.0, 'moisture': None},
+                   {'temp': 22.0, 'humi': 41.0, 'moisture': 1}]:
+            problems.append(f'good lines around the garbage were not all ingested: {got}')
+        if health['parse_errors'] != 2:
+            problems.append(f"expected 2 parse errors, got {health['parse_errors']}")
+        if health['line_overflows'] != 1:
+            problems.append(f"expected 1 over-long line, got {health['line_overflows']}")
+    return problems
+
+
+def check_reconnect():
+    problems = []
+    with _Harness() as h:
+        if not wait_for(lambda: h.connected('ttyACM0')):
+            return ['port never opened']
+        pico = h.picos['ttyACM0']
+        pico.write(b'21,40\n')
+        wait_for(lambda: len(h.readings) == 1)
+        pico.unplug()
+        if not wait_for(lambda: not h.connected('ttyACM0')):
+            problems.append('unplug was not noticed')
+        pico.plug()
+        if not wait_for(lambda: h.connected('ttyACM0')):
+            return problems + ['port was not reopened after the replug']
+        pico.write(b'23,42\n')
+        wait_for(lambda: len(h.readings) == 2)
+        health = h.health('ttyACM0')
+        if [r['temp'] for _, r in h.readings] != [21.0, 23.0]:
+            problems.append(f'readings around the reconnect: {h.readings}')
+        if health['reconnects'] != 1:
+            problems.append(f"expected 1 reconnect, got {health['reconnects']}")
+    return problems
+
+
+def _handshake(pico, n=serial_reader.HANDSHAKE_LINES):
+    pico.write(b''.join(b'20,50,%d\n' % i for i in range(n)))
+
+
+def check_multi_port():
+    problems = []
+    with _Harness(('ttyACM0', 'ttyACM1', 'ttyUSB0'), fixed=False) as h:
+        if not wait_for(lambda: all(h.connected(name) for name in h.picos)):
+            return ['not every discovered port was opened']
+        for k, pico in enumerate(h.picos.values()):
+            _handshake(pico)
+            pico.write(b'%d,40\n' % (30 + k))
+        n = len(h.picos) * (serial_reader.HANDSHAKE_LINES + 1)
+        wait_for(lambda: len(h.readings) >= n)
+        for k, (name, pico) in enumerate(h.picos.items()):
+            temps = [r['temp'] for port, r in h.readings if port == pico.path]
+            if temps[-1:] != [30.0 + k]:
+                problems.append(f'{name}: readings {temps}')
+    return problems
+
+
+def check_hot_plug():
+    problems = []
+    with _Harness((), fixed=False) as h:
+        time.sleep(0.2)
+        pico = h.add('ttyACM3')
+        if not wait_for(lambda: h.connected('ttyACM3')):
+            return ['a port plugged in while running was not picked up']
+        _handshake(pico)
+        if not wait_for(lambda: len(h.readings) == serial_reader.HANDSHAKE_LINES):
+            problems.append(f'readings after the handshake: {h.readings}')
+        pico.unplug()
+        if not wait_for(lambda: not h.health('ttyACM3')['present']):
+            problems.append('unplug was not noticed')
+        pico.plug()
+        if not wait_for(lambda: h.connected('ttyACM3')):
+            return problems + ['port was not reopened after the replug']
+        if h.health('ttyACM3')['trusted']:
+            problems.append('a replugged port was trusted without a new handshake')
+        pico.write(b'25,40\n')
+        time.sleep(0.2)
+        if len(h.readings) != serial_reader.HANDSHAKE_LINES:
+            problems.append('a reading was ingested before the new handshake')
+        _handshake(pico)
+        if not wait_for(lambda: len(h.readings) == 2 * serial_reader.HANDSHAKE_LINES + 1):
+            problems.append(f'readings after the second handshake: {len(h.readings)}')
+    return problems
+
+
+def check_handshake():
+    problems = []
+    with _Harness(('ttyACM0', 'ttyUSB0'), fixed=False) as h:
+        if not wait_for(lambda: h.connected('ttyACM0') and h.connected('ttyUSB0')):
+            return ['ports never opened']
+        # Something that is not a Pico, and a Pico that was interrupted by noise
+        h.picos['ttyUSB0'].write(b'AT\r\nOK\r\n+CREG: 0,1\r\n')
+        _handshake(h.picos['ttyACM0'], serial_reader.HANDSHAKE_LINES - 1)
+        h.picos['ttyACM0'].write(b'boot: rst cause 1\n')
+        time.sleep(0.2)
+        if h.readings:
+            problems.append(f'readings before a completed handshake: {h.readings}')
+        _handshake(h.picos['ttyACM0'])
+        if not wait_for(lambda: len(h.readings) == serial_reader.HANDSHAKE_LINES):
+            problems.append(f'readings after the handshake: {h.readings}')
+        if not wait_for(lambda: h.health('ttyUSB0')['handshake_failures'] >= 1):
+            problems.append('a port without a handshake was not closed')
+        if not wait_for(lambda: h.connected('ttyUSB0')):
+            problems.append('a port that failed the handshake was not retried')
+        if h.health('ttyUSB0')['trusted'] or h.health('ttyUSB0')['rejected']:
+            problems.append('a port that failed the handshake is trusted or left closed for good')
+        if any(port == h.picos['ttyUSB0'].path for port, _ in h.readings):
+            problems.append('readings from a port that failed the handshake')
+    return problems
+
+
+def check_slow_sender():
+    problems = []
+    with _Harness(('ttyACM0',), fixed=False) as h:
+        if not wait_for(lambda: h.connected('ttyACM0')):
+            return ['port never opened']
+        pico = h.picos['ttyACM0']
+        # Boot banner, one reading, then failed sensor reads past the deadline
+        pico.write(b'MicroPython v1.22.0 on 2024-01-05; Raspberry Pi Pico\r\n21,40\n')
+        if not wait_for(lambda: h.health('ttyACM0')['handshake_failures'] >= 1):
+            return ['the first handshake did not time out']
+        # Then a reading every HANDSHAKE_TIMEOUT / 4, as a Pico does once it runs
+        deadline = time.monotonic() + CHECK_TIMEOUT
+        while not h.health('ttyACM0')['trusted'] and time.monotonic() < deadline:
+            pico.write(b'22,41\n')
+            time.sleep(serial_reader.HANDSHAKE_TIMEOUT / 4)
+        health = h.health('ttyACM0')
+        if not health['trusted'] or health['rejected']:
+            return [f'a slow Pico was never ingested: {health}']
+        pico.write(b'23,42\n')
+        if not wait_for(lambda: h.readings and h.readings[-1][1]['temp'] == 23.0):
+            problems.append(f'readings after the handshake: {h.readings}')
+    return problems
+
+
+def check_allow_list():
+    problems = []
+    real = serial_reader.usb_vendor_id
+    serial_reader.usb_vendor_id = lambda path: 0x2341 if path.endswith('ttyACM1') else 0x2E8A
+    try:
+        with _Harness(('ttyACM0', 'ttyACM1'), fixed=False) as h:
+            if not wait_for(lambda: h.connected('ttyACM0') and h.health('ttyACM1') is not None):
+                return ['ports were not discovered']
+            h.picos['ttyACM0'].write(b'21,40\n')
+            if not wait_for(lambda: len(h.readings) == 1):
+                problems.append('a port with a Pico vendor id was not trusted without a handshake')
+            time.sleep(0.2)
+            health = h.health('ttyACM1')
+            if health['connected'] or health['connected_since'] is not None:
+                problems.append('a port with a foreign USB vendor id was opened')
+            if not health['rejected']:
+                problems.append('the foreign port is not reported as rejected')
+    finally:
+        serial_reader.usb_vendor_id = real
+    return problems
+
+
+CHECKS = {
+    'partial_lines': check_partial_lines,
+    'garbage': check_garbage,
+    'reconnect': check_reconnect,
+    'multi_port': check_multi_port,
+    'hot_plug': check_hot_plug,
+    'handshake': check_handshake,
+    'slow_sender': check_slow_sender,
+    'allow_list': check_allow_list,
+}
+
+
+def run(names=None):
+    """Run the checks; returns {name: [problems]} (empty lists pass)."""
+    # Rescan and retry quickly so the checks finish in a few seconds
+    serial_reader.DISCOVERY_INTERVAL = 0.1
+    serial_reader.RECONNECT_MIN_DELAY = 0.05
+    serial_reader.HANDSHAKE_TIMEOUT = 1.0
+    results = {}
+    for name in names or CHECKS:
+        try:
+            results[name] = CHECKS[name]()
+        except Exception as e:
+            results[name] = [f'{type(e).__name__}: {e}']
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check serial ingestion against fake Picos on ptys')
+    parser.add_argument('checks', nargs='*', help=f"any of {', '.join(CHECKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = False
+    for check, found in run(args.checks).items():
+        print(f"{'ok  ' if not found else 'FAIL'} {check}")
+        for problem in found:
+            print(f"       {problem}")
+        failed = failed or bool(found)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,161 @@
+"""
+Tiled inference for high-resolution plant frames.
+
+YOLOv5 letterboxes the whole frame down to its input size, so small leaves in
+wide-angle 1080p shots shrink to a few pixels and are missed. Tiled mode cuts
+the frame into overlapping tiles at (roughly) the model's native size, runs the
+tiles as batches, shifts the detections back into frame coordinates and merges
+duplicates across tile boundaries with class-aware NMS. A leaf cut by a tile
+edge is only partly detected in that tile; its fragment overlaps the whole box
+by little IoU but lies almost entirely inside it, so boxes are also merged on
+intersection over the smaller box.
+
+Detections are plain lists: [x1, y1, x2, y2, conf, cls] in frame pixels.
+
+Benchmark single-shot vs tiled inference on a local image:
+
+    python tiled_inference.py test_images/bed.jpg --repeat 5
+"""
+
+import time
+
+import numpy as np
+
+TILE_SIZE = 640          # tile edge in pixels (YOLOv5n native input size)
+TILE_OVERLAP = 0.2       # fraction of the tile shared with its neighbour
+TILE_BATCH_SIZE = 4      # tiles per forward pass
+NMS_IOU = 0.45           # IoU above which overlapping same-class boxes are merged
+NMS_CONTAINMENT = 0.8    # share of the smaller box covered by the larger one to merge them
+INCLUDE_FULL_FRAME = True  # also run a single-shot pass so large objects are kept
+
+
+def tile_windows(height, width, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Return (x1, y1, x2, y2) windows covering the frame with the given overlap."""
+    def starts(length):
+        if length <= tile:
+            return [0]
+        stride = max(1, int(tile * (1.0 - overlap)))
+        positions = list(range(0, length - tile, stride))
+        positions.append(length - tile)  # last tile flush with the edge
+        return positions
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def nms(dets, iou_threshold=NMS_IOU, containment_threshold=NMS_CONTAINMENT):
+    """
+    Class-aware non-maximum suppression over [x1, y1, x2, y2, conf, cls] rows.
+
+    A box is dropped when a higher-scoring box of its class overlaps it by
+    more than `iou_threshold` IoU or covers more than `containment_threshold`
+    of the smaller of the two.
+    """
+    if len(dets) == 0:
+        return []
+    arr = np.asarray(dets, dtype=np.float32)
+    # Offset boxes per class so boxes of different classes never overlap
+    offsets = arr[:, 5:6] * (arr[:, :4].max() + 1.0)
+    boxes = arr[:, :4] + offsets
+    scores = arr[:, 4]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        ios = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        order = rest[(iou <= iou_threshold) & (ios <= containment_threshold)]
+    return arr[keep].tolist()
+
+
+def detect_single(model, frame):
+    """Run one full-frame forward pass and return detection rows."""
+    results = model(frame)
+    return results.xyxy[0].tolist()
+
+
+def detect_tiled(model, frame, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+                 batch_size=TILE_BATCH_SIZE, include_full_frame=INCLUDE_FULL_FRAME):
+    """
+    Run tiled inference and return (detections, info).
+
+    Tiles are grouped into batches of `batch_size` and the batches run one
+    after another: the model is not safe to call from several threads, and
+    torch already spreads each forward pass over all cores. `info` reports
+    the tile count and batches run.
+    """
+    h, w = frame.shape[:2]
+    windows = tile_windows(h, w, tile, overlap)
+    tiles = [np.ascontiguousarray(frame[y1:y2, x1:x2]) for (x1, y1, x2, y2) in windows]
+    dets = []
+    batches = 0
+    for start in range(0, len(tiles), batch_size):
+        indices = range(start, min(start + batch_size, len(tiles)))
+        results = model([tiles[i] for i in indices], size=tile)
+        batches += 1
+        for i, tile_dets in zip(indices, results.xyxy):
+            x0, y0 = windows[i][0], windows[i][1]
+            for x1, y1, x2, y2, conf, cls in tile_dets.tolist():
+                dets.append([x1 + x0, y1 + y0, x2 + x0, y2 + y0, conf, cls])
+    if include_full_frame:
+        dets.extend(detect_single(model, frame))
+    info = {'tiles': len(tiles), 'batches': batches,
+            'full_frame_pass': bool(include_full_frame)}
+    return nms(dets), info
+
+
+def benchmark(model, frame, repeat=3, **tiled_kwargs):
+    """Compare single-shot and tiled inference on one frame."""
+    def timed(fn):
+        fn()  # warm-up
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            out = fn()
+        return (time.perf_counter() - t0) / repeat, out
+
+    single_s, single_dets = timed(lambda: detect_single(model, frame))
+    tiled_s, (tiled_dets, info) = timed(lambda: detect_tiled(model, frame, **tiled_kwargs))
+    return {
+        'frame': f"{frame.shape[1]}x{frame.shape[0]}",
+        'single_ms': round(single_s * 1000, 1),
+        'single_fps': round(1.0 / single_s, 2),
+        'single_detections': len(single_dets),
+        'tiled_ms': round(tiled_s * 1000, 1),
+        'tiled_fps': round(1.0 / tiled_s, 2),
+        'tiled_detections': len(tiled_dets),
+        'slowdown': round(tiled_s / single_s, 2),
+        **info,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import cv2
+    import torch
+
+    parser = argparse.ArgumentParser(description='Benchmark single-shot vs tiled YOLOv5n inference')
+    parser.add_argument('image')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tile', type=int, default=TILE_SIZE)
+    parser.add_argument('--overlap', type=float, default=TILE_OVERLAP)
+    parser.add_argument('--batch-size', type=int, default=TILE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    frame = cv2.imread(args.image)
+    if frame is None:
+        raise SystemExit(f"Could not read {args.image}")
+    yolo = torch.hub.load('ultralytics/yolov5', 'yolov5n', pretrained=True)
+    yolo.conf = 0.3
+    report = benchmark(yolo, frame, repeat=args.repeat,
+                       tile=args.tile, overlap=args.overlap,
+                       batch_size=args.batch_size)
+    for key, value in report.items():
+        print(f"{key:>18}: {value}")
@@ -85,6 +85,9 @@ TELEMETRY_INTERVAL = getattr(device_config, 'TELEMETRY_INTERVAL', 60)
 WIFI_SSID = getattr(device_config, 'WIFI_SSID', '')
 WIFI_PASSWORD = getattr(device_config, 'WIFI_PASSWORD', '')
 TELEMETRY_URL = getattr(device_config, 'TELEMETRY_URL', 'http://<PI_IP>:5000/pico/sensors')
+# 'binary' sends a 21-byte struct record instead of JSON; only set it when the Pi
+# server accepts application/x-sensor-struct (older servers reject it)
+TELEMETRY_FORMAT = getattr(device_config, 'TELEMETRY_FORMAT', 'json')
 
 try:
     import urequests as requests
@@ -93,6 +96,17 @@ except Exception:
     requests = None
     import json
 
+try:
+    import ustruct as struct
+except Exception:
+    import struct
+
+# Binary telemetry record; must match BINARY_RECORD in pi/sensor_payloads.py:
+# version, flags, ts, temp, humi, moisture_percent, raw, bits (relay, moisture)
+TELEMETRY_CONTENT_TYPE = 'application/x-sensor-struct'
+TELEMETRY_RECORD = '<BBIfffHB'
+TELEMETRY_VERSION = 1
+
 
 class Relay:
     def __init__(self, pin_no, active_low=True):
@@ -214,15 +228,46 @@ def connect_wifi(ssid, password, timeout=15):
     return False
 
 
+def encode_telemetry(payload):
+    # Pack a telemetry dict into one binary record; absent fields are flagged
+    # off rather than sent, so the record stays a fixed 21 bytes
+    flags = 0
+    values = []
+    for i, key in enumerate(('ts', 'temp', 'humi', 'moisture_percent', 'raw')):
+        value = payload.get(key)
+        if value is not None:
+            flags |= 1 << i
+        values.append(value or 0)
+    bits = 0
+    if payload.get('relay') is not None:
+        flags |= 0x20
+        bits |= 0x1 if payload['relay'] else 0
+    if payload.get('moisture') is not None:
+        flags |= 0x40
+        bits |= 0x2 if payload['moisture'] else 0
+    ts, temp, humi, percent, raw = values
+    return struct.pack(TELEMETRY_RECORD, TELEMETRY_VERSION, flags, int(ts),
+                       temp, humi, percent, int(raw), bits)
+
+
 def send_telemetry(url, payload):
     if not url:
         return False
     if requests is None:
         return False
     try:
-        headers = {'Content-Type': 'application/json'}
-        r = requests.post(url, data=json.dumps(payload), headers=headers)
+        if TELEMETRY_FORMAT == 'binary':
+            headers = {'Content-Type': TELEMETRY_CONTENT_TYPE}
+            data = encode_telemetry(payload)
+        else:
+            headers = {'Content-Type': 'application/json'}
+            data = json.dumps(payload)
+        r = requests.post(url, data=data, headers=headers)
+        status = r.status_code
         r.close()
+        if not 200 <= status < 300:
+            print('Telemetry rejected: HTTP', status)
+            return False
         return True
     except Exception as e:
         print('Telemetry post failed:', e)
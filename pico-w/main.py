@@ -11,6 +11,7 @@ PASSWORD = 'YOUR_WIFI_PASSWORD'
 SENSOR_URL = 'http://192.168.1.120:5000/pico/sensors'  # Update with your Pi's IP if needed
 POLL_INTERVAL = 1      # Check every 1 second for faster response to moisture changes
 MAX_RETRIES = 3        # Number of retries for failed requests
+LONG_POLL_WAIT = 20    # Seconds the Pi may hold a request until data changes (0 = plain polling)
 
 # Watering safety limits (all times in seconds)
 MAX_WATERING_TIME = 10     # Maximum time pump can run continuously
@@ -26,6 +27,10 @@ last_watering_time = 0     # Track when we last watered
 watering_start_time = 0    # Track when current watering cycle started
 is_watering = False        # Track if we're currently watering
 
+# Long-poll state: last sensor version and data seen from the Pi
+sensor_version = None
+last_data = None
+
 # Connect to WiFi
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
@@ -91,8 +96,21 @@ while True:
     while retry_count < MAX_RETRIES:
         try:
             print('Fetching sensor data...')
-            response = urequests.get(SENSOR_URL)
-            data = response.json()
+            # Block on the Pi until the readings change, except while watering
+            # where the loop must keep running to enforce MAX_WATERING_TIME
+            wait = 0 if is_watering else LONG_POLL_WAIT
+            if sensor_version is not None and wait:
+                url = '{}?since={}&wait={}'.format(SENSOR_URL, sensor_version, wait)
+            else:
+                url = SENSOR_URL
+            response = urequests.get(url)
+            if response.status_code == 304 and last_data is not None:
+                data = last_data  # unchanged since last fetch
+            else:
+                data = response.json()
+                last_data = data
+            headers = getattr(response, 'headers', None) or {}
+            sensor_version = headers.get('X-Sensor-Version', sensor_version)
             print('Sensor data:', data)
             
             if 'moisture' in data: